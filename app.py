@@ -4,20 +4,31 @@
 
 from __future__ import division
 
-from flask import Flask, make_response, request, current_app, jsonify, render_template
+from flask import Flask, make_response, request, has_request_context, current_app, render_template, abort, g, stream_with_context
+from flask import json as flask_json
 from datetime import datetime, timedelta, date
 from functools import update_wrapper
-import json, os, requests, time
+import json, os, requests, time, base64, hashlib, gzip, zlib, struct, msgpack
 from flask.ext.heroku import Heroku
 from flask.ext.sqlalchemy import SQLAlchemy
 from sqlalchemy.ext.mutable import Mutable
-from sqlalchemy import types, desc
+from sqlalchemy import types, desc, func, and_, or_, case, Table, DDL, literal, select, type_coerce
+from sqlalchemy.sql import table, column, literal_column
+from sqlalchemy.event import listen
+from sqlalchemy.orm.attributes import set_committed_value, get_history, PASSIVE_NO_INITIALIZE
+from sqlalchemy.orm import class_mapper, load_only, joinedload, undefer
 from dictalchemy import make_class_dictable
-from dateutil.tz import tzoffset
+from dateutil.tz import tzoffset, tzutc
+from dateutil.parser import parse as parse_datetime
+from calendar import timegm
 from mimetypes import guess_type
 from copy import deepcopy
+from itertools import islice
+from collections import OrderedDict
 from os.path import join
-from math import ceil
+from math import ceil, floor, radians, sin, cos, asin, sqrt
+from heapq import heappush, heapreplace
+from StringIO import StringIO
 from urllib import urlencode
 from flask.ext.script import Manager
 from flask.ext.migrate import Migrate, MigrateCommand
@@ -48,13 +59,24 @@ def add_cors_header(response):
 
 app.after_request(add_cors_header)
 
+app.config.setdefault('RESPONSE_CACHE_SIZE', 500)
+app.config.setdefault('RESPONSE_CACHE_TIMEOUT', 600)
+app.config.setdefault('COMPRESS_MIN_SIZE', 500)
+app.config.setdefault('COMPRESS_LEVEL', 6)
+
 
 # -------------------
 # Types
 # -------------------
 
+class JSONB(types.UserDefinedType):
+    ''' Postgres binary JSON storage, which SQLAlchemy 0.9.3 doesn't know about.
+    '''
+    def get_col_spec(self):
+        return 'JSONB'
+
 class JsonType(Mutable, types.TypeDecorator):
-    ''' JSON wrapper type for TEXT database storage.
+    ''' JSON wrapper type for JSONB storage in Postgres, and TEXT elsewhere.
 
         References:
         http://stackoverflow.com/questions/4038314/sqlalchemy-json-as-blob-text
@@ -62,27 +84,61 @@ class JsonType(Mutable, types.TypeDecorator):
     '''
     impl = types.Unicode
 
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'postgresql':
+            return dialect.type_descriptor(JSONB())
+        else:
+            return dialect.type_descriptor(self.impl)
+
     def process_bind_param(self, value, engine):
         return unicode(json.dumps(value))
 
     def process_result_value(self, value, engine):
-        if value:
+        if not isinstance(value, basestring):
+            # psycopg2 2.5.4 and later decode JSONB by themselves
+            return value
+        elif value:
             return json.loads(value)
         else:
             # default can also be a list
             return {}
 
+def json_text(column, key):
+    ''' Return a SQL expression for the text value of a key in a JSON column.
+    '''
+    if db.engine.dialect.name == 'postgresql':
+        return type_coerce(column.op('->>')(literal(key)), types.Unicode)
+    else:
+        return func.json_extract(column, '$.' + key, type_=types.Unicode)
+
 
 # -------------------
 # Models
 # -------------------
 
+def wanted(key, fields):
+    ''' True if a dictionary key is among the fields asked for, or if all fields are.
+    '''
+    return fields is None or key in fields
+
+def columns_dict(obj, fields=None, hidden=('keep', )):
+    ''' Return the columns of a model object as a dictionary, without hidden ones.
+
+        With a collection of field names only those columns are read,
+        so columns left out of the query with load_only() stay unloaded.
+    '''
+    keys = [attr.key for attr in class_mapper(type(obj)).column_attrs
+            if attr.key not in hidden and wanted(attr.key, fields)]
+
+    return db.Model.asdict(obj, only=keys) if keys else dict()
+
 class Organization(db.Model):
     '''
         Brigades and other civic tech organizations
     '''
     #Columns
-    name = db.Column(db.Unicode(), primary_key=True)
+    id = db.Column(db.Integer(), primary_key=True)
+    name = db.Column(db.Unicode(), unique=True, index=True, nullable=False)
     website = db.Column(db.Unicode())
     events_url = db.Column(db.Unicode())
     rss = db.Column(db.Unicode())
@@ -95,6 +151,12 @@ class Organization(db.Model):
     started_on = db.Column(db.Unicode())
     keep = db.Column(db.Boolean())
 
+    # When its data last changed, see set_updated_at().
+    updated_at = db.Column(db.DateTime(), index=True)
+
+    # Name made safe for use in a URL, see organization_slug_id().
+    slug = db.Column(db.Unicode(), unique=True, index=True)
+
     # Relationships
     events = db.relationship('Event', cascade='save-update, delete')
     stories = db.relationship('Story', cascade='save-update, delete')
@@ -103,6 +165,7 @@ class Organization(db.Model):
     def __init__(self, name, website=None, events_url=None,
                  rss=None, projects_list_url=None, type=None, city=None, latitude=None, longitude=None):
         self.name = name
+        self.slug = safe_name(name)
         self.website = website
         self.events_url = events_url
         self.rss = rss
@@ -115,74 +178,47 @@ class Organization(db.Model):
         self.last_updated = time.time()
         self.started_on = str(date.today())
 
-    def current_events(self):
-        '''
-            Return the two soonest upcoming events
-        '''
-        filter_old = Event.start_time_notz >= datetime.utcnow()
-        current_events = Event.query.filter_by(organization_name=self.name)\
-            .filter(filter_old).order_by(Event.start_time_notz.asc()).limit(2).all()
-        current_events_json = [row.asdict() for row in current_events]
-        return current_events_json
-
-    def current_projects(self):
-        '''
-            Return the three most current projects
-        '''
-        current_projects = Project.query.filter_by(organization_name=self.name).order_by(desc(Project.last_updated)).limit(3)
-        current_projects_json = [project.asdict() for project in current_projects]
-        
-        return current_projects_json
-
-    def current_stories(self):
-        '''
-            Return the two most current stories
-        '''
-        current_stories = Story.query.filter_by(organization_name=self.name).limit(2).all()
-        current_stories_json = [row.asdict() for row in current_stories]
-        return current_stories_json
-
     def all_events(self):
         ''' API link to all an orgs events
         '''
         # Make a nice org name
         organization_name = safe_name(self.name)
-        return '%s://%s/api/organizations/%s/events' % (request.scheme, request.host, organization_name)
+        return '%s/api/organizations/%s/events' % (api_root(), organization_name)
 
     def upcoming_events(self):
         ''' API link to an orgs upcoming events
         '''
         # Make a nice org name
         organization_name = safe_name(self.name)
-        return '%s://%s/api/organizations/%s/upcoming_events' % (request.scheme, request.host, organization_name)
+        return '%s/api/organizations/%s/upcoming_events' % (api_root(), organization_name)
 
     def past_events(self):
         ''' API link to an orgs past events
         '''
         # Make a nice org name
         organization_name = safe_name(self.name)
-        return '%s://%s/api/organizations/%s/past_events' % (request.scheme, request.host, organization_name)
+        return '%s/api/organizations/%s/past_events' % (api_root(), organization_name)
 
     def all_projects(self):
         ''' API link to all an orgs projects
         '''
         # Make a nice org name
         organization_name = safe_name(self.name)
-        return '%s://%s/api/organizations/%s/projects' % (request.scheme, request.host, organization_name)
+        return '%s/api/organizations/%s/projects' % (api_root(), organization_name)
 
     def all_issues(self):
         '''API link to all an orgs issues
         '''
         # Make a nice org name
         organization_name = safe_name(self.name)
-        return '%s://%s/api/organizations/%s/issues' % (request.scheme, request.host, organization_name)
+        return '%s/api/organizations/%s/issues' % (api_root(), organization_name)
 
     def all_stories(self):
         ''' API link to all an orgs stories
         '''
         # Make a nice org name
         organization_name = safe_name(self.name)
-        return '%s://%s/api/organizations/%s/stories' % (request.scheme, request.host, organization_name)
+        return '%s/api/organizations/%s/stories' % (api_root(), organization_name)
 
     def api_id(self):
         ''' Return organization name made safe for use in a URL.
@@ -192,24 +228,30 @@ class Organization(db.Model):
     def api_url(self):
         ''' API link to itself
         '''
-        return '%s://%s/api/organizations/%s' % (request.scheme, request.host, self.api_id())
+        return '%s/api/organizations/%s' % (api_root(), self.api_id())
 
-    def asdict(self, include_extras=False):
+    def asdict(self, include_extras=False, extras=None, fields=None):
         ''' Return Organization as a dictionary, with some properties tweaked.
 
-            Optionally include linked projects, events, and stories.
+            Optionally include linked projects, events, and stories, and
+            counts of them. Those already loaded by the caller can be passed
+            in as extras, a dictionary keyed on current_events, current_projects,
+            current_stories and counts. Optionally limit the dictionary to some fields.
         '''
-        organization_dict = db.Model.asdict(self)
-
-        del organization_dict['keep']
+        organization_dict = columns_dict(self, fields, ('id', 'keep', 'slug', 'updated_at'))
 
         for key in ('all_events', 'all_projects', 'all_stories', 'all_issues',
                     'upcoming_events', 'past_events', 'api_url'):
-            organization_dict[key] = getattr(self, key)()
+            if wanted(key, fields):
+                organization_dict[key] = getattr(self, key)()
 
         if include_extras:
-            for key in ('current_events', 'current_projects', 'current_stories'):
-                organization_dict[key] = getattr(self, key)()
+            if extras is None:
+                extras = load_organization_extras([self.id], fields)[self.id]
+
+            for key in ORGANIZATION_EXTRAS:
+                if wanted(key, fields):
+                    organization_dict[key] = extras[key]
 
         return organization_dict
 
@@ -224,9 +266,19 @@ class Story(db.Model):
     type = db.Column(db.Unicode())
     keep = db.Column(db.Boolean())
 
+    # When its data last changed, see set_updated_at().
+    updated_at = db.Column(db.DateTime(), index=True)
+
     # Relationships
     organization = db.relationship('Organization', single_parent=True, cascade='all, delete-orphan')
-    organization_name = db.Column(db.Unicode(), db.ForeignKey('organization.name', ondelete='CASCADE'))
+    organization_id = db.Column(db.Integer(), db.ForeignKey('organization.id', ondelete='CASCADE'))
+
+    # Read from the organization, and written through set_organization_id()
+    organization_name = db.column_property(select([Organization.name]).where(Organization.id == organization_id)
+                                           .correlate_except(Organization).as_scalar())
+
+    # Stories are looked up by organization and link, see run_update.save_story_info().
+    __table_args__ = (db.Index('ix_story_organization_id_link', 'organization_id', 'link'), )
 
     def __init__(self, title=None, link=None, type=None, organization_name=None):
         self.title = title
@@ -238,23 +290,27 @@ class Story(db.Model):
     def api_url(self):
         ''' API link to itself
         '''
-        return '%s://%s/api/stories/%s' % (request.scheme, request.host, str(self.id))
+        return '%s/api/stories/%s' % (api_root(), str(self.id))
 
-    def asdict(self, include_organization=False):
+    def asdict(self, include_organization=False, fields=None):
         ''' Return Story as a dictionary, with some properties tweaked.
 
-            Optionally include linked organization.
+            Optionally include linked organization, and limit
+            the dictionary to some fields.
         '''
-        story_dict = db.Model.asdict(self)
+        story_dict = columns_dict(self, fields, ('keep', 'organization_id', 'updated_at'))
 
-        del story_dict['keep']
-        story_dict['api_url'] = self.api_url()
+        if wanted('api_url', fields):
+            story_dict['api_url'] = self.api_url()
 
-        if include_organization:
+        if include_organization and wanted('organization', fields):
             story_dict['organization'] = self.organization.asdict()
 
         return story_dict
 
+# Project columns copied out of github_details by run_update.
+GITHUB_COLUMNS = ('language', 'watchers_count', 'forks_count', 'open_issues', 'pushed_at')
+
 class Project(db.Model):
     '''
         Civic tech projects on GitHub
@@ -262,27 +318,53 @@ class Project(db.Model):
     # Columns
     id = db.Column(db.Integer(), primary_key=True)
     name = db.Column(db.Unicode())
-    code_url = db.Column(db.Unicode())
+    code_url = db.Column(db.Unicode(), index=True)
     link_url = db.Column(db.Unicode())
     description = db.Column(db.Unicode())
     type = db.Column(db.Unicode())
     categories = db.Column(db.Unicode())
-    github_details = db.Column(JsonType())
+    # Only loaded and decoded when asked for, see load_fields()
+    github_details = db.deferred(db.Column(JsonType()))
     last_updated = db.Column(db.DateTime())
     last_updated_issues = db.Column(db.Unicode())
     keep = db.Column(db.Boolean())
 
+    # When its data last changed, see set_updated_at().
+    updated_at = db.Column(db.DateTime(), index=True)
+
+    # Copies of github_details values, for filtering and sorting
+    language = db.Column(db.Unicode(), index=True)
+    watchers_count = db.Column(db.Integer(), index=True)
+    forks_count = db.Column(db.Integer(), index=True)
+    open_issues = db.Column(db.Integer(), index=True)
+    pushed_at = db.Column(db.DateTime(), index=True)
+
     # Relationships
     organization = db.relationship('Organization', single_parent=True, cascade='all, delete-orphan')
-    organization_name = db.Column(db.Unicode(), db.ForeignKey('organization.name', ondelete='CASCADE'))
+    organization_id = db.Column(db.Integer(), db.ForeignKey('organization.id', ondelete='CASCADE'))
+
+    # Read from the organization, and written through set_organization_id()
+    organization_name = db.column_property(select([Organization.name]).where(Organization.id == organization_id)
+                                           .correlate_except(Organization).as_scalar())
 
     # Issue has cascade so issues are deleted with their parent projects
     issues = db.relationship('Issue', cascade='save-update, delete')
 
+    # Projects are listed by recent updates, for everyone or for one organization,
+    # and sorted down on Github columns with missing values last, see get_projects().
+    __table_args__ = (db.Index('ix_project_last_updated', 'last_updated', 'id'),
+                      db.Index('ix_project_organization_id_last_updated', 'organization_id', 'last_updated', 'id'),
+                      db.Index('ix_project_language_desc', language.desc().nullslast(), id.desc()),
+                      db.Index('ix_project_watchers_count_desc', watchers_count.desc().nullslast(), id.desc()),
+                      db.Index('ix_project_forks_count_desc', forks_count.desc().nullslast(), id.desc()),
+                      db.Index('ix_project_open_issues_desc', open_issues.desc().nullslast(), id.desc()),
+                      db.Index('ix_project_pushed_at_desc', pushed_at.desc().nullslast(), id.desc()))
+
     def __init__(self, name, code_url=None, link_url=None,
                  description=None, type=None, categories=None,
                  github_details=None, last_updated=None, last_updated_issues=None,
-                 organization_name=None, keep=None):
+                 organization_name=None, keep=None, language=None, watchers_count=None,
+                 forks_count=None, open_issues=None, pushed_at=None):
         self.name = name
         self.code_url = code_url
         self.link_url = link_url
@@ -294,26 +376,42 @@ class Project(db.Model):
         self.last_updated_issues = last_updated_issues
         self.organization_name = organization_name
         self.keep = True
+        self.language = language
+        self.watchers_count = watchers_count
+        self.forks_count = forks_count
+        self.open_issues = open_issues
+        self.pushed_at = pushed_at
 
     def api_url(self):
         ''' API link to itself
         '''
-        return '%s://%s/api/projects/%s' % (request.scheme, request.host, str(self.id))
+        return '%s/api/projects/%s' % (api_root(), str(self.id))
 
-    def asdict(self, include_organization=False):
+    def asdict(self, include_organization=False, issues=None, include_issues=True, fields=None):
         ''' Return Project as a dictionary, with some properties tweaked.
 
-            Optionally include linked organization.
+            Optionally include linked organization. Issues already loaded
+            by the caller, e.g. with load_issues(), can be passed in to
+            save a query. Without include_issues the project is summarized
+            and its issues are never touched. Optionally limit the
+            dictionary to some fields.
         '''
-        project_dict = db.Model.asdict(self)
+        project_dict = columns_dict(self, fields, ('keep', 'organization_id', 'updated_at') + GITHUB_COLUMNS)
 
-        del project_dict['keep']
-        project_dict['api_url'] = self.api_url()
+        if wanted('api_url', fields):
+            project_dict['api_url'] = self.api_url()
 
-        if include_organization:
+        if include_organization and wanted('organization', fields):
             project_dict['organization'] = self.organization.asdict()
 
-        project_dict['issues'] = [o.asdict() for o in db.session.query(Issue).filter(Issue.project_id == project_dict['id']).all()]
+        if not include_issues or not wanted('issues', fields):
+            return project_dict
+
+        if issues is None:
+            issues = db.session.query(Issue).filter(Issue.project_id == self.id).order_by(Issue.id).all()
+            load_labels(issues)
+
+        project_dict['issues'] = [o.asdict() for o in issues]
 
         return project_dict
 
@@ -329,9 +427,12 @@ class Issue(db.Model):
     body = db.Column(db.Unicode())
     keep = db.Column(db.Boolean())
 
+    # When its data last changed, see set_updated_at().
+    updated_at = db.Column(db.DateTime(), index=True)
+
     # Relationships
     project = db.relationship('Project', single_parent=True, cascade='all, delete-orphan')
-    project_id = db.Column(db.Integer(), db.ForeignKey('project.id', ondelete='CASCADE'))
+    project_id = db.Column(db.Integer(), db.ForeignKey('project.id', ondelete='CASCADE'), index=True)
 
     labels = db.relationship('Label', cascade='save-update, delete')
 
@@ -345,26 +446,38 @@ class Issue(db.Model):
     def api_url(self):
         ''' API link to itself
         '''
-        return '%s://%s/api/issues/%s' % (request.scheme, request.host, str(self.id))
+        return '%s/api/issues/%s' % (api_root(), str(self.id))
 
-    def asdict(self, include_project=False):
+    def asdict(self, include_project=False, project=None, fields=None):
         '''
             Return issue as a dictionary with some properties tweaked
+
+            A parent project already loaded by the caller can be passed in.
+            Optionally limit the dictionary to some fields.
         '''
-        issue_dict = db.Model.asdict(self)
+        issue_dict = columns_dict(self, fields, ('keep', 'updated_at'))
 
         # TODO: Also paged_results assumes asdict takes this argument, should be checked and fixed later
         if include_project:
-            issue_dict['project'] = db.session.query(Project).filter(Project.id == self.project_id).first().asdict()
-            del issue_dict['project']['issues']
-            del issue_dict['project_id']
+            if wanted('project', fields):
+                if project is None:
+                    project = load_fields(db.session.query(Project).filter(Project.id == self.project_id), None).first()
+                issue_dict['project'] = project.asdict(include_issues=False)
+            issue_dict.pop('project_id', None)
 
-        del issue_dict['keep']
-        issue_dict['api_url'] = self.api_url()
-        issue_dict['labels'] = [l.asdict() for l in self.labels]
+        if wanted('api_url', fields):
+            issue_dict['api_url'] = self.api_url()
+
+        if wanted('labels', fields):
+            issue_dict['labels'] = [l.asdict() for l in self.labels]
 
         return issue_dict
 
+def normalize_label(name):
+    ''' Return a label name in the form used to match it.
+    '''
+    return name.strip().lower() if name is not None else None
+
 class Label(db.Model):
     '''
         Issue labels for projects on Github
@@ -372,14 +485,20 @@ class Label(db.Model):
     # Columns
     id = db.Column(db.Integer(), primary_key=True)
     name = db.Column(db.Unicode())
+    normalized_name = db.Column(db.Unicode())
     color = db.Column(db.Unicode())
     url = db.Column(db.Unicode())
 
     issue = db.relationship('Issue', single_parent=True, cascade='all, delete-orphan')
-    issue_id = db.Column(db.Integer, db.ForeignKey('issue.id', ondelete='CASCADE'))
+    issue_id = db.Column(db.Integer, db.ForeignKey('issue.id', ondelete='CASCADE'), index=True)
+
+    # Normalized names are matched exactly or by prefix, see issues_with_labels().
+    __table_args__ = (db.Index('label_normalized_name', 'normalized_name', 'issue_id',
+                               postgresql_ops={'normalized_name': 'text_pattern_ops'}), )
 
     def __init__(self, name, color, url, issue_id=None):
         self.name = name
+        self.normalized_name = normalize_label(name)
         self.color = color
         self.url = url
         self.issue_id = issue_id
@@ -390,8 +509,8 @@ class Label(db.Model):
         '''
         label_dict = db.Model.asdict(self)
 
-        del label_dict['id']
-        del label_dict['issue_id']
+        for key in ('id', 'issue_id', 'normalized_name'):
+            del label_dict[key]
 
         return label_dict
 
@@ -403,7 +522,7 @@ class Event(db.Model):
     id  = db.Column(db.Integer(), primary_key=True)
     name = db.Column(db.Unicode())
     description = db.Column(db.Unicode())
-    event_url = db.Column(db.Unicode())
+    event_url = db.Column(db.Unicode(), index=True)
     location = db.Column(db.Unicode())
     created_at = db.Column(db.Unicode())
     start_time_notz = db.Column(db.DateTime(False))
@@ -411,9 +530,20 @@ class Event(db.Model):
     utc_offset = db.Column(db.Integer())
     keep = db.Column(db.Boolean())
 
+    # When its data last changed, see set_updated_at().
+    updated_at = db.Column(db.DateTime(), index=True)
+
     # Relationships
     organization = db.relationship('Organization', single_parent=True, cascade='all, delete-orphan')
-    organization_name = db.Column(db.Unicode(), db.ForeignKey('organization.name', ondelete='CASCADE'))
+    organization_id = db.Column(db.Integer(), db.ForeignKey('organization.id', ondelete='CASCADE'))
+
+    # Read from the organization, and written through set_organization_id()
+    organization_name = db.column_property(select([Organization.name]).where(Organization.id == organization_id)
+                                           .correlate_except(Organization).as_scalar())
+
+    # Events are listed by start time, for everyone or for one organization.
+    __table_args__ = (db.Index('ix_event_start_time_notz', 'start_time_notz', 'id'),
+                      db.Index('ix_event_organization_id_start_time_notz', 'organization_id', 'start_time_notz', 'id'))
 
     def __init__(self, name, event_url, start_time_notz, created_at, utc_offset,
                  organization_name, location=None, end_time_notz=None, description=None):
@@ -451,382 +581,1779 @@ class Event(db.Model):
     def api_url(self):
         ''' API link to itself
         '''
-        return '%s://%s/api/events/%s' % (request.scheme, request.host, str(self.id))
+        return '%s/api/events/%s' % (api_root(), str(self.id))
 
-    def asdict(self, include_organization=False):
+    def asdict(self, include_organization=False, fields=None):
         ''' Return Event as a dictionary, with some properties tweaked.
 
-            Optionally include linked organization.
+            Optionally include linked organization, and limit
+            the dictionary to some fields.
         '''
-        event_dict = db.Model.asdict(self)
-
-        for key in ('keep', 'start_time_notz', 'end_time_notz', 'utc_offset'):
-            del event_dict[key]
+        hidden = ('keep', 'organization_id', 'start_time_notz', 'end_time_notz', 'utc_offset', 'updated_at')
+        event_dict = columns_dict(self, fields, hidden)
 
         for key in ('start_time', 'end_time', 'api_url'):
-            event_dict[key] = getattr(self, key)()
+            if wanted(key, fields):
+                event_dict[key] = getattr(self, key)()
 
-        if include_organization:
+        if include_organization and wanted('organization', fields):
             event_dict['organization'] = self.organization.asdict()
 
         return event_dict
 
-class Error(db.Model):
-    '''
-        Errors from run_update.py
+def set_organization_id(mapper, connection, target):
+    ''' Point a project, event or story at the organization named by its organization_name.
+
+        Objects are still made with an organization name, but stored
+        with the integer id of the organization. An organization set
+        through the relationship wins over a name. Raise ValueError
+        for a name that matches no organization.
     '''
-    # Columns
-    id  = db.Column(db.Integer(), primary_key=True)
-    error = db.Column(db.Unicode())
-    time = db.Column(db.DateTime(False))
+    added = get_history(target, 'organization_name').added
 
-# -------------------
-# API
-# -------------------
+    if get_history(target, 'organization').added:
+        return
 
-def page_info(query, page, limit):
-    ''' Return last page and offset for a query.
-    '''
-    # Get a bunch of projects.
-    total = query.count()
-    last = int(ceil(total / limit))
-    offset = (page - 1) * limit
+    if added and added[0] is not None:
+        organization = Organization.__table__
+        filter = organization.c.name == added[0]
+        organization_id = connection.execute(select([organization.c.id]).where(filter)).scalar()
 
-    return last, offset
+        if organization_id is None:
+            raise ValueError(u'No organization named "%s"' % added[0])
 
-def pages_dict(page, last, querystring):
-    ''' Return a dictionary of pages to return in API responses.
-    '''
-    url = '%s://%s%s' % (request.scheme, request.host, request.path)
+        target.organization_id = organization_id
 
-    pages = dict()
+for model in (Story, Project, Event):
+    listen(model, 'before_insert', set_organization_id)
+    listen(model, 'before_update', set_organization_id)
 
-    if page > 1:
-        pages['first'] = dict()
-        pages['prev'] = dict()
-        if 'per_page' in request.args:
-            pages['first']['per_page'] = request.args['per_page']
-            pages['prev']['per_page'] = request.args['per_page']
+def set_updated_at(mapper, connection, target):
+    ''' Stamp an organization, project, issue, event or story with the time its data changed.
 
-    if page > 2:
-        pages['prev']['page'] = page - 1
+        run_update.py rewrites every row it keeps on each run, so only
+        real changes to columns other than UNSTAMPED_COLUMNS count.
+    '''
+    changed = [attr.key for attr in mapper.column_attrs if attr.key not in UNSTAMPED_COLUMNS
+               and get_history(target, attr.key, passive=PASSIVE_NO_INITIALIZE).has_changes()]
 
-    if page < last:
-        pages['next'] = {'page': page + 1}
-        pages['last'] = {'page': last}
-        if 'per_page' in request.args:
-            pages['next']['per_page'] = request.args['per_page']
-            pages['last']['per_page'] = request.args['per_page']
+    if changed or target.updated_at is None:
+        target.updated_at = datetime.utcnow()
 
-    for key in pages:
-        if querystring != '':
-            pages[key] = '%s?%s&%s' % (url, urlencode(pages[key]), querystring) if pages[key] else url
-        else:
-            pages[key] = '%s?%s' % (url, urlencode(pages[key])) if pages[key] else url
+for model in (Organization, Story, Project, Issue, Event):
+    listen(model, 'before_insert', set_updated_at)
+    listen(model, 'before_update', set_updated_at)
 
-    return pages
+class SearchDocument(db.Model):
+    '''
+        Searchable text of a project, issue, story or event.
 
-def paged_results(query, page, per_page, querystring=''):
+        Postgres matches title and body with a full-text index;
+        SQLite keeps a matching FTS4 table up to date with triggers.
     '''
+    # Columns
+    id = db.Column(db.Integer(), primary_key=True)
+    kind = db.Column(db.Unicode())
+    title = db.Column(db.Unicode())
+    body = db.Column(db.Unicode())
+
+    # Relationships
+    project = db.relationship('Project')
+    project_id = db.Column(db.Integer(), db.ForeignKey('project.id', ondelete='CASCADE'), index=True)
+    issue = db.relationship('Issue')
+    issue_id = db.Column(db.Integer(), db.ForeignKey('issue.id', ondelete='CASCADE'), index=True)
+    story = db.relationship('Story')
+    story_id = db.Column(db.Integer(), db.ForeignKey('story.id', ondelete='CASCADE'), index=True)
+    event = db.relationship('Event')
+    event_id = db.Column(db.Integer(), db.ForeignKey('event.id', ondelete='CASCADE'), index=True)
+
+# Searchable models by kind, with the attributes used for title and body.
+SEARCH_FIELDS = dict(project=(Project, 'name', 'description'),
+                     issue=(Issue, 'title', 'body'),
+                     story=(Story, 'title', None),
+                     event=(Event, 'name', 'description'))
+
+# Text search configuration for Postgres.
+SEARCH_CONFIG = 'english'
+
+listen(SearchDocument.__table__, 'after_create',
+       DDL("CREATE INDEX search_document_text ON search_document "
+           "USING gin (to_tsvector('english', title || ' ' || body))").execute_if(dialect='postgresql'))
+
+for statement in ("CREATE VIRTUAL TABLE search_document_fts USING fts4(title, body)",
+                  "CREATE TRIGGER search_document_insert AFTER INSERT ON search_document BEGIN "
+                  "INSERT INTO search_document_fts (docid, title, body) VALUES (new.id, new.title, new.body); END",
+                  "CREATE TRIGGER search_document_update AFTER UPDATE ON search_document BEGIN "
+                  "UPDATE search_document_fts SET title = new.title, body = new.body WHERE docid = new.id; END",
+                  "CREATE TRIGGER search_document_delete AFTER DELETE ON search_document BEGIN "
+                  "DELETE FROM search_document_fts WHERE docid = old.id; END"):
+    listen(SearchDocument.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+
+listen(SearchDocument.__table__, 'after_drop',
+       DDL("DROP TABLE search_document_fts").execute_if(dialect='sqlite'))
+
+# Text columns that listings commonly filter on by substring, by model.
+# Postgres answers ILIKE '%value%' on them from trigram indexes.
+# Organization names of other models are filtered on organization.name.
+TRIGRAM_COLUMNS = {
+    Organization: ('name', 'type', 'city'),
+    Project: ('name', 'description', 'type', 'categories'),
+    Issue: ('title', 'body'),
+    Event: ('name', 'description', 'location'),
+    Story: ('title', )
+    }
+
+listen(db.metadata, 'before_create',
+       DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect='postgresql'))
+
+for (model, names) in TRIGRAM_COLUMNS.items():
+    for name in names:
+        listen(model.__table__, 'after_create',
+               DDL("CREATE INDEX %(table)s_" + name + "_trgm ON %(table)s "
+                   "USING gin (" + name + " gin_trgm_ops)").execute_if(dialect='postgresql'))
+
+def index_search_document(session, obj):
+    ''' Add or update the search document for a project, issue, story or event.
+
+        Call this after saving the object; new objects are linked
+        to their document when the session is flushed.
     '''
-    total = query.count()
-    last, offset = page_info(query, page, per_page)
-    model_dicts = [o.asdict(True) for o in query.limit(per_page).offset(offset)]
+    for (kind, (model, title_attr, body_attr)) in SEARCH_FIELDS.items():
+        if isinstance(obj, model):
+            break
+    else:
+        raise TypeError('Can not index %s for search' % type(obj).__name__)
 
-    return dict(total=total, pages=pages_dict(page, last, querystring), objects=model_dicts)
+    document = None
 
-def is_safe_name(name):
-    ''' Return True if the string is a safe name.
-    '''
-    return raw_name(safe_name(name)) == name
+    if obj.id is not None:
+        filter = getattr(SearchDocument, kind + '_id') == obj.id
+        document = session.query(SearchDocument).filter(filter).first()
 
-def safe_name(name):
-    ''' Return URL-safe organization name with spaces replaced by dashes.
+    if document is None:
+        document = SearchDocument(kind=kind)
+        setattr(document, kind, obj)
+        session.add(document)
 
-        Slashes will be removed, which is incompatible with raw_name().
-    '''
-    return name.replace(' ', '-').replace('/', '-').replace('?','-').replace('#','-')
+    document.title = getattr(obj, title_attr) or u''
+    document.body = (body_attr and getattr(obj, body_attr)) or u''
 
-def raw_name(name):
-    ''' Return raw organization name with dashes replaced by spaces.
+    return document
 
-        Also replace old-style underscores with spaces.
+def rebuild_search_index(session):
+    ''' Replace every search document with fresh ones, one statement per kind.
     '''
-    return name.replace('_', ' ').replace('-', ' ')
+    session.query(SearchDocument).delete()
 
-def get_query_params(args):
-    filters = {}
-    for key,value in args.iteritems():
-        if 'page' not in key: 
-            filters[key] = value
-    return filters, urlencode(filters)
+    for (kind, (model, title_attr, body_attr)) in SEARCH_FIELDS.items():
+        title = func.coalesce(getattr(model, title_attr), u'')
+        body = func.coalesce(getattr(model, body_attr), u'') if body_attr else literal(u'')
+        rows = select([literal(kind), model.id, title, body])
+        insert = SearchDocument.__table__.insert()
+        session.execute(insert.from_select(['kind', kind + '_id', 'title', 'body'], rows))
 
-@app.route('/api/organizations')
-@app.route('/api/organizations/<name>')
-def get_organizations(name=None):
-    ''' Regular response option for organizations.
+class Error(db.Model):
+    '''
+        Errors from run_update.py
     '''
+    # Columns
+    id  = db.Column(db.Integer(), primary_key=True)
+    error = db.Column(db.Unicode())
+    time = db.Column(db.DateTime(False))
 
-    filters = request.args
-    filters, querystring = get_query_params(request.args)
+class OrganizationSummary(db.Model):
+    '''
+        Current events, projects and stories of an organization, and counts,
+        saved by run_update.py each time it commits the organization.
 
-    if name:
-        # Get one named organization.
-        filter = Organization.name == raw_name(name)
-        org = db.session.query(Organization).filter(filter).first()
-        return jsonify(org.asdict(True))
+        Lists are saved as the API shows them, with links under SUMMARY_ROOT.
+    '''
+    # Columns
+    organization_id = db.Column(db.Integer(), db.ForeignKey('organization.id', ondelete='CASCADE'), primary_key=True)
+    current_events = db.Column(JsonType())
+    current_projects = db.Column(JsonType())
+    current_stories = db.Column(JsonType())
+    project_count = db.Column(db.Integer())
+    issue_count = db.Column(db.Integer())
+    upcoming_event_count = db.Column(db.Integer())
+    story_count = db.Column(db.Integer())
+
+    def __init__(self, organization_id, extras):
+        self.organization_id = organization_id
+        self.current_events = extras['current_events']
+        self.current_stories = extras['current_stories']
+
+        # Project update times are saved as ISO 8601 text.
+        self.current_projects = [dict(project, last_updated=project['last_updated'] and project['last_updated'].isoformat())
+                                 for project in extras['current_projects']]
+
+        counts = extras['counts']
+        self.project_count, self.issue_count = counts['projects'], counts['issues']
+        self.upcoming_event_count, self.story_count = counts['upcoming_events'], counts['stories']
 
-    # Get a bunch of organizations.
-    query = db.session.query(Organization)
+    def asdict(self):
+        ''' Return the summary as organization extras, with links under the requested host.
+        '''
+        projects = [dict(project, last_updated=project['last_updated'] and parse_datetime(project['last_updated']))
+                    for project in self.current_projects]
 
-    for attr, value in filters.iteritems():
-        query = query.filter(getattr(Organization, attr).ilike('%%%s%%' % value))
+        counts = dict(projects=self.project_count, issues=self.issue_count,
+                      upcoming_events=self.upcoming_event_count, stories=self.story_count)
 
-    response = paged_results(query, int(request.args.get('page', 1)), int(request.args.get('per_page', 10)), querystring)
+        extras = dict(current_events=self.current_events, current_projects=projects,
+                      current_stories=self.current_stories, counts=counts)
 
-    return jsonify(response)
+        return rebase_links(extras, api_root())
 
-@app.route('/api/organizations.geojson')
-def get_organizations_geojson():
-    ''' GeoJSON response option for organizations.
+class DataGeneration(db.Model):
     '''
-    geojson = dict(type='FeatureCollection', features=[])
+        Counter bumped by run_update.py each time it commits new data.
 
-    for org in db.session.query(Organization):
-        # The unique identifier of an organization.
-        id = org.api_id()
+        Cached API results are only good for the generation they were
+        made in. There is a single row, with id 1.
+    '''
+    # Columns
+    id = db.Column(db.Integer(), primary_key=True)
+    generation = db.Column(db.BigInteger())
 
-        # Pick out all the properties that aren't part of the location.
-        props = org.asdict()
+def bump_generation(session):
+    ''' Advance the data generation, inside the transaction that changes data.
 
-        # GeoJSON Point geometry, http://geojson.org/geojson-spec.html#point
-        geom = dict(type='Point', coordinates=[org.longitude, org.latitude])
+        A new counter starts from the current time in milliseconds, so that
+        a recreated database never repeats a generation already seen by a
+        running app.
+    '''
+    filter = DataGeneration.id == 1
+    bumped = session.query(DataGeneration).filter(filter)\
+        .update({'generation': DataGeneration.generation + 1}, synchronize_session=False)
 
-        feature = dict(type='Feature', id=id, properties=props, geometry=geom)
-        geojson['features'].append(feature)
+    if not bumped:
+        session.add(DataGeneration(id=1, generation=int(time.time() * 1000)))
 
-    return jsonify(geojson)
+def data_generation():
+    ''' Return the current data generation, or None if it has never been bumped.
 
-@app.route("/api/organizations/<organization_name>/events")
-def get_orgs_events(organization_name):
-    '''
-        A cleaner url for getting an organizations events
-        Better than /api/events?q={"filters":[{"name":"organization_name","op":"eq","val":"Code for San Francisco"}]}
+        The generation is read once per request.
     '''
-    # Check org name
-    organization = Organization.query.filter_by(name=raw_name(organization_name)).first()
-    if not organization:
-        return "Organization not found", 404
+    if not hasattr(g, 'data_generation'):
+        row = db.session.query(DataGeneration.generation).filter(DataGeneration.id == 1).first()
+        g.data_generation = row[0] if row else None
 
-    # Get event objects
-    query = Event.query.filter_by(organization_name=organization.name)
-    response = paged_results(query, int(request.args.get('page', 1)), int(request.args.get('per_page', 25)))
-    return jsonify(response)
+    return g.data_generation
 
-@app.route("/api/organizations/<organization_name>/upcoming_events")
-def get_upcoming_events(organization_name):
-    '''
-        Get events that occur in the future. Order asc.
-    '''
-    # Check org name
-    organization = Organization.query.filter_by(name=raw_name(organization_name)).first()
-    if not organization:
-        return "Organization not found", 404
-    # Get upcoming event objects
-    query = Event.query.filter(Event.organization_name == organization.name, Event.start_time_notz >= datetime.utcnow())
-    response = paged_results(query, int(request.args.get('page', 1)), int(request.args.get('per_page', 25)))
-    return jsonify(response)
+# -------------------
+# Compression
+# -------------------
 
-@app.route("/api/organizations/<organization_name>/past_events")
-def get_past_events(organization_name):
-    '''
-        Get events that occur in the past. Order desc.
-    '''
-    # Check org name
-    organization = Organization.query.filter_by(name=raw_name(organization_name)).first()
-    if not organization:
-        return "Organization not found", 404
-    # Get past event objects
-    query = Event.query.filter(Event.organization_name == organization.name, Event.start_time_notz < datetime.utcnow()).\
-            order_by(desc(Event.start_time_notz))
-    response = paged_results(query, int(request.args.get('page', 1)), int(request.args.get('per_page', 25)))
-    return jsonify(response)
+# Content encodings we can produce, in order of preference.
+COMPRESS_ENCODINGS = ('gzip', 'deflate')
 
-@app.route("/api/organizations/<organization_name>/stories")
-def get_orgs_stories(organization_name):
-    '''
-        A cleaner url for getting an organizations stories
+COMPRESS_MIMETYPES = ('application/json', 'application/msgpack', 'application/javascript', 'application/xml',
+                      'text/html', 'text/css', 'text/plain', 'text/xml')
+
+def accepted_encoding(size):
+    ''' Return the content encoding to use for a response body of a given size, or None.
     '''
-    # Check org name
-    organization = Organization.query.filter_by(name=raw_name(organization_name)).first()
-    if not organization:
-        return "Organization not found", 404
+    if size < current_app.config['COMPRESS_MIN_SIZE']:
+        return None
 
-    # Get story objects
-    query = Story.query.filter_by(organization_name=organization.name)
-    response = paged_results(query, int(request.args.get('page', 1)), int(request.args.get('per_page', 25)))
-    return jsonify(response)
+    return request.accept_encodings.best_match(COMPRESS_ENCODINGS)
 
-@app.route("/api/organizations/<organization_name>/projects")
-def get_orgs_projects(organization_name):
-    '''
-        A cleaner url for getting an organizations projects
+def compress(data, encoding):
+    ''' Return data compressed with gzip or deflate.
+
+        Gzip timestamps are left out so that equal data compresses equally.
     '''
-    # Check org name
-    organization = Organization.query.filter_by(name=raw_name(organization_name)).first()
-    if not organization:
-        return "Organization not found", 404
+    level = current_app.config['COMPRESS_LEVEL']
 
-    # Get project objects
-    query = Project.query.filter_by(organization_name=organization.name).order_by(desc(Project.last_updated))
-    response = paged_results(query, int(request.args.get('page', 1)), int(request.args.get('per_page', 10)))
-    return jsonify(response)
+    if encoding == 'deflate':
+        return zlib.compress(data, level)
 
-@app.route("/api/organizations/<organization_name>/issues")
-@app.route("/api/organizations/<organization_name>/issues/labels/<labels>")
-def get_orgs_issues(organization_name, labels=None):
-    ''' A clean url to get an organizations issues
-    '''
+    output = StringIO()
+    with gzip.GzipFile(fileobj=output, mode='wb', compresslevel=level, mtime=0) as gzip_file:
+        gzip_file.write(data)
 
-    # Get one named organization.
-    organization = Organization.query.filter_by(name=raw_name(organization_name)).first()
-    if not organization:
-        return "Organization not found", 404
+    return output.getvalue()
 
-    # Get that organization's projects
-    projects = Project.query.filter_by(organization_name=organization.name).all()
-    project_ids = [project.id for project in projects]
+def compress_response(response):
+    ''' Compress responses for clients that accept it.
 
-    # Get all issues belonging to these projects
-    query = Issue.query.filter(Issue.project_id.in_(project_ids))
+        API responses are compressed by the response cache instead,
+        so that each body is only compressed once per data generation.
+    '''
+    if response.status_code != 200 or response.is_streamed or response.direct_passthrough:
+        return response
 
-    if labels:
-        # Create a labels list by comma separating the argument
-        labels = labels.split(',')
+    if response.mimetype not in COMPRESS_MIMETYPES or 'Content-Encoding' in response.headers:
+        return response
 
-        # Create the filter for each label
-        labels = [Label.name.ilike('%%%s%%' % label) for label in labels]
+    data = response.get_data()
+    encoding = accepted_encoding(len(data))
+    response.vary.add('Accept-Encoding')
 
-        # Create the base query object by joining on Issue.labels
-        query = query.join(Issue.labels)
+    if encoding is not None:
+        response.set_data(compress(data, encoding))
+        response.headers['Content-Encoding'] = encoding
 
-        # Filter for issues with each individual label
-        label_queries = [query.filter(L) for L in labels]
+    return response
 
-        # Intersect filters to find issues with all labels
-        query = query.intersect(*label_queries)     
+app.after_request(compress_response)
 
-    response = paged_results(query, int(request.args.get('page', 1)), int(request.args.get('per_page', 10)))
-    return jsonify(response)
+# -------------------
+# Response cache
+# -------------------
 
-@app.route('/api/projects')
-@app.route('/api/projects/<int:id>')
-def get_projects(id=None):
-    ''' Regular response option for projects.
+# Rendered API responses for one data generation, keyed on format and URL.
+response_cache = dict(generation=None, responses=OrderedDict())
+
+# Endpoints that report live status rather than data.
+UNCACHED_ENDPOINTS = ('well_known_status', )
+
+def cacheable_request():
+    ''' True if the current request is a GET for API data.
     '''
+    if request.method != 'GET' or request.endpoint in UNCACHED_ENDPOINTS:
+        return False
 
-    filters, querystring = get_query_params(request.args)
+    return request.path.startswith('/api/')
 
-    if id:
-        # Get one named project.
-        filter = Project.id == id
-        proj = db.session.query(Project).filter(filter).first()
-        return jsonify(proj.asdict(True))
+def response_cache_key():
+    ''' Return the response cache key for the current request, or None.
 
-    # Get a bunch of projects.
-    query = db.session.query(Project)
+        Responses are only cached once there is a data generation to tie
+        them to; the cache is emptied whenever the generation changes.
+    '''
+    if not cacheable_request():
+        return None
 
-    for attr, value in filters.iteritems():
-        if 'organization' in attr:
-            org_attr = attr.split('_')[1]
-            query = query.join(Project.organization).filter(getattr(Organization, org_attr).ilike('%%%s%%' % value))
-        else:
-            query = query.filter(getattr(Project, attr).ilike('%%%s%%' % value))
+    generation = data_generation()
 
-    query = query.order_by(desc(Project.last_updated))
-    response = paged_results(query, int(request.args.get('page', 1)), int(request.args.get('per_page', 10)), querystring)
-    return jsonify(response)
+    if generation is None:
+        return None
 
-@app.route('/api/issues')
-@app.route('/api/issues/<int:id>')
-def get_issues(id=None):
-    '''Regular response option for issues.
-    '''
+    if response_cache['generation'] != generation:
+        response_cache.update(generation=generation, responses=OrderedDict())
 
-    filters = request.args
-    filters, querystring = get_query_params(request.args)
+    return response_format(), request.url
 
-    if id:
-        # Get one issue
-        filter = Issue.id == id
-        issue = db.session.query(Issue).filter(filter).first()
-        return jsonify(issue.asdict(True))
+def serve_cached_response():
+    ''' Answer a request from the response cache, if it has a fresh copy.
+    '''
+    key = response_cache_key()
+    cached = response_cache['responses'].get(key)
 
-    # Get a bunch of issues
-    query = db.session.query(Issue)
+    if cached is None:
+        return None
 
-    for attr, value in filters.iteritems():
-        if 'project' in attr:
-            proj_attr = attr.split('_')[1]
-            query = query.join(Issue.project).filter(getattr(Project, proj_attr).ilike('%%%s%%' % value))
-        else:
-            query = query.filter(getattr(Issue, attr).ilike('%%%s%%' % value))
+    if time.time() - cached['time'] > current_app.config['RESPONSE_CACHE_TIMEOUT']:
+        del response_cache['responses'][key]
+        return None
 
-    response = paged_results(query, int(request.args.get('page', 1)), int(request.args.get('per_page', 10)), querystring)
-    return jsonify(response)
+    g.cached_response = True
+    response = current_app.response_class(cached['data'], mimetype=cached['mimetype'])
 
-@app.route('/api/issues/labels/<labels>')
-def get_issues_by_labels(labels):
-    '''
-    A clean url to filter issues by a comma-separated list of labels
+    return conditional_response(response, cached)
+
+def cache_response(response):
+    ''' Tag API responses with a strong ETag, answer If-None-Match, and cache them.
     '''
+    if getattr(g, 'cached_response', False) or not cacheable_request():
+        return response
 
-    # Create a labels list by comma separating the argument
-    labels = labels.split(',')
+    if response.status_code != 200 or response.is_streamed or response.mimetype not in API_MIMETYPES:
+        return response
 
-    # Create the filter for each label
-    labels = [Label.name.ilike('%%%s%%' % label) for label in labels]
+    data = response.get_data()
+    etag = hashlib.sha1(data).hexdigest()
+    cached = dict(data=data, mimetype=response.mimetype, etag=etag, time=time.time(), encoded={})
 
-    # Create the base query object by joining on Issue.labels
-    base_query = db.session.query(Issue).join(Issue.labels)
+    key = response_cache_key()
 
-    # Filter for issues with each individual label
-    label_queries = [base_query.filter(L) for L in labels]
+    if key is not None:
+        responses = response_cache['responses']
+        responses[key] = cached
 
-    # Intersect filters to find issues with all labels
-    query = base_query.intersect(*label_queries)
+        while len(responses) > current_app.config['RESPONSE_CACHE_SIZE']:
+            responses.popitem(last=False)
 
-    # Return the paginated reponse
-    response = paged_results(query, int(request.args.get('page', 1)), int(request.args.get('per_page', 10)))
-    return jsonify(response)
+    return conditional_response(response, cached)
 
-@app.route('/api/events')
-@app.route('/api/events/<int:id>')
-def get_events(id=None):
-    ''' Regular response option for events.
+def conditional_response(response, cached):
+    ''' Compress and tag a response from a cache entry, and answer If-None-Match.
+
+        Compressed bodies are kept in the entry, one per content encoding.
+        Each encoding gets its own ETag, since the bytes differ.
     '''
+    encoding = accepted_encoding(len(cached['data']))
+    response.vary.update(('Accept', 'Accept-Encoding'))
 
-    filters = request.args
-    filters, querystring = get_query_params(request.args)
+    if encoding is None:
+        response.set_etag(cached['etag'])
 
-    if id:
-        # Get one named event.
+    else:
+        if encoding not in cached['encoded']:
+            cached['encoded'][encoding] = compress(cached['data'], encoding)
+
+        response.set_data(cached['encoded'][encoding])
+        response.headers['Content-Encoding'] = encoding
+        response.set_etag('%s-%s' % (cached['etag'], encoding))
+
+    return response.make_conditional(request)
+
+app.before_request(serve_cached_response)
+app.after_request(cache_response)
+
+# -------------------
+# API
+# -------------------
+
+# Query string arguments that control paging instead of filtering results.
+RESERVED_ARGS = ('page', 'per_page', 'cursor', 'total', 'fields', 'expand', 'pretty', 'format', 'sort')
+
+# Largest page size for paged listings; unbounded ones are streamed instead.
+MAX_PER_PAGE = 100
+
+# Rows fetched from the server-side cursor and serialized at a time when streaming.
+STREAM_BATCH_SIZE = 500
+
+# Models for bulk export, with the joins from each to its organization.
+EXPORT_MODELS = dict(organizations=Organization, projects=Project, issues=Issue, events=Event, stories=Story)
+
+# Columns that run_update.py sets on every run, which don't count as changes to a row.
+UNSTAMPED_COLUMNS = ('keep', 'last_updated', 'last_updated_issues', 'updated_at')
+
+# GeoJSON features of all organizations for one data generation and host.
+geojson_cache = dict(key=None, features=None, grid=None)
+
+# Size of the spatial grid over organization locations, in degrees.
+GEOJSON_GRID_SIZE = 1.0
+
+# K-d tree of organization locations, for the same generation and host as geojson_cache.
+kdtree_cache = dict(key=None, tree=None)
+
+# Mean radius of the Earth, in kilometers.
+EARTH_RADIUS = 6371.0
+
+# Columns that derived fields of each model are computed from, see load_fields().
+FIELD_COLUMNS = {
+    Organization: dict([(key, ('name', )) for key in ('all_events', 'all_projects', 'all_stories', 'all_issues',
+                                                      'upcoming_events', 'past_events', 'api_url')]),
+    Project: dict(organization=('organization_id', )),
+    Issue: dict(project=('project_id', )),
+    Event: dict(start_time=('start_time_notz', 'utc_offset'), end_time=('end_time_notz', 'utc_offset'),
+                organization=('organization_id', )),
+    Story: dict(organization=('organization_id', ))
+    }
+
+# Related objects that listings embed with ?expand=, by model.
+EXPANSIONS = {
+    Project: dict(organization=Project.organization),
+    Event: dict(organization=Event.organization),
+    Story: dict(organization=Story.organization)
+    }
+
+# Ways to match issues against a list of labels, see issues_with_labels().
+LABEL_MATCHES = ('all', 'any')
+
+# Attributes that listings can be filtered on, by model, with the operator
+# used when none is given. Text is matched as a substring, as it always was.
+FILTER_ATTRIBUTES = {
+    Organization: dict(name='contains', website='contains', events_url='contains', rss='contains',
+                       projects_list_url='contains', type='contains', city='contains', started_on='contains',
+                       latitude='eq', longitude='eq', last_updated='eq'),
+    Project: dict(name='contains', code_url='contains', link_url='contains', description='contains',
+                  type='contains', categories='contains', last_updated='eq',
+                  language='eq', watchers_count='eq', forks_count='eq', open_issues='eq', pushed_at='eq'),
+    Issue: dict(title='contains', html_url='contains', body='contains', project_id='eq'),
+    Event: dict(name='contains', description='contains', event_url='contains', location='contains',
+                created_at='contains'),
+    Story: dict(title='contains', link='contains', type='contains')
+    }
+
+# Parents whose attributes listings can be filtered on with a prefix, like "organization_type".
+FILTER_RELATIONS = {
+    Project: ('organization', Project.organization, Organization),
+    Issue: ('project', Issue.project, Project),
+    Event: ('organization', Event.organization, Organization),
+    Story: ('organization', Story.organization, Organization)
+    }
+
+# Filter operators, by attribute suffix like "name__prefix". Each one compiles
+# to a predicate that a B-tree index, or a trigram index for text, can answer.
+FILTER_OPERATORS = {
+    'eq': lambda column, value: column == value,
+    'in': lambda column, values: column.in_(values),
+    'gt': lambda column, value: column > value,
+    'lt': lambda column, value: column < value,
+    'prefix': lambda column, value: column.ilike(like_escape(value) + '%', escape='\\'),
+    'contains': lambda column, value: column.ilike('%' + like_escape(value) + '%', escape='\\')
+    }
+
+TEXT_OPERATORS = ('prefix', 'contains')
+
+# Totals of listing queries for one data generation, keyed on endpoint and arguments.
+count_cache = dict(generation=None, counts=dict())
+COUNT_CACHE_SIZE = 1000
+
+# Organization ids by slug for one data generation.
+slug_cache = dict(generation=None, ids=dict())
+
+# Stand-in scheme and host for links in saved organization summaries.
+SUMMARY_ROOT = 'http://summary.invalid'
+
+# Sort keys for cursor pagination, as (column, ascending) pairs.
+# Each list ends with a unique column so that keys never tie.
+ORGANIZATION_KEYS = ((Organization.name, True), )
+PROJECT_KEYS = ((Project.last_updated, False), (Project.id, False))
+ISSUE_KEYS = ((Issue.id, True), )
+EVENT_KEYS = ((Event.start_time_notz, True), (Event.id, True))
+PAST_EVENT_KEYS = ((Event.start_time_notz, False), (Event.id, False))
+STORY_KEYS = ((Story.id, True), )
+
+# Response formats, and their mimetypes in order of preference.
+API_FORMATS = ('json', 'msgpack')
+MSGPACK_MIMETYPE = 'application/msgpack'
+API_MIMETYPES = ('application/json', MSGPACK_MIMETYPE)
+
+def json_dumps(obj, pretty=False):
+    ''' Serialize API data as compact JSON, or indented if pretty.
+
+        Flask's JSON module uses simplejson and its C speedups when
+        installed, and the app's encoder takes care of datetimes.
+    '''
+    if pretty:
+        return flask_json.dumps(obj, indent=2, separators=(',', ': '))
+
+    return flask_json.dumps(obj, separators=(',', ':'))
+
+def msgpack_default(obj):
+    ''' Encode datetimes for MessagePack as timestamp extension types.
+
+        Naive datetimes are taken to be UTC. See
+        https://github.com/msgpack/msgpack/blob/master/spec.md#timestamp-extension-type
+    '''
+    if not isinstance(obj, datetime):
+        raise TypeError('Cannot serialize %r' % obj)
+
+    seconds, nanoseconds = timegm(obj.utctimetuple()), obj.microsecond * 1000
+
+    # msgpack 1.0 and later pack their own Timestamp type.
+    if hasattr(msgpack, 'Timestamp'):
+        return msgpack.Timestamp(seconds, nanoseconds)
+
+    if 0 <= seconds < 2**34:
+        data = struct.pack('>Q', nanoseconds << 34 | seconds)
+    else:
+        data = struct.pack('>Iq', nanoseconds, seconds)
+
+    # msgpack 0.6.2, pinned in requirements.txt as the last release for
+    # Python 2, has no Timestamp type. Its ExtType is a namedtuple whose
+    # __new__() only allows application codes 0 to 127, so the reserved
+    # timestamp code -1 is set with tuple.__new__(). The packer writes
+    # any ExtType's code as a signed byte without checking it again.
+    return tuple.__new__(msgpack.ExtType, (-1, data))
+
+def msgpack_dumps(obj):
+    ''' Serialize API data as MessagePack.
+    '''
+    return msgpack.packb(obj, default=msgpack_default)
+
+def response_format():
+    ''' Return the API response format for the current request, json or msgpack.
+
+        ?format= wins over the Accept header, which defaults to JSON.
+    '''
+    if request.args.get('format') in API_FORMATS:
+        return request.args['format']
+
+    if request.accept_mimetypes.best_match(API_MIMETYPES) == MSGPACK_MIMETYPE:
+        return 'msgpack'
+
+    return 'json'
+
+def api_response(obj):
+    ''' Return a JSON or MessagePack response for API data.
+
+        JSON is indented with ?pretty=1.
+    '''
+    if response_format() == 'msgpack':
+        response = current_app.response_class(msgpack_dumps(obj), mimetype=MSGPACK_MIMETYPE)
+    else:
+        pretty = request.args.get('pretty') in ('1', 'true')
+        response = current_app.response_class(json_dumps(obj, pretty), mimetype='application/json')
+
+    response.vary.add('Accept')
+
+    return response
+
+def estimated_count(query):
+    ''' Return the planner's row estimate for an unfiltered Postgres table query.
+
+        Return None when the query is filtered or joined, or when no
+        estimate is available, and the exact count is needed.
+    '''
+    if db.engine.dialect.name != 'postgresql' or query.whereclause is not None:
+        return None
+
+    froms = query.statement.froms
+    if len(froms) != 1 or not isinstance(froms[0], Table):
+        return None
+
+    estimate = db.session.execute('SELECT reltuples FROM pg_class WHERE oid = CAST(:name AS regclass)',
+                                  dict(name=froms[0].name)).scalar()
+
+    return int(estimate) if estimate >= 0 else None
+
+def count_results(query, cache=True):
+    ''' Return the total number of results for a listing query.
+
+        Totals are cached for the current data generation, keyed on the
+        endpoint and its arguments. Pass cache=False for queries that
+        depend on the time of day. With ?total=estimate, unfiltered
+        queries return an estimate from table statistics instead.
+    '''
+    if request.args.get('total') == 'estimate':
+        total = estimated_count(query)
+        if total is not None:
+            return total
+
+    generation = data_generation()
+
+    if not cache or generation is None:
+        return query.count()
+
+    if count_cache['generation'] != generation or len(count_cache['counts']) >= COUNT_CACHE_SIZE:
+        count_cache.update(generation=generation, counts=dict())
+
+    args = [(key, value) for (key, value) in request.args.items(multi=True) if key not in RESERVED_ARGS]
+    key = request.endpoint, tuple(sorted((request.view_args or {}).items())), tuple(sorted(args))
+
+    if key not in count_cache['counts']:
+        count_cache['counts'][key] = query.count()
+
+    return count_cache['counts'][key]
+
+def page_info(total, page, limit):
+    ''' Return last page and offset for a total count.
+    '''
+    last = int(ceil(total / limit))
+    offset = (page - 1) * limit
+
+    return last, offset
+
+def pages_dict(page, last, querystring, cursors=None):
+    ''' Return a dictionary of pages to return in API responses.
+
+        With cursors, a dictionary of cursor strings keyed on page name,
+        link to those pages instead of numbered ones.
+    '''
+    url = '%s://%s%s' % (request.scheme, request.host, request.path)
+
+    pages = dict()
+
+    if cursors is not None:
+        for key in cursors:
+            pages[key] = dict(cursor=cursors[key])
+            for arg in ('per_page', 'total', 'fields', 'expand', 'format', 'sort'):
+                if arg in request.args:
+                    pages[key][arg] = request.args[arg]
+
+    elif page > 1:
+        pages['first'] = dict()
+        pages['prev'] = dict()
+        if 'per_page' in request.args:
+            pages['first']['per_page'] = request.args['per_page']
+            pages['prev']['per_page'] = request.args['per_page']
+
+    if page > 2:
+        pages['prev']['page'] = page - 1
+
+    if cursors is None and page < last:
+        pages['next'] = {'page': page + 1}
+        pages['last'] = {'page': last}
+        if 'per_page' in request.args:
+            pages['next']['per_page'] = request.args['per_page']
+            pages['last']['per_page'] = request.args['per_page']
+
+    if cursors is None:
+        for arg in ('fields', 'expand', 'format', 'sort'):
+            if arg in request.args:
+                for key in pages:
+                    pages[key][arg] = request.args[arg]
+
+    for key in pages:
+        if querystring != '':
+            pages[key] = '%s?%s&%s' % (url, urlencode(pages[key]), querystring) if pages[key] else url
+        else:
+            pages[key] = '%s?%s' % (url, urlencode(pages[key])) if pages[key] else url
+
+    return pages
+
+def load_labels(issues):
+    ''' Load the labels of a list of issues with a single query.
+    '''
+    labels = dict([(issue.id, []) for issue in issues])
+
+    if labels:
+        query = db.session.query(Label).filter(Label.issue_id.in_(labels.keys())).order_by(Label.id)
+        for label in query:
+            labels[label.issue_id].append(label)
+
+    # Fill in the relationship without triggering a lazy load per issue.
+    for issue in issues:
+        set_committed_value(issue, 'labels', labels[issue.id])
+
+def load_issues(projects):
+    ''' Return a dictionary of issue lists keyed on project id.
+
+        Issues and their labels are loaded for all projects at once.
+    '''
+    issues = dict([(project.id, []) for project in projects])
+
+    if issues:
+        query = db.session.query(Issue).filter(Issue.project_id.in_(issues.keys())).order_by(Issue.id)
+        loaded_issues = query.all()
+        load_labels(loaded_issues)
+
+        for issue in loaded_issues:
+            issues[issue.project_id].append(issue)
+
+    return issues
+
+def load_projects(issues):
+    ''' Return a dictionary of the parent projects of issues, keyed on id.
+    '''
+    project_ids = set([issue.project_id for issue in issues])
+
+    if not project_ids:
+        return dict()
+
+    query = load_fields(db.session.query(Project).filter(Project.id.in_(project_ids)), None)
+    return dict([(project.id, project) for project in query])
+
+def load_first_rows(model, ids, limit, order_by, *criteria):
+    ''' Return a dictionary of the first rows of a model for each organization id.
+
+        Rows are numbered within each organization with row_number(),
+        so the rows for all organizations come back from a single query.
+    '''
+    rows = dict([(id, []) for id in ids])
+
+    if not rows:
+        return rows
+
+    row_number = func.row_number().over(partition_by=model.organization_id, order_by=order_by)
+    numbered = db.session.query(model.id, row_number.label('row_number'))\
+        .filter(model.organization_id.in_(ids), *criteria).subquery()
+
+    query = db.session.query(model).join(numbered, model.id == numbered.c.id)\
+        .filter(numbered.c.row_number <= limit).order_by(numbered.c.row_number)
+
+    for row in load_fields(query, None):
+        rows[row.organization_id].append(row)
+
+    return rows
+
+def load_current_events(ids):
+    ''' Return the two soonest upcoming events for each organization id.
+    '''
+    filter_old = Event.start_time_notz >= datetime.utcnow()
+    order_by = [Event.start_time_notz.asc(), Event.id]
+    events = load_first_rows(Event, ids, 2, order_by, filter_old)
+
+    return dict([(id, [event.asdict() for event in events[id]]) for id in events])
+
+def load_current_projects(ids):
+    ''' Return the three most current projects for each organization id.
+    '''
+    order_by = [desc(Project.last_updated), Project.id]
+    projects = load_first_rows(Project, ids, 3, order_by)
+    issues = load_issues([project for id in projects for project in projects[id]])
+
+    return dict([(id, [project.asdict(issues=issues[project.id]) for project in projects[id]])
+                 for id in projects])
+
+def load_current_stories(ids):
+    ''' Return the two most current stories for each organization id.
+    '''
+    stories = load_first_rows(Story, ids, 2, Story.id)
+
+    return dict([(id, [story.asdict() for story in stories[id]]) for id in stories])
+
+def load_counts(ids):
+    ''' Return counts of projects, issues, upcoming events and stories for each organization id.
+    '''
+    counts = dict([(id, dict(projects=0, issues=0, upcoming_events=0, stories=0)) for id in ids])
+
+    if not counts:
+        return counts
+
+    queries = dict(
+        projects=db.session.query(Project.organization_id, func.count(Project.id))
+            .filter(Project.organization_id.in_(ids)).group_by(Project.organization_id),
+        issues=db.session.query(Project.organization_id, func.count(Issue.id)).join(Issue, Issue.project_id == Project.id)
+            .filter(Project.organization_id.in_(ids)).group_by(Project.organization_id),
+        upcoming_events=db.session.query(Event.organization_id, func.count(Event.id))
+            .filter(Event.organization_id.in_(ids), Event.start_time_notz >= datetime.utcnow()).group_by(Event.organization_id),
+        stories=db.session.query(Story.organization_id, func.count(Story.id))
+            .filter(Story.organization_id.in_(ids)).group_by(Story.organization_id)
+        )
+
+    for (key, query) in queries.items():
+        for (id, count) in query:
+            counts[id][key] = count
+
+    return counts
+
+def api_root():
+    ''' Return the scheme and host that API links are made under.
+
+        Outside of a request, as when run_update.py saves organization
+        summaries, links are made under SUMMARY_ROOT.
+    '''
+    if not has_request_context():
+        return SUMMARY_ROOT
+
+    return '%s://%s' % (request.scheme, request.host)
+
+def rebase_links(value, root):
+    ''' Return a saved value with links under SUMMARY_ROOT moved under another root.
+    '''
+    if isinstance(value, dict):
+        return dict([(key, rebase_links(item, root)) for (key, item) in value.items()])
+
+    if isinstance(value, list):
+        return [rebase_links(item, root) for item in value]
+
+    if isinstance(value, basestring) and value.startswith(SUMMARY_ROOT + '/'):
+        return root + value[len(SUMMARY_ROOT):]
+
+    return value
+
+def load_summaries(ids):
+    ''' Return organization extras saved by run_update.py, keyed on organization id.
+    '''
+    if not ids:
+        return dict()
+
+    query = db.session.query(OrganizationSummary).filter(OrganizationSummary.organization_id.in_(ids))
+    return dict([(summary.organization_id, summary.asdict()) for summary in query])
+
+def load_organization_extras(ids, fields=None):
+    ''' Return current events, projects and stories, and counts, for each organization id.
+
+        Saved summaries are read with a single primary key lookup,
+        and organizations without one are loaded live.
+    '''
+    keys = [key for key in ORGANIZATION_EXTRAS if wanted(key, fields)]
+    extras = dict([(id, dict()) for id in ids])
+
+    if not keys:
+        return extras
+
+    summaries = load_summaries(ids)
+    missing = [id for id in ids if id not in summaries]
+    loaded = dict([(key, ORGANIZATION_EXTRAS[key](missing)) for key in keys])
+
+    for id in ids:
+        for key in keys:
+            extras[id][key] = summaries[id][key] if id in summaries else loaded[key][id]
+
+    return extras
+
+# Loaders of organization extras, keyed on their name in Organization.asdict().
+ORGANIZATION_EXTRAS = OrderedDict([('current_events', load_current_events), ('current_projects', load_current_projects),
+                                   ('current_stories', load_current_stories), ('counts', load_counts)])
+
+def page_dicts(objects, fields=None, expand=()):
+    ''' Return a list of dictionaries for a page of model objects.
+
+        Related rows are loaded for the whole page at once
+        and handed to each object's asdict(). With a set of
+        fields, related rows that aren't asked for are skipped.
+        Organizations are only embedded when expanded.
+    '''
+    include_organization = 'organization' in expand
+
+    if objects and isinstance(objects[0], Project):
+        issues = load_issues(objects) if wanted('issues', fields) else dict()
+        return [o.asdict(include_organization, issues=issues.get(o.id), fields=fields) for o in objects]
+
+    if objects and isinstance(objects[0], Organization):
+        extras = load_organization_extras([o.id for o in objects], fields)
+
+        return [o.asdict(True, extras=extras[o.id], fields=fields) for o in objects]
+
+    if objects and isinstance(objects[0], Issue):
+        projects = load_projects(objects) if wanted('project', fields) else dict()
+        if wanted('labels', fields):
+            load_labels(objects)
+        return [o.asdict(True, project=projects.get(o.project_id), fields=fields) for o in objects]
+
+    if objects and isinstance(objects[0], SearchDocument):
+        return search_dicts(objects, fields, expand)
+
+    return [o.asdict(include_organization, fields=fields) for o in objects]
+
+def requested_fields():
+    ''' Return the set of fields asked for with ?fields=, or None for all of them.
+    '''
+    if 'fields' not in request.args:
+        return None
+
+    return set(request.args['fields'].split(','))
+
+def requested_expansions():
+    ''' Return the set of related objects asked for with ?expand=.
+    '''
+    return set(request.args.get('expand', '').split(',')) - set([''])
+
+def load_expansions(query, expand):
+    ''' Load the related objects to expand in the same query, with a join.
+    '''
+    model = query.column_descriptions[0]['type']
+    relations = EXPANSIONS.get(model, dict())
+
+    for name in expand:
+        if name in relations:
+            query = query.options(joinedload(relations[name]))
+
+    return query
+
+def load_fields(query, fields, keys=()):
+    ''' Limit a query for model objects to the columns behind a set of fields.
+
+        Primary keys, sort keys, and the columns that requested
+        derived fields are computed from are always loaded.
+        Without fields, deferred columns are loaded too.
+    '''
+    model = query.column_descriptions[0]['type']
+    mapper = class_mapper(model)
+
+    if fields is None:
+        return query.options(*[undefer(attr.key) for attr in mapper.column_attrs if attr.deferred])
+
+    if model not in FIELD_COLUMNS:
+        return query
+    columns = set(fields)
+
+    for field in fields:
+        columns.update(FIELD_COLUMNS[model].get(field, ()))
+
+    columns.update([col.key for (col, _) in keys])
+    columns.update([col.key for col in mapper.primary_key])
+
+    return query.options(load_only(*[attr.key for attr in mapper.column_attrs if attr.key in columns]))
+
+def search_query(q):
+    ''' Return a query for search documents matching q, best matches first.
+
+        Postgres ranks documents with its full-text index. SQLite
+        matches every word with its FTS4 table, in document order.
+    '''
+    query = db.session.query(SearchDocument)
+
+    if db.engine.dialect.name == 'postgresql':
+        vector = func.to_tsvector(SEARCH_CONFIG, SearchDocument.title + u' ' + SearchDocument.body)
+        tsquery = func.plainto_tsquery(SEARCH_CONFIG, q)
+        query = query.filter(vector.op('@@')(tsquery))
+        return query.order_by(desc(func.ts_rank(vector, tsquery)), SearchDocument.id)
+
+    fts = table('search_document_fts', column('docid'))
+    words = ' '.join(['"%s"' % word.replace('"', '') for word in q.split()])
+    matches = select([fts.c.docid]).where(literal_column('search_document_fts').match(words))
+
+    return query.filter(SearchDocument.id.in_(matches)).order_by(SearchDocument.id)
+
+def search_dicts(documents, fields=None, expand=()):
+    ''' Return a list of dictionaries for a page of search documents.
+
+        Each kind of result is loaded with a single query,
+        and serialized like a page of that kind.
+    '''
+    dicts = dict()
+
+    for (kind, (model, _, _)) in SEARCH_FIELDS.items():
+        ids = [getattr(document, kind + '_id') for document in documents if document.kind == kind]
+
+        if ids:
+            query = db.session.query(model).filter(model.id.in_(ids))
+            objects = load_expansions(load_fields(query, fields), expand).all()
+            for (obj, obj_dict) in zip(objects, page_dicts(objects, fields, expand)):
+                dicts[(kind, obj.id)] = obj_dict
+
+    keys = [(document.kind, getattr(document, document.kind + '_id')) for document in documents]
+
+    return [dict(type=kind, object=dicts[(kind, id)]) for (kind, id) in keys if (kind, id) in dicts]
+
+def grid_cell(lon, lat):
+    ''' Return the spatial grid cell of a location.
+    '''
+    return int(floor(lon / GEOJSON_GRID_SIZE)), int(floor(lat / GEOJSON_GRID_SIZE))
+
+def organization_features():
+    ''' Return GeoJSON features for all organizations, and a grid index of them.
+
+        Features are built once per data generation and host, since their
+        properties include API links. The grid maps cells to feature indexes.
+    '''
+    generation = data_generation()
+    key = generation, request.url_root
+
+    if generation is not None and geojson_cache['key'] == key:
+        return geojson_cache['features'], geojson_cache['grid']
+
+    features, grid = [], dict()
+
+    for org in db.session.query(Organization).order_by(Organization.name):
+        # The unique identifier of an organization.
+        id = org.api_id()
+
+        # Pick out all the properties that aren't part of the location.
+        props = org.asdict()
+
+        # GeoJSON Point geometry, http://geojson.org/geojson-spec.html#point
+        geom = dict(type='Point', coordinates=[org.longitude, org.latitude])
+
+        if org.longitude is not None and org.latitude is not None:
+            grid.setdefault(grid_cell(org.longitude, org.latitude), []).append(len(features))
+
+        feature = dict(type='Feature', id=id, properties=props, geometry=geom)
+        features.append(feature)
+
+    if generation is not None:
+        geojson_cache.update(key=key, features=features, grid=grid)
+
+    return features, grid
+
+def features_in_bbox(features, grid, bbox):
+    ''' Return the features inside a minlon,minlat,maxlon,maxlat bounding box.
+
+        Only grid cells that overlap the box are checked. Boxes with
+        minlon greater than maxlon cross the antimeridian.
+    '''
+    minlon, minlat, maxlon, maxlat = bbox
+    ranges = [(minlon, maxlon)] if minlon <= maxlon else [(minlon, 180), (-180, maxlon)]
+    indexes = set()
+
+    for (west, east) in ranges:
+        (x1, y1), (x2, y2) = grid_cell(west, minlat), grid_cell(east, maxlat)
+
+        if (x2 - x1 + 1) * (y2 - y1 + 1) > len(grid):
+            # Big boxes: check the few occupied cells instead of every cell.
+            cells = [(x, y) for (x, y) in grid if x1 <= x <= x2 and y1 <= y <= y2]
+        else:
+            cells = [(x, y) for x in range(x1, x2 + 1) for y in range(y1, y2 + 1)]
+
+        for cell in cells:
+            for index in grid.get(cell, []):
+                lon, lat = features[index]['geometry']['coordinates']
+                if west <= lon <= east and minlat <= lat <= maxlat:
+                    indexes.add(index)
+
+    return [features[index] for index in sorted(indexes)]
+
+def unit_vector(lon, lat):
+    ''' Return a location as a point on the unit sphere.
+
+        Straight-line distances between these points sort
+        the same way as great-circle distances.
+    '''
+    lon, lat = radians(lon), radians(lat)
+    return cos(lat) * cos(lon), cos(lat) * sin(lon), sin(lat)
+
+def build_kdtree(points, depth=0):
+    ''' Return a k-d tree of (vector, index) points as nested tuples.
+    '''
+    if not points:
+        return None
+
+    axis = depth % 3
+    points = sorted(points, key=lambda point: point[0][axis])
+    middle = len(points) // 2
+
+    return (points[middle], axis, build_kdtree(points[:middle], depth + 1),
+            build_kdtree(points[middle + 1:], depth + 1))
+
+def kdtree_nearest(tree, vector, k):
+    ''' Return (squared distance, index) pairs for the k points nearest a vector.
+    '''
+    heap = []
+
+    def search(node):
+        if node is None:
+            return
+
+        (point, index), axis, left, right = node
+        distance = sum([(a - b) ** 2 for (a, b) in zip(point, vector)])
+
+        # Keep the k best as a max-heap of negated distances.
+        if len(heap) < k:
+            heappush(heap, (-distance, index))
+        elif distance < -heap[0][0]:
+            heapreplace(heap, (-distance, index))
+
+        offset = vector[axis] - point[axis]
+        near, far = (left, right) if offset < 0 else (right, left)
+        search(near)
+
+        # Only look across the splitting plane if it's closer than the worst match.
+        if len(heap) < k or offset ** 2 < -heap[0][0]:
+            search(far)
+
+    search(tree)
+
+    return sorted([(-distance, index) for (distance, index) in heap])
+
+def organization_kdtree():
+    ''' Return GeoJSON features for all organizations, and a k-d tree of them.
+
+        The tree is built once per data generation and host, like the features.
+    '''
+    features, _ = organization_features()
+    key = data_generation(), request.url_root
+
+    if key[0] is not None and kdtree_cache['key'] == key:
+        return features, kdtree_cache['tree']
+
+    points = [(unit_vector(*feature['geometry']['coordinates']), index)
+              for (index, feature) in enumerate(features)
+              if None not in feature['geometry']['coordinates']]
+
+    tree = build_kdtree(points)
+
+    if key[0] is not None:
+        kdtree_cache.update(key=key, tree=tree)
+
+    return features, tree
+
+def encode_cursor(direction, keys, row):
+    ''' Return an opaque cursor pointing before or after a row.
+    '''
+    values = [getattr(row, col.key) for (col, _) in keys]
+    values = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+
+    return base64.urlsafe_b64encode(json.dumps({direction: values}))
+
+def decode_cursor(cursor, keys):
+    ''' Return direction and key values from a cursor made by encode_cursor().
+
+        An empty cursor points at the first page.
+    '''
+    if not cursor:
+        return 'after', None
+
+    try:
+        decoded = json.loads(base64.urlsafe_b64decode(str(cursor)))
+        if not isinstance(decoded, dict) or len(decoded) != 1:
+            raise ValueError(cursor)
+
+        ((direction, values), ) = decoded.items()
+        if direction not in ('before', 'after') or not isinstance(values, list) or len(values) != len(keys):
+            raise ValueError(cursor)
+
+        for (index, (col, _)) in enumerate(keys):
+            if values[index] is not None and isinstance(col.type, types.DateTime):
+                values[index] = parse_datetime(values[index])
+
+    except (TypeError, ValueError):
+        abort(make_response('Bad cursor "%s"' % cursor, 400))
+
+    return direction, values
+
+def nulls_at_end(ascending, backward, nulls_last):
+    ''' Return True if nulls come at the end of a sort key's order.
+
+        Nulls sort last going up and first going down, as in Postgres,
+        or with nulls_last they sort last either way.
+    '''
+    if nulls_last:
+        return not backward
+
+    return ascending != backward
+
+def keyset_order(keys, backward=False, nulls_last=False):
+    ''' Return order_by clauses for sort keys, reversed if going backward.
+    '''
+    order = []
+
+    for (col, ascending) in keys:
+        clause = col.asc() if ascending != backward else col.desc()
+
+        if nulls_at_end(ascending, backward, nulls_last):
+            order.append(clause.nullslast())
+        else:
+            order.append(clause.nullsfirst())
+
+    return order
+
+def keyset_filter(keys, values, backward=False, nulls_last=False):
+    ''' Return a filter for rows sorted after key values, or before them if going backward.
+    '''
+    alternatives, equals = [], []
+
+    for ((col, ascending), value) in zip(keys, values):
+        at_end = nulls_at_end(ascending, backward, nulls_last)
+
+        if value is None:
+            beyond = None if at_end else (col != None)
+        else:
+            beyond = (col > value) if ascending != backward else (col < value)
+            beyond = (beyond | (col == None)) if at_end else beyond
+
+        if beyond is not None:
+            alternatives.append(and_(*(equals + [beyond])))
+
+        equals.append(col == value)
+
+    return or_(*alternatives)
+
+def keyset_results(query, keys, per_page, cursor, querystring='', cache_count=True, fields=None, expand=(), nulls_last=False):
+    ''' Return a page of results following a cursor instead of a page number.
+
+        Deep pages are as cheap as the first one because rows are found
+        by their sort keys rather than by counting past an offset.
+        The total count is only included on request.
+    '''
+    direction, values = decode_cursor(cursor, keys)
+    backward = direction == 'before'
+    total_query = query
+
+    if values is not None:
+        query = query.filter(keyset_filter(keys, values, backward, nulls_last))
+
+    query = query.order_by(None).order_by(*keyset_order(keys, backward, nulls_last))
+    objects = load_expansions(load_fields(query, fields, keys), expand).limit(per_page + 1).all()
+    more = len(objects) > per_page
+    objects = objects[:per_page]
+
+    if backward:
+        objects.reverse()
+
+    cursors = dict(first='')
+
+    if objects and (more or backward):
+        cursors['next'] = encode_cursor('after', keys, objects[-1])
+
+    if objects and values is not None and (more or not backward):
+        cursors['prev'] = encode_cursor('before', keys, objects[0])
+
+    response = dict(pages=pages_dict(None, None, querystring, cursors), objects=page_dicts(objects, fields, expand))
+
+    if request.args.get('total'):
+        response['total'] = count_results(total_query, cache_count)
+
+    return response
+
+def paged_results(query, page, per_page, querystring='', keys=None, cache_count=True, nulls_last=False):
+    ''' Return a page of results with links to other pages.
+
+        With sort keys, an optional cursor argument asks for keyset
+        pagination instead of numbered pages, with nulls sorted as in
+        keyset_order(). The total is counted
+        once, see count_results(). Pages hold at most MAX_PER_PAGE results,
+        with only the fields asked for and related objects expanded.
+    '''
+    per_page = max(1, min(per_page, MAX_PER_PAGE))
+    fields, expand = requested_fields(), requested_expansions()
+
+    if keys is not None and 'cursor' in request.args:
+        return keyset_results(query, keys, per_page, request.args['cursor'], querystring, cache_count, fields, expand, nulls_last)
+
+    total = count_results(query, cache_count)
+    last, offset = page_info(total, page, per_page)
+    objects = load_expansions(load_fields(query, fields), expand).limit(per_page).offset(offset).all()
+    model_dicts = page_dicts(objects, fields, expand)
+
+    return dict(total=total, pages=pages_dict(page, last, querystring), objects=model_dicts)
+
+def issues_with_labels(query, labels, match):
+    ''' Filter an issue query by a comma-separated list of label names.
+
+        Each name matches labels that are equal to it or start with it,
+        ignoring case. With match "all", issues need a label for every
+        name; with match "any", one is enough. All names are checked
+        in a single grouped query over the label index.
+    '''
+    names = [normalize_label(name) for name in labels.split(',') if name.strip()]
+    conditions = [Label.normalized_name.like(like_escape(name) + '%', escape='\\') for name in names]
+
+    matching = db.session.query(Label.issue_id).filter(or_(*conditions))
+
+    if match == 'all' and len(conditions) > 1:
+        matched = [func.max(case([(condition, 1)], else_=0)) == 1 for condition in conditions]
+        matching = matching.group_by(Label.issue_id).having(and_(*matched))
+
+    return query.filter(Issue.id.in_(matching))
+
+def streamed_dicts(query, fields=None, expand=()):
+    ''' Generate a dictionary for every result of a query.
+
+        Rows come from a server-side cursor and are serialized a batch at
+        a time, so memory use stays flat however many results there are.
+    '''
+    query = load_expansions(load_fields(query, fields), expand)
+    rows = iter(query.execution_options(stream_results=True).yield_per(STREAM_BATCH_SIZE))
+    batch = list(islice(rows, STREAM_BATCH_SIZE))
+
+    while batch:
+        for obj_dict in page_dicts(batch, fields, expand):
+            yield obj_dict
+
+        batch = list(islice(rows, STREAM_BATCH_SIZE))
+
+def streamed_results(query):
+    ''' Return a streaming JSON response with every result of a query.
+
+        The total follows the objects, once they have all been counted.
+    '''
+    fields, expand = requested_fields(), requested_expansions()
+
+    def generate():
+        total = 0
+
+        yield '{"objects": ['
+
+        for obj_dict in streamed_dicts(query, fields, expand):
+            yield (',\n' if total else '\n') + json_dumps(obj_dict)
+            total += 1
+
+        yield '\n], "total": %d}\n' % total
+
+    return current_app.response_class(stream_with_context(generate()), mimetype='application/json')
+
+def like_escape(value):
+    ''' Escape LIKE wildcards in a string, so that it matches literally.
+    '''
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def filter_column(model, name):
+    ''' Return a filterable column of a model, its default operator, and a relation to join.
+
+        Return None for the column if the name isn't filterable.
+    '''
+    if name in FILTER_ATTRIBUTES[model]:
+        return getattr(model, name), FILTER_ATTRIBUTES[model][name], None
+
+    if model is Project and name.startswith('github_details.'):
+        return json_text(Project.github_details, name.split('.', 1)[1]), 'contains', None
+
+    if model in FILTER_RELATIONS:
+        prefix, relation, parent = FILTER_RELATIONS[model]
+        parent_name = name[len(prefix) + 1:]
+
+        if name.startswith(prefix + '_') and parent_name in FILTER_ATTRIBUTES[parent]:
+            return getattr(parent, parent_name), FILTER_ATTRIBUTES[parent][parent_name], relation
+
+    return None, None, None
+
+def filter_value(column, value):
+    ''' Convert a filter argument to the type of a column.
+
+        Raise ValueError or TypeError for values that don't fit.
+    '''
+    if isinstance(column.type, types.Integer):
+        return int(value)
+    elif isinstance(column.type, types.Float):
+        return float(value)
+    elif isinstance(column.type, types.DateTime):
+        value = parse_datetime(value)
+        if value.tzinfo is not None:
+            value = value.astimezone(tzutc()).replace(tzinfo=None)
+        return value
+    else:
+        return value
+
+def filter_query(query, model, filters):
+    ''' Filter a listing query by arguments like "name__prefix=Code".
+
+        Attribute names must be listed in FILTER_ATTRIBUTES, or name
+        a parent's attribute with a prefix from FILTER_RELATIONS.
+        Operators come from FILTER_OPERATORS; "in" takes a comma-separated list.
+    '''
+    joined = set()
+
+    for attr, value in filters.iteritems():
+        name, _, op = attr.partition('__')
+        column, default_op, relation = filter_column(model, name)
+        op = op or default_op
+
+        if column is None or op not in FILTER_OPERATORS:
+            abort(make_response('Unknown filter "%s"' % attr, 400))
+
+        if op in TEXT_OPERATORS and not isinstance(column.type, types.String):
+            abort(make_response('Filter "%s" only works on text' % attr, 400))
+
+        try:
+            if op == 'in':
+                value = [filter_value(column, item) for item in value.split(',')]
+            else:
+                value = filter_value(column, value)
+        except (TypeError, ValueError):
+            abort(make_response('Bad value "%s" for %s' % (value, attr), 400))
+
+        if relation is not None and relation not in joined:
+            query = query.join(relation)
+            joined.add(relation)
+
+        query = query.filter(FILTER_OPERATORS[op](column, value))
+
+    return query
+
+def project_sort_keys():
+    ''' Return sort keys for projects from the sort argument, like "-watchers_count".
+
+        Projects can be sorted on Github columns, up or down with a
+        leading "-", and by recent updates otherwise. Projects without
+        a value for the column come last either way.
+    '''
+    sort = request.args.get('sort')
+
+    if not sort:
+        return PROJECT_KEYS
+
+    name, ascending = (sort[1:], False) if sort.startswith('-') else (sort, True)
+
+    if name not in GITHUB_COLUMNS:
+        abort(make_response('Unknown sort "%s"' % sort, 400))
+
+    return ((getattr(Project, name), ascending), (Project.id, ascending))
+
+def is_safe_name(name):
+    ''' Return True if the string is a safe name.
+    '''
+    return raw_name(safe_name(name)) == name
+
+def safe_name(name):
+    ''' Return URL-safe organization name with spaces replaced by dashes.
+
+        Slashes will be removed, which is incompatible with raw_name().
+    '''
+    return name.replace(' ', '-').replace('/', '-').replace('?','-').replace('#','-')
+
+def raw_name(name):
+    ''' Return raw organization name with dashes replaced by spaces.
+
+        Also replace old-style underscores with spaces.
+    '''
+    return name.replace('_', ' ').replace('-', ' ')
+
+def organization_slug_id(name):
+    ''' Return the id of an organization from its name in a URL, or None.
+
+        Names are matched on their indexed slug, and remembered for
+        the current data generation. Unknown names aren't remembered.
+    '''
+    slug = safe_name(raw_name(name))
+    generation = data_generation()
+
+    if generation is not None and slug_cache['generation'] != generation:
+        slug_cache.update(generation=generation, ids=dict())
+
+    if generation is not None and slug in slug_cache['ids']:
+        return slug_cache['ids'][slug]
+
+    row = db.session.query(Organization.id).filter(Organization.slug == slug).first()
+
+    if row is None:
+        return None
+
+    if generation is not None:
+        slug_cache['ids'][slug] = row[0]
+
+    return row[0]
+
+def get_query_params(args):
+    filters = {}
+    for key,value in args.iteritems():
+        if 'page' not in key and key not in RESERVED_ARGS:
+            filters[key] = value
+    return filters, urlencode(filters)
+
+@app.route('/api/organizations')
+@app.route('/api/organizations/<name>')
+def get_organizations(name=None):
+    ''' Regular response option for organizations.
+    '''
+
+    filters = request.args
+    filters, querystring = get_query_params(request.args)
+
+    if name:
+        # Get one named organization.
+        filter = Organization.slug == safe_name(raw_name(name))
+        fields = requested_fields()
+        org = load_fields(db.session.query(Organization).filter(filter), fields).first()
+        return api_response(org.asdict(True, fields=fields))
+
+    # Get a bunch of organizations.
+    query = db.session.query(Organization)
+
+    query = filter_query(query, Organization, filters)
+
+    response = paged_results(query, int(request.args.get('page', 1)), int(request.args.get('per_page', 10)), querystring, keys=ORGANIZATION_KEYS)
+
+    return api_response(response)
+
+@app.route('/api/organizations.geojson')
+def get_organizations_geojson():
+    ''' GeoJSON response option for organizations.
+
+        Optionally limit features to a bbox of minlon,minlat,maxlon,maxlat,
+        and their properties to a comma-separated list of fields.
+    '''
+    features, grid = organization_features()
+
+    if 'bbox' in request.args:
+        try:
+            bbox = [float(value) for value in request.args['bbox'].split(',')]
+        except ValueError:
+            bbox = None
+
+        if bbox is None or len(bbox) != 4:
+            return make_response('Bad bbox "%s"' % request.args['bbox'], 400)
+
+        # Comparisons with nan are false, so it fails these range checks too.
+        minlon, minlat, maxlon, maxlat = bbox
+        if not (-180 <= minlon <= 180 and -180 <= maxlon <= 180 and -90 <= minlat <= maxlat <= 90):
+            return make_response('Bad bbox "%s"' % request.args['bbox'], 400)
+
+        features = features_in_bbox(features, grid, bbox)
+
+    if 'fields' in request.args:
+        fields = request.args['fields'].split(',')
+        features = [dict(feature, properties=dict([(key, value) for (key, value) in feature['properties'].items() if key in fields]))
+                    for feature in features]
+
+    geojson = dict(type='FeatureCollection', features=features)
+
+    return api_response(geojson)
+
+@app.route('/api/organizations/near')
+def get_organizations_near():
+    ''' Find the k organizations nearest to a lat and lon.
+
+        Return them nearest first, with their distance in kilometers.
+    '''
+    try:
+        lat, lon = float(request.args['lat']), float(request.args['lon'])
+        k = int(request.args.get('k', 10))
+        # Comparisons with nan are false, so it fails this range check too.
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            raise ValueError(lat, lon)
+    except (KeyError, ValueError):
+        return make_response('Find organizations near a "lat" and "lon", with an optional "k".', 400)
+
+    features, tree = organization_kdtree()
+    nearest = kdtree_nearest(tree, unit_vector(lon, lat), max(1, min(k, MAX_PER_PAGE)))
+
+    objects = [dict(features[index]['properties'], distance=EARTH_RADIUS * 2 * asin(min(1, sqrt(distance) / 2)))
+               for (distance, index) in nearest]
+
+    return api_response(dict(objects=objects))
+
+@app.route("/api/organizations/<organization_name>/events")
+def get_orgs_events(organization_name):
+    '''
+        A cleaner url for getting an organizations events
+        Better than /api/events?q={"filters":[{"name":"organization_name","op":"eq","val":"Code for San Francisco"}]}
+    '''
+    # Check org name
+    id = organization_slug_id(organization_name)
+    if id is None:
+        return "Organization not found", 404
+
+    # Get event objects
+    query = Event.query.filter_by(organization_id=id)
+    response = paged_results(query, int(request.args.get('page', 1)), int(request.args.get('per_page', 25)), keys=EVENT_KEYS)
+    return api_response(response)
+
+@app.route("/api/organizations/<organization_name>/upcoming_events")
+def get_upcoming_events(organization_name):
+    '''
+        Get events that occur in the future. Order asc.
+    '''
+    # Check org name
+    id = organization_slug_id(organization_name)
+    if id is None:
+        return "Organization not found", 404
+    # Get upcoming event objects
+    query = Event.query.filter(Event.organization_id == id, Event.start_time_notz >= datetime.utcnow())
+    response = paged_results(query, int(request.args.get('page', 1)), int(request.args.get('per_page', 25)), keys=EVENT_KEYS, cache_count=False)
+    return api_response(response)
+
+@app.route("/api/organizations/<organization_name>/past_events")
+def get_past_events(organization_name):
+    '''
+        Get events that occur in the past. Order desc.
+    '''
+    # Check org name
+    id = organization_slug_id(organization_name)
+    if id is None:
+        return "Organization not found", 404
+    # Get past event objects
+    query = Event.query.filter(Event.organization_id == id, Event.start_time_notz < datetime.utcnow()).\
+            order_by(desc(Event.start_time_notz))
+    response = paged_results(query, int(request.args.get('page', 1)), int(request.args.get('per_page', 25)), keys=PAST_EVENT_KEYS, cache_count=False)
+    return api_response(response)
+
+@app.route("/api/organizations/<organization_name>/stories")
+def get_orgs_stories(organization_name):
+    '''
+        A cleaner url for getting an organizations stories
+    '''
+    # Check org name
+    id = organization_slug_id(organization_name)
+    if id is None:
+        return "Organization not found", 404
+
+    # Get story objects
+    query = Story.query.filter_by(organization_id=id)
+    response = paged_results(query, int(request.args.get('page', 1)), int(request.args.get('per_page', 25)), keys=STORY_KEYS)
+    return api_response(response)
+
+@app.route("/api/organizations/<organization_name>/projects")
+def get_orgs_projects(organization_name):
+    '''
+        A cleaner url for getting an organizations projects
+    '''
+    # Check org name
+    id = organization_slug_id(organization_name)
+    if id is None:
+        return "Organization not found", 404
+
+    # Get project objects
+    query = Project.query.filter_by(organization_id=id).order_by(desc(Project.last_updated))
+    response = paged_results(query, int(request.args.get('page', 1)), int(request.args.get('per_page', 10)), keys=PROJECT_KEYS)
+    return api_response(response)
+
+@app.route("/api/organizations/<organization_name>/issues")
+@app.route("/api/organizations/<organization_name>/issues/labels/<labels>")
+def get_orgs_issues(organization_name, labels=None):
+    ''' A clean url to get an organizations issues
+    '''
+
+    # Get one named organization.
+    id = organization_slug_id(organization_name)
+    if id is None:
+        return "Organization not found", 404
+
+    # Get that organization's projects
+    project_ids = [row.id for row in db.session.query(Project.id).filter(Project.organization_id == id)]
+
+    # Get all issues belonging to these projects
+    query = Issue.query.filter(Issue.project_id.in_(project_ids))
+
+    querystring = ''
+
+    if labels:
+        match = request.args.get('match', 'all')
+        if match not in LABEL_MATCHES:
+            return 'Unknown label match "%s"' % match, 400
+
+        # Find issues with all or any of the comma-separated labels
+        query = issues_with_labels(query, labels, match)
+        querystring = urlencode(dict(match=match)) if 'match' in request.args else ''
+
+    response = paged_results(query, int(request.args.get('page', 1)), int(request.args.get('per_page', 10)), querystring, keys=ISSUE_KEYS)
+    return api_response(response)
+
+@app.route('/api/projects')
+@app.route('/api/projects/<int:id>')
+def get_projects(id=None):
+    ''' Regular response option for projects.
+    '''
+
+    filters, querystring = get_query_params(request.args)
+
+    if id:
+        # Get one named project.
+        filter = Project.id == id
+        fields = requested_fields()
+        proj = load_fields(db.session.query(Project).filter(filter), fields).first()
+        return api_response(proj.asdict(True, fields=fields))
+
+    # Get a bunch of projects.
+    query = db.session.query(Project)
+
+    query = filter_query(query, Project, filters)
+
+    keys = project_sort_keys()
+    sorted_keys = keys is not PROJECT_KEYS
+
+    if sorted_keys:
+        query = query.order_by(*keyset_order(keys, nulls_last=True))
+    else:
+        query = query.order_by(desc(Project.last_updated))
+    response = paged_results(query, int(request.args.get('page', 1)), int(request.args.get('per_page', 10)), querystring,
+                             keys=keys, nulls_last=sorted_keys)
+    return api_response(response)
+
+@app.route('/api/issues')
+@app.route('/api/issues/<int:id>')
+def get_issues(id=None):
+    '''Regular response option for issues.
+    '''
+
+    filters = request.args
+    filters, querystring = get_query_params(request.args)
+
+    if id:
+        # Get one issue
+        filter = Issue.id == id
+        fields = requested_fields()
+        issue = load_fields(db.session.query(Issue).filter(filter), fields).first()
+        return api_response(issue.asdict(True, fields=fields))
+
+    # Get a bunch of issues
+    query = db.session.query(Issue)
+
+    query = filter_query(query, Issue, filters)
+
+    response = paged_results(query, int(request.args.get('page', 1)), int(request.args.get('per_page', 10)), querystring, keys=ISSUE_KEYS)
+    return api_response(response)
+
+@app.route('/api/issues/labels/<labels>')
+def get_issues_by_labels(labels):
+    '''
+    A clean url to filter issues by a comma-separated list of labels
+    '''
+
+    match = request.args.get('match', 'all')
+    if match not in LABEL_MATCHES:
+        return 'Unknown label match "%s"' % match, 400
+
+    # Find issues with all or any of the comma-separated labels
+    query = issues_with_labels(db.session.query(Issue), labels, match)
+    querystring = urlencode(dict(match=match)) if 'match' in request.args else ''
+
+    # Return the paginated reponse
+    response = paged_results(query, int(request.args.get('page', 1)), int(request.args.get('per_page', 10)), querystring, keys=ISSUE_KEYS)
+    return api_response(response)
+
+@app.route('/api/events')
+@app.route('/api/events/<int:id>')
+def get_events(id=None):
+    ''' Regular response option for events.
+    '''
+
+    filters = request.args
+    filters, querystring = get_query_params(request.args)
+
+    if id:
+        # Get one named event.
         filter = Event.id == id
-        event = db.session.query(Event).filter(filter).first()
-        return jsonify(event.asdict(True))
+        fields = requested_fields()
+        event = load_fields(db.session.query(Event).filter(filter), fields).first()
+        return api_response(event.asdict(True, fields=fields))
 
     # Get a bunch of events.
     query = db.session.query(Event)
 
-    for attr, value in filters.iteritems():
-        if 'organization' in attr:
-            org_attr = attr.split('_')[1]
-            query = query.join(Event.organization).filter(getattr(Organization, org_attr).ilike('%%%s%%' % value))
-        else:
-            query = query.filter(getattr(Event, attr).ilike('%%%s%%' % value))
+    query = filter_query(query, Event, filters)
 
-    response = paged_results(query, int(request.args.get('page', 1)), int(request.args.get('per_page', 25)), querystring)
-    return jsonify(response)
+    response = paged_results(query, int(request.args.get('page', 1)), int(request.args.get('per_page', 25)), querystring, keys=EVENT_KEYS)
+    return api_response(response)
 
 @app.route('/api/events/upcoming_events')
 @app.route('/api/events/upcoming_events/<filter>')
@@ -836,12 +2363,10 @@ def get_all_upcoming_events(filter=None):
     '''
     query = Event.query.filter(Event.start_time_notz >= datetime.utcnow()).order_by(Event.start_time_notz)
     if filter == 'all':
-        response = paged_results(query, int(request.args.get('page', 1)), int(request.args.get('per_page', 10000000)))
-        del response['pages']
-        return jsonify(response)
+        return streamed_results(query)
     if not filter:
-        response = paged_results(query, int(request.args.get('page', 1)), int(request.args.get('per_page', 25)))
-        return jsonify(response)
+        response = paged_results(query, int(request.args.get('page', 1)), int(request.args.get('per_page', 25)), keys=EVENT_KEYS, cache_count=False)
+        return api_response(response)
     else:
         return make_response("We haven't added /"+filter+" yet.", 404)
 
@@ -857,21 +2382,67 @@ def get_stories(id=None):
     if id:
         # Get one named story.
         filter = Story.id == id
-        story = db.session.query(Story).filter(filter).first()
-        return jsonify(story.asdict(True))
+        fields = requested_fields()
+        story = load_fields(db.session.query(Story).filter(filter), fields).first()
+        return api_response(story.asdict(True, fields=fields))
 
     # Get a bunch of stories.
     query = db.session.query(Story)
 
-    for attr, value in filters.iteritems():
-        if 'organization' in attr:
-            org_attr = attr.split('_')[1]
-            query = query.join(Story.organization).filter(getattr(Organization, org_attr).ilike('%%%s%%' % value))
-        else:
-            query = query.filter(getattr(Story, attr).ilike('%%%s%%' % value))
+    query = filter_query(query, Story, filters)
 
-    response = paged_results(query, int(request.args.get('page', 1)), int(request.args.get('per_page', 25)), querystring)
-    return jsonify(response)
+    response = paged_results(query, int(request.args.get('page', 1)), int(request.args.get('per_page', 25)), querystring, keys=STORY_KEYS)
+    return api_response(response)
+
+@app.route('/api/export/<entity>.ndjson')
+def export(entity):
+    ''' Stream every organization, project, issue, event or story as
+        newline-delimited JSON, one object per line.
+
+        With since, a Unix timestamp or ISO 8601 date, only export rows
+        whose data changed since then. Deleted rows aren't exported.
+    '''
+    if entity not in EXPORT_MODELS:
+        return make_response("We don't export %s." % entity, 404)
+
+    model = EXPORT_MODELS[entity]
+    query = db.session.query(model).order_by(*model.__table__.primary_key.columns)
+
+    if 'since' in request.args:
+        since = request.args['since']
+        try:
+            since = datetime.utcfromtimestamp(float(since))
+        except (ValueError, OverflowError):
+            try:
+                since = parse_datetime(since)
+            except (ValueError, TypeError):
+                return make_response('Bad since "%s"' % since, 400)
+            since = since.astimezone(tzutc()).replace(tzinfo=None) if since.tzinfo else since
+
+        query = query.filter(model.updated_at >= since)
+
+    fields, expand = requested_fields(), requested_expansions()
+
+    def generate():
+        for obj_dict in streamed_dicts(query, fields, expand):
+            yield json_dumps(obj_dict) + '\n'
+
+    return current_app.response_class(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/api/search')
+def search():
+    ''' Full-text search over projects, issues, stories and events.
+
+        Return the best matches first.
+    '''
+    q = request.args.get('q', '').strip()
+
+    if not q:
+        return make_response('Search with a "q" parameter.', 400)
+
+    querystring = urlencode(dict(q=q.encode('utf8')))
+    response = paged_results(search_query(q), int(request.args.get('page', 1)), int(request.args.get('per_page', 10)), querystring)
+    return api_response(response)
 
 # -------------------
 # Routes
@@ -937,7 +2508,7 @@ def well_known_status():
     state = dict(status=status, updated=int(time.time()), resources=[])
     state.update(dict(dependencies=['Meetup', 'Github', 'PostgreSQL']))
 
-    return jsonify(state)
+    return api_response(state)
 
 @app.route("/")
 def index():
@@ -958,5 +2529,13 @@ def api_static_file(path):
     response.headers['Content-Type'] = mime_type
     return response
 
+@manager.command
+def search_index():
+    ''' Rebuild the full-text search index from scratch.
+    '''
+    rebuild_search_index(db.session)
+    bump_generation(db.session)
+    db.session.commit()
+
 if __name__ == "__main__":
     manager.run()
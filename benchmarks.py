@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+''' Benchmark API response formats for projects and issues.
+
+    Compares response size and CPU time of pretty and compact JSON,
+    of the standard library and simplejson encoders, and of JSON and
+    MessagePack, and times substring filters on 100,000 issues with and
+    without trigram indexes. Uses the test database, which is emptied
+    afterwards.
+
+    Name benchmarks on the command line to run only those, e.g.
+    "python benchmarks.py trigrams".
+'''
+import sys, json, time, struct, msgpack
+from datetime import datetime
+
+from app import app, db, Issue, TRIGRAM_COLUMNS
+from factories import OrganizationFactory, ProjectFactory, IssueFactory
+
+URL = '/api/projects?per_page=100'
+MSGPACK_URLS = ('/api/projects?per_page=100', '/api/issues?per_page=100')
+TRIGRAM_URLS = ('/api/issues?title=%s', '/api/issues?body=%s')
+TRIGRAM_ISSUES = 100000
+ROUNDS = 20
+
+def cpu_time(function, rounds=ROUNDS):
+    ''' Return the mean CPU seconds taken by a function.
+    '''
+    start = time.clock()
+    for _ in range(rounds):
+        function()
+
+    return (time.clock() - start) / rounds
+
+def wall_time(function, rounds=ROUNDS):
+    ''' Return the mean elapsed seconds taken by a function.
+    '''
+    start = time.time()
+    for _ in range(rounds):
+        function()
+
+    return (time.time() - start) / rounds
+
+def unpack_timestamp(code, data):
+    ''' Decode MessagePack timestamps, which msgpack 0.6 leaves to the caller.
+    '''
+    if len(data) == 8:
+        value, = struct.unpack('>Q', data)
+        return datetime.utcfromtimestamp(value & (2**34 - 1))
+
+    return msgpack.ExtType(code, data)
+
+def benchmark_json(client):
+    ''' Compare pretty and compact JSON, and the available encoders.
+    '''
+    compact, pretty = client.get(URL).data, client.get(URL + '&pretty=1').data
+
+    print 'Response bytes: %d pretty, %d compact (%.0f%% saved)' \
+        % (len(pretty), len(compact), 100. * (len(pretty) - len(compact)) / len(pretty))
+
+    pretty_request = cpu_time(lambda: client.get(URL + '&pretty=1'))
+    compact_request = cpu_time(lambda: client.get(URL))
+
+    print 'Request CPU: %.1fms pretty, %.1fms compact' % (pretty_request * 1000, compact_request * 1000)
+
+    data = json.loads(compact)
+
+    # Flask sorts keys by default, which the standard library only does in pure Python
+    sort_keys = app.config['JSON_SORT_KEYS']
+    encoders = [('json', json)]
+
+    try:
+        import simplejson
+    except ImportError:
+        print 'simplejson is not installed'
+    else:
+        encoders.append(('simplejson', simplejson))
+
+    for name, module in encoders:
+        pretty_encode = cpu_time(lambda: module.dumps(data, indent=2, separators=(',', ': '), sort_keys=sort_keys))
+        compact_encode = cpu_time(lambda: module.dumps(data, separators=(',', ':'), sort_keys=sort_keys))
+
+        print 'Encode CPU with %s: %.1fms pretty, %.1fms compact' % (name, pretty_encode * 1000, compact_encode * 1000)
+
+def benchmark_msgpack(client):
+    ''' Compare JSON and MessagePack responses, and parsing them.
+    '''
+    for url in MSGPACK_URLS:
+        json_data, msgpack_data = client.get(url).data, client.get(url + '&format=msgpack').data
+
+        print '%s bytes: %d JSON, %d MessagePack' % (url, len(json_data), len(msgpack_data))
+
+        json_request = cpu_time(lambda: client.get(url))
+        msgpack_request = cpu_time(lambda: client.get(url + '&format=msgpack'))
+
+        print '%s request CPU: %.1fms JSON, %.1fms MessagePack' % (url, json_request * 1000, msgpack_request * 1000)
+
+        json_parse = cpu_time(lambda: json.loads(json_data))
+        msgpack_parse = cpu_time(lambda: msgpack.unpackb(msgpack_data, raw=False, ext_hook=unpack_timestamp))
+
+        print '%s parse CPU: %.2fms JSON, %.2fms MessagePack' % (url, json_parse * 1000, msgpack_parse * 1000)
+
+def benchmark_trigrams(client):
+    ''' Compare substring filters on many issues with and without trigram indexes.
+    '''
+    project_id = db.session.query(db.func.min(Issue.project_id)).scalar()
+
+    db.session.execute('''INSERT INTO issue (title, body, project_id, keep)
+                          SELECT 'Issue ' || md5(number::text), 'Body ' || md5((-number)::text), :project_id, true
+                          FROM generate_series(1, :count) AS number''',
+                       dict(project_id=project_id, count=TRIGRAM_ISSUES))
+    db.session.commit()
+    db.session.execute('ANALYZE issue')
+
+    # An eight character substring of one generated issue's hashes
+    needle = db.session.execute("SELECT substr(md5('5000'), 10, 8)").scalar()
+    indexes = ['issue_%s_trgm' % name for name in TRIGRAM_COLUMNS[Issue]]
+
+    for url in [url % needle for url in TRIGRAM_URLS]:
+        indexed = wall_time(lambda: client.get(url), 5)
+
+        for index in indexes:
+            db.session.execute('DROP INDEX %s' % index)
+        db.session.commit()
+
+        unindexed = wall_time(lambda: client.get(url), 5)
+
+        for name in TRIGRAM_COLUMNS[Issue]:
+            db.session.execute('CREATE INDEX issue_%s_trgm ON issue USING gin (%s gin_trgm_ops)' % (name, name))
+        db.session.commit()
+
+        print '%s on %d issues: %.1fms without trigram indexes, %.1fms with' \
+            % (url, TRIGRAM_ISSUES, unindexed * 1000, indexed * 1000)
+
+BENCHMARKS = dict(json=benchmark_json, msgpack=benchmark_msgpack, trigrams=benchmark_trigrams)
+
+def main(names):
+    for name in names:
+        if name not in BENCHMARKS:
+            raise SystemExit('Unknown benchmark %s, choose from %s' % (name, ', '.join(sorted(BENCHMARKS))))
+
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'postgres://postgres@localhost/civic_json_worker_test'
+    app.config['RESPONSE_CACHE_SIZE'] = 0
+    db.create_all()
+
+    try:
+        organization = OrganizationFactory(name=u'Code for Benchmarks')
+        db.session.flush()
+        for number in range(100):
+            project = ProjectFactory(organization_name=organization.name)
+            project.last_updated = datetime(2014, 6, 1, number % 24)
+            db.session.flush()
+            for _ in range(5):
+                IssueFactory(project_id=project.id)
+        db.session.commit()
+
+        client = app.test_client()
+        for name in names or ('json', 'msgpack', 'trigrams'):
+            BENCHMARKS[name](client)
+
+    finally:
+        db.session.close()
+        db.drop_all()
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,26 @@
+"""Add normalized label names
+
+Revision ID: 1f6c83d2a9b4
+Revises: 4b2a9d1c7e3f
+Create Date: 2026-10-17 14:22:05.631870
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '1f6c83d2a9b4'
+down_revision = '4b2a9d1c7e3f'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('label', sa.Column('normalized_name', sa.Unicode(), nullable=True))
+    op.execute("UPDATE label SET normalized_name = lower(trim(name))")
+    op.create_index('label_normalized_name', 'label', ['normalized_name', 'issue_id'], unique=False,
+                    postgresql_ops={'normalized_name': 'text_pattern_ops'})
+
+
+def downgrade():
+    op.drop_index('label_normalized_name', 'label')
+    op.drop_column('label', 'normalized_name')
@@ -0,0 +1,39 @@
+"""Add Github columns to projects
+
+Revision ID: 2d7f4b8e6a15
+Revises: 5c1e9a7b3d20
+Create Date: 2026-10-17 18:05:12.908431
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '2d7f4b8e6a15'
+down_revision = '5c1e9a7b3d20'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('project', sa.Column('language', sa.Unicode(), nullable=True))
+    op.add_column('project', sa.Column('watchers_count', sa.Integer(), nullable=True))
+    op.add_column('project', sa.Column('forks_count', sa.Integer(), nullable=True))
+    op.add_column('project', sa.Column('open_issues', sa.Integer(), nullable=True))
+    op.add_column('project', sa.Column('pushed_at', sa.DateTime(), nullable=True))
+
+    op.execute("""UPDATE project SET
+                    language = github_details->>'language',
+                    watchers_count = (github_details->>'watchers_count')::integer,
+                    forks_count = (github_details->>'forks_count')::integer,
+                    open_issues = (github_details->>'open_issues')::integer,
+                    pushed_at = (github_details->>'pushed_at')::timestamptz AT TIME ZONE 'UTC'
+                  WHERE jsonb_typeof(github_details) = 'object'""")
+
+    for column in ('language', 'watchers_count', 'forks_count', 'open_issues', 'pushed_at'):
+        op.create_index('ix_project_' + column, 'project', [column], unique=False)
+
+
+def downgrade():
+    for column in ('language', 'watchers_count', 'forks_count', 'open_issues', 'pushed_at'):
+        op.drop_index('ix_project_' + column, 'project')
+        op.drop_column('project', column)
@@ -0,0 +1,26 @@
+"""Add data generation counter
+
+Revision ID: 395c2fbce87a
+Revises: None
+Create Date: 2026-10-17 10:12:41.503320
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '395c2fbce87a'
+down_revision = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('data_generation',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('generation', sa.BigInteger(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('data_generation')
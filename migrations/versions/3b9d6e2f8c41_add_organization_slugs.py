@@ -0,0 +1,29 @@
+"""Add organization slugs
+
+Revision ID: 3b9d6e2f8c41
+Revises: 8e2c5f1a7b39
+Create Date: 2026-10-17 21:02:37.604918
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3b9d6e2f8c41'
+down_revision = '8e2c5f1a7b39'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('organization', sa.Column('slug', sa.Unicode(), nullable=True))
+
+    # Same as app.safe_name()
+    op.execute("""UPDATE organization SET slug =
+                    replace(replace(replace(replace(name, ' ', '-'), '/', '-'), '?', '-'), '#', '-')""")
+
+    op.create_index('ix_organization_slug', 'organization', ['slug'], unique=True)
+
+
+def downgrade():
+    op.drop_index('ix_organization_slug', 'organization')
+    op.drop_column('organization', 'slug')
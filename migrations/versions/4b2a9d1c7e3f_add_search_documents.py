@@ -0,0 +1,56 @@
+"""Add search documents
+
+Revision ID: 4b2a9d1c7e3f
+Revises: 395c2fbce87a
+Create Date: 2026-10-17 13:40:12.208114
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4b2a9d1c7e3f'
+down_revision = '395c2fbce87a'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('search_document',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('kind', sa.Unicode(), nullable=True),
+        sa.Column('title', sa.Unicode(), nullable=True),
+        sa.Column('body', sa.Unicode(), nullable=True),
+        sa.Column('project_id', sa.Integer(), nullable=True),
+        sa.Column('issue_id', sa.Integer(), nullable=True),
+        sa.Column('story_id', sa.Integer(), nullable=True),
+        sa.Column('event_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['event_id'], ['event.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['issue_id'], ['issue.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['project_id'], ['project.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['story_id'], ['story.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_search_document_event_id', 'search_document', ['event_id'], unique=False)
+    op.create_index('ix_search_document_issue_id', 'search_document', ['issue_id'], unique=False)
+    op.create_index('ix_search_document_project_id', 'search_document', ['project_id'], unique=False)
+    op.create_index('ix_search_document_story_id', 'search_document', ['story_id'], unique=False)
+    op.execute("CREATE INDEX search_document_text ON search_document "
+               "USING gin (to_tsvector('english', title || ' ' || body))")
+
+    op.execute("INSERT INTO search_document (kind, project_id, title, body) "
+               "SELECT 'project', id, coalesce(name, ''), coalesce(description, '') FROM project")
+    op.execute("INSERT INTO search_document (kind, issue_id, title, body) "
+               "SELECT 'issue', id, coalesce(title, ''), coalesce(body, '') FROM issue")
+    op.execute("INSERT INTO search_document (kind, story_id, title, body) "
+               "SELECT 'story', id, coalesce(title, ''), '' FROM story")
+    op.execute("INSERT INTO search_document (kind, event_id, title, body) "
+               "SELECT 'event', id, coalesce(name, ''), coalesce(description, '') FROM event")
+
+
+def downgrade():
+    op.drop_index('search_document_text', 'search_document')
+    op.drop_index('ix_search_document_story_id', 'search_document')
+    op.drop_index('ix_search_document_project_id', 'search_document')
+    op.drop_index('ix_search_document_issue_id', 'search_document')
+    op.drop_index('ix_search_document_event_id', 'search_document')
+    op.drop_table('search_document')
@@ -0,0 +1,31 @@
+"""Add updated_at columns for incremental exports
+
+Revision ID: 4d8b1e6f3a27
+Revises: 9c5d3a7e2b18
+Create Date: 2026-10-18 10:12:37.215940
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4d8b1e6f3a27'
+down_revision = '9c5d3a7e2b18'
+
+from alembic import op
+import sqlalchemy as sa
+
+TABLES = ('organization', 'project', 'issue', 'event', 'story')
+
+
+def upgrade():
+    for table in TABLES:
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(), nullable=True))
+
+        # When existing rows last changed isn't known, so count them as changed now.
+        op.execute("UPDATE %s SET updated_at = timezone('utc', now())" % table)
+        op.create_index('ix_%s_updated_at' % table, table, ['updated_at'], unique=False)
+
+
+def downgrade():
+    for table in reversed(TABLES):
+        op.drop_index('ix_%s_updated_at' % table, table)
+        op.drop_column(table, 'updated_at')
@@ -0,0 +1,24 @@
+"""Store github_details as JSONB
+
+Revision ID: 5c1e9a7b3d20
+Revises: 1f6c83d2a9b4
+Create Date: 2026-10-17 16:48:37.214095
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5c1e9a7b3d20'
+down_revision = '1f6c83d2a9b4'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.execute("ALTER TABLE project ALTER COLUMN github_details TYPE JSONB "
+               "USING CASE WHEN github_details = '' THEN NULL ELSE github_details::jsonb END")
+
+
+def downgrade():
+    op.execute("ALTER TABLE project ALTER COLUMN github_details TYPE VARCHAR "
+               "USING github_details::text")
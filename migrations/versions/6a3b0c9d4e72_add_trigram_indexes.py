@@ -0,0 +1,37 @@
+"""Add trigram indexes for substring filters
+
+Revision ID: 6a3b0c9d4e72
+Revises: 2d7f4b8e6a15
+Create Date: 2026-10-17 19:31:48.552160
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '6a3b0c9d4e72'
+down_revision = '2d7f4b8e6a15'
+
+from alembic import op
+import sqlalchemy as sa
+
+TRIGRAM_COLUMNS = dict(
+    organization=('name', 'type', 'city'),
+    project=('name', 'description', 'type', 'categories', 'organization_name'),
+    issue=('title', 'body'),
+    event=('name', 'description', 'location', 'organization_name'),
+    story=('title', 'organization_name')
+    )
+
+
+def upgrade():
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+
+    for (table, columns) in TRIGRAM_COLUMNS.items():
+        for column in columns:
+            op.execute("CREATE INDEX %s_%s_trgm ON %s USING gin (%s gin_trgm_ops)" % (table, column, table, column))
+
+
+def downgrade():
+    # The pg_trgm extension is left installed.
+    for (table, columns) in TRIGRAM_COLUMNS.items():
+        for column in columns:
+            op.drop_index('%s_%s_trgm' % (table, column), table)
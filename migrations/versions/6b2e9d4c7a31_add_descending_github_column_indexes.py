@@ -0,0 +1,28 @@
+"""Add descending indexes for sorting projects on Github columns
+
+Revision ID: 6b2e9d4c7a31
+Revises: 4d8b1e6f3a27
+Create Date: 2026-10-18 14:05:52.381204
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '6b2e9d4c7a31'
+down_revision = '4d8b1e6f3a27'
+
+from alembic import op
+import sqlalchemy as sa
+
+COLUMNS = ('language', 'watchers_count', 'forks_count', 'open_issues', 'pushed_at')
+
+
+def upgrade():
+    # Sorting down puts missing values last, which the plain column
+    # indexes can't provide when read backward.
+    for column in COLUMNS:
+        op.execute('CREATE INDEX ix_project_%s_desc ON project (%s DESC NULLS LAST, id DESC)' % (column, column))
+
+
+def downgrade():
+    for column in reversed(COLUMNS):
+        op.drop_index('ix_project_%s_desc' % column, 'project')
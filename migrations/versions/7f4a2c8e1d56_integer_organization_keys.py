@@ -0,0 +1,68 @@
+"""Integer organization keys
+
+Revision ID: 7f4a2c8e1d56
+Revises: 3b9d6e2f8c41
+Create Date: 2026-10-17 22:26:51.730442
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '7f4a2c8e1d56'
+down_revision = '3b9d6e2f8c41'
+
+from alembic import op
+import sqlalchemy as sa
+
+CHILD_TABLES = ('project', 'event', 'story')
+
+# Indexes that start with the organization, by table, without the organization column.
+ORGANIZATION_INDEXES = dict(
+    project=('last_updated', ['last_updated', 'id']),
+    event=('start_time_notz', ['start_time_notz', 'id']),
+    story=('link', ['link'])
+    )
+
+
+def upgrade():
+    for table in CHILD_TABLES:
+        op.drop_constraint('%s_organization_name_fkey' % table, table)
+
+    op.drop_constraint('organization_pkey', 'organization')
+    # Number existing organizations from the same sequence new ones will use.
+    op.execute("ALTER TABLE organization ADD COLUMN id SERIAL NOT NULL")
+    op.create_primary_key('organization_pkey', 'organization', ['id'])
+    op.create_index('ix_organization_name', 'organization', ['name'], unique=True)
+
+    for table in CHILD_TABLES:
+        name, columns = ORGANIZATION_INDEXES[table]
+        op.add_column(table, sa.Column('organization_id', sa.Integer(), nullable=True))
+        op.execute("""UPDATE %s SET organization_id = organization.id FROM organization
+                      WHERE organization.name = %s.organization_name""" % (table, table))
+
+        # Indexes on the name column go with it.
+        op.drop_column(table, 'organization_name')
+        op.create_foreign_key('%s_organization_id_fkey' % table, table, 'organization',
+                              ['organization_id'], ['id'], ondelete='CASCADE')
+        op.create_index('ix_%s_organization_id_%s' % (table, name), table, ['organization_id'] + columns, unique=False)
+
+
+def downgrade():
+    for table in CHILD_TABLES:
+        name, columns = ORGANIZATION_INDEXES[table]
+        op.add_column(table, sa.Column('organization_name', sa.Unicode(), nullable=True))
+        op.execute("""UPDATE %s SET organization_name = organization.name FROM organization
+                      WHERE organization.id = %s.organization_id""" % (table, table))
+
+        # The foreign key and index go with the id column.
+        op.drop_column(table, 'organization_id')
+        op.create_index('ix_%s_organization_name_%s' % (table, name), table, ['organization_name'] + columns, unique=False)
+        op.execute("CREATE INDEX %s_organization_name_trgm ON %s USING gin (organization_name gin_trgm_ops)" % (table, table))
+
+    op.drop_index('ix_organization_name', 'organization')
+    op.drop_constraint('organization_pkey', 'organization')
+    op.drop_column('organization', 'id')
+    op.create_primary_key('organization_pkey', 'organization', ['name'])
+
+    for table in CHILD_TABLES:
+        op.create_foreign_key('%s_organization_name_fkey' % table, table, 'organization',
+                              ['organization_name'], ['name'], ondelete='CASCADE')
@@ -0,0 +1,36 @@
+"""Add indexes for listings and update lookups
+
+Revision ID: 8e2c5f1a7b39
+Revises: 6a3b0c9d4e72
+Create Date: 2026-10-17 20:14:05.318264
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '8e2c5f1a7b39'
+down_revision = '6a3b0c9d4e72'
+
+from alembic import op
+import sqlalchemy as sa
+
+INDEXES = (
+    ('ix_project_last_updated', 'project', ['last_updated', 'id']),
+    ('ix_project_organization_name_last_updated', 'project', ['organization_name', 'last_updated', 'id']),
+    ('ix_project_code_url', 'project', ['code_url']),
+    ('ix_issue_project_id', 'issue', ['project_id']),
+    ('ix_label_issue_id', 'label', ['issue_id']),
+    ('ix_event_start_time_notz', 'event', ['start_time_notz', 'id']),
+    ('ix_event_organization_name_start_time_notz', 'event', ['organization_name', 'start_time_notz', 'id']),
+    ('ix_event_event_url', 'event', ['event_url']),
+    ('ix_story_organization_name_link', 'story', ['organization_name', 'link'])
+    )
+
+
+def upgrade():
+    for (name, table, columns) in INDEXES:
+        op.create_index(name, table, columns, unique=False)
+
+
+def downgrade():
+    for (name, table, columns) in reversed(INDEXES):
+        op.drop_index(name, table)
@@ -0,0 +1,42 @@
+"""Add organization summaries
+
+Revision ID: 9c5d3a7e2b18
+Revises: 7f4a2c8e1d56
+Create Date: 2026-10-17 23:48:12.604917
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '9c5d3a7e2b18'
+down_revision = '7f4a2c8e1d56'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+class JSONB(sa.types.UserDefinedType):
+    ''' Postgres JSONB column type, as in app.JSONB.
+    '''
+    def get_col_spec(self):
+        return 'JSONB'
+
+
+def upgrade():
+    # Rows are written by the next run of run_update.py; until then
+    # organizations are read from their live tables.
+    op.create_table('organization_summary',
+        sa.Column('organization_id', sa.Integer(), nullable=False),
+        sa.Column('current_events', JSONB(), nullable=True),
+        sa.Column('current_projects', JSONB(), nullable=True),
+        sa.Column('current_stories', JSONB(), nullable=True),
+        sa.Column('project_count', sa.Integer(), nullable=True),
+        sa.Column('issue_count', sa.Integer(), nullable=True),
+        sa.Column('upcoming_event_count', sa.Integer(), nullable=True),
+        sa.Column('story_count', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['organization_id'], ['organization.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('organization_id')
+        )
+
+
+def downgrade():
+    op.drop_table('organization_summary')
@@ -7,11 +7,13 @@ from operator import itemgetter
 from StringIO import StringIO
 from requests import get
 from datetime import datetime
-from dateutil.tz import tzoffset
+from dateutil.tz import tzoffset, tzutc
+from dateutil.parser import parse as parse_datetime
 from unidecode import unidecode
 from feeds import extract_feed_links, get_first_working_feed_link
 import feedparser
-from app import db, app, Project, Organization, Story, Event, Error, Issue, Label, is_safe_name
+from sqlalchemy.orm import undefer
+from app import db, app, Project, Organization, OrganizationSummary, Story, Event, Error, Issue, Label, is_safe_name, safe_name, bump_generation, index_search_document, GITHUB_COLUMNS, ORGANIZATION_EXTRAS
 from urllib2 import HTTPError, URLError
 from urlparse import urlparse
 from random import shuffle
@@ -89,7 +91,7 @@ def get_meetup_events(organization, group_urlname):
                          name=event['name'],
                          event_url=event['event_url'],
                          start_time_notz=format_date(event['time'], event['utc_offset']),
-                         created_at=format_date(event['created'], event['utc_offset']),
+                         created_at=unicode(format_date(event['created'], event['utc_offset'])),
                          utc_offset=event['utc_offset']/1000.0)
 
             # Some events don't have descriptions
@@ -328,17 +330,17 @@ def update_project_info(project):
 
             # unless one of the fields has been updated
             if project['description'] != existing_project.description:
-                project['last_updated'] = datetime.now().strftime("%a, %d %b %Y %H:%M:%S %Z")
+                project['last_updated'] = datetime.now()
             if project['categories'] != existing_project.categories:
-                project['last_updated'] = datetime.now().strftime("%a, %d %b %Y %H:%M:%S %Z")
+                project['last_updated'] = datetime.now()
             if project['type'] != existing_project.type:
-                project['last_updated'] = datetime.now().strftime("%a, %d %b %Y %H:%M:%S %Z")
+                project['last_updated'] = datetime.now()
             if project['link_url'] != existing_project.link_url:
-                project['last_updated'] = datetime.now().strftime("%a, %d %b %Y %H:%M:%S %Z")
+                project['last_updated'] = datetime.now()
 
         else:
             # Set a date when we first see a non-github project
-            project['last_updated'] = datetime.now().strftime("%a, %d %b %Y %H:%M:%S %Z")
+            project['last_updated'] = datetime.now()
 
         return project
 
@@ -394,8 +396,9 @@ def update_project_info(project):
             logging.info('Project %s has not been modified since last update', repo_url)
             return None
 
-        # Save last_updated time header for future requests
-        project['last_updated'] = got.headers['Last-Modified']
+        # Save last_updated time header for future requests, as a naive UTC datetime like the column holds
+        last_modified = parse_datetime(got.headers['Last-Modified'])
+        project['last_updated'] = last_modified.astimezone(tzutc()).replace(tzinfo=None)
 
         all_github_attributes = got.json()
         github_details = {}
@@ -467,7 +470,7 @@ def get_issues(org_name):
     db.session.flush()
 
     # Only grab this organizations projects
-    projects = db.session.query(Project).filter(Project.organization_name == org_name).all()
+    projects = db.session.query(Project).join(Project.organization).filter(Organization.name == org_name).all()
 
     # Populate issues for each project
     for project in projects:
@@ -571,24 +574,58 @@ def save_organization_info(session, org_dict):
     for (field, value) in org_dict.items():
         setattr(existing_org, field, value)
 
+    # Keep the URL slug in step with the name, for organization_slug_id().
+    existing_org.slug = safe_name(existing_org.name)
+
     # Flush existing object, to prevent a sqlalchemy.orm.exc.StaleDataError.
     session.flush()
 
     return existing_org
 
+def save_organization_summary(session, organization):
+    ''' Save the current events, projects and stories of an organization, and counts of them.
+
+        Links are made under app.SUMMARY_ROOT, and moved to the requested
+        host when read. Return an app.OrganizationSummary instance.
+    '''
+    session.flush()
+
+    extras = dict([(key, load([organization.id])[organization.id]) for (key, load) in ORGANIZATION_EXTRAS.items()])
+
+    return session.merge(OrganizationSummary(organization.id, extras))
+
+def github_columns(github_details):
+    ''' Return a dictionary of Project column values copied from Github details.
+    '''
+    columns = dict([(name, (github_details or {}).get(name)) for name in GITHUB_COLUMNS])
+
+    if columns['pushed_at']:
+        pushed_at = parse_datetime(columns['pushed_at'])
+        columns['pushed_at'] = pushed_at.astimezone(tzutc()).replace(tzinfo=None)
+
+    return columns
+
 def save_project_info(session, proj_dict):
     ''' Save a dictionary of project info to the datastore session.
 
         Return an app.Project instance.
     '''
+    # Projects skipped while Github throttles us come without details,
+    # and keep the columns copied from the ones already saved.
+    if 'github_details' in proj_dict:
+        proj_dict = dict(proj_dict, **github_columns(proj_dict['github_details']))
+
     # Select the current project, filtering on name AND organization.
-    filter = Project.name == proj_dict['name'], Project.organization_name == proj_dict['organization_name']
-    existing_project = session.query(Project).filter(*filter).first()
+    filter = Project.name == proj_dict['name'], Organization.name == proj_dict['organization_name']
+    # Github details are read too, to tell whether new ones are any different.
+    query = session.query(Project).options(undefer(Project.github_details))
+    existing_project = query.join(Project.organization).filter(*filter).first()
 
     # If this is a new project, save and return it.
     if not existing_project:
         new_project = Project(**proj_dict)
         session.add(new_project)
+        index_search_document(session, new_project)
         return new_project
 
     # Mark the existing project for safekeeping.
@@ -600,6 +637,7 @@ def save_project_info(session, proj_dict):
 
     # Flush existing object, to prevent a sqlalchemy.orm.exc.StaleDataError.
     session.flush()
+    index_search_document(session, existing_project)
 
     return existing_project
 
@@ -625,6 +663,7 @@ def save_issue_info(session, issue_dict, label_list):
         new_issue = Issue(**issue_dict)
         new_issue.labels = labels
         session.add(new_issue)
+        index_search_document(session, new_issue)
         return new_issue
 
     # Mark the existing issue for safekeeping.
@@ -637,6 +676,7 @@ def save_issue_info(session, issue_dict, label_list):
 
     # Flush existing object, to prevent a sqlalchemy.orm.exc.StaleDataError.
     session.flush()
+    index_search_document(session, existing_issue)
 
     return existing_issue
 
@@ -647,13 +687,14 @@ def save_event_info(session, event_dict):
     '''
     # Select the current event, filtering on event_url and organization.
     filter = Event.event_url == event_dict['event_url'], \
-             Event.organization_name == event_dict['organization_name']
-    existing_event = session.query(Event).filter(*filter).first()
+             Organization.name == event_dict['organization_name']
+    existing_event = session.query(Event).join(Event.organization).filter(*filter).first()
 
     # If this is a new event, save and return it.
     if not existing_event:
         new_event = Event(**event_dict)
         session.add(new_event)
+        index_search_document(session, new_event)
         return new_event
 
     # Mark the existing event for safekeeping.
@@ -665,21 +706,23 @@ def save_event_info(session, event_dict):
 
     # Flush existing object, to prevent a sqlalchemy.orm.exc.StaleDataError.
     session.flush()
+    index_search_document(session, existing_event)
 
 def save_story_info(session, story_dict):
     '''
         Save a dictionary of story into to the datastore session then return
         that story instance
     '''
-    filter = Story.organization_name == story_dict['organization_name'], \
+    filter = Organization.name == story_dict['organization_name'], \
              Story.link == story_dict['link']
 
-    existing_story = session.query(Story).filter(*filter).first()
+    existing_story = session.query(Story).join(Story.organization).filter(*filter).first()
 
     # If this is a new story, save and return it.
     if not existing_story:
         new_story = Story(**story_dict)
         session.add(new_story)
+        index_search_document(session, new_story)
         return new_story
 
     # Mark the existing story for safekeeping.
@@ -691,6 +734,7 @@ def save_story_info(session, story_dict):
 
     # Flush existing object, to prevent a sqlalchemy.orm.exc.StaleDataError.
     session.flush()
+    index_search_document(session, existing_story)
 
 def get_event_group_identifier(events_url):
     parse_result = urlparse(events_url)
@@ -746,18 +790,18 @@ def main(org_name=None, org_sources=None, minimum_age=3*3600):
                 continue
 
         # Mark everything in this organization for deletion at first.
-        db.session.execute(db.update(Event, values={'keep': False}).where(Event.organization_name == org_info['name']))
-        db.session.execute(db.update(Story, values={'keep': False}).where(Story.organization_name == org_info['name']))
-        db.session.execute(db.update(Project, values={'keep': False}).where(Project.organization_name == org_info['name']))
-        db.session.execute(db.update(Organization, values={'keep': False}).where(Organization.name == org_info['name']))
-
-        # Empty lat longs are okay.
+        if existing_org:
+            db.session.execute(db.update(Event, values={'keep': False}).where(Event.organization_id == existing_org.id))
+            db.session.execute(db.update(Story, values={'keep': False}).where(Story.organization_id == existing_org.id))
+            db.session.execute(db.update(Project, values={'keep': False}).where(Project.organization_id == existing_org.id))
+            db.session.execute(db.update(Organization, values={'keep': False}).where(Organization.id == existing_org.id))
+
+        # Empty lat longs are okay. Others are read as numbers, so
+        # unchanged ones compare equal to those already saved.
         if 'latitude' in org_info:
-            if not org_info['latitude']:
-                org_info['latitude'] = None
+            org_info['latitude'] = float(org_info['latitude']) if org_info['latitude'] else None
         if 'longitude' in org_info:
-            if not org_info['longitude']:
-                org_info['longitude'] = None
+            org_info['longitude'] = float(org_info['longitude']) if org_info['longitude'] else None
 
         organization = save_organization_info(db.session, org_info)
         organization_names.add(organization.name)
@@ -800,12 +844,16 @@ def main(org_name=None, org_sources=None, minimum_age=3*3600):
         db.session.query(Issue).filter(not Issue.keep).delete()
         db.session.query(Organization).filter(not Organization.keep).delete()
 
+        # Save what the organization's API response shows, to be read in one query.
+        save_organization_summary(db.session, organization)
+
       except:
         # Raise the error, get out of main(), and don't commit the transaction.
         raise
 
       else:
         # Commit and move on to the next organization.
+        bump_generation(db.session)
         db.session.commit()
 
     # Stop right here if an org name was specified.
@@ -817,10 +865,11 @@ def main(org_name=None, org_sources=None, minimum_age=3*3600):
         if bad_org.name in organization_names:
             continue
 
-        db.session.execute(db.delete(Event).where(Event.organization_name == bad_org.name))
-        db.session.execute(db.delete(Story).where(Story.organization_name == bad_org.name))
-        db.session.execute(db.delete(Project).where(Project.organization_name == bad_org.name))
-        db.session.execute(db.delete(Organization).where(Organization.name == bad_org.name))
+        db.session.execute(db.delete(Event).where(Event.organization_id == bad_org.id))
+        db.session.execute(db.delete(Story).where(Story.organization_id == bad_org.id))
+        db.session.execute(db.delete(Project).where(Project.organization_id == bad_org.id))
+        db.session.execute(db.delete(Organization).where(Organization.id == bad_org.id))
+        bump_generation(db.session)
         db.session.commit()
 
 parser = ArgumentParser(description='''Update database from CSV source URL.''')
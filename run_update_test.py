@@ -53,7 +53,7 @@ class RunUpdateTestCase(unittest.TestCase):
             return response(200, u'''name,website,events_url,rss,projects_list_url\nCöde for Ameriça,http://codeforamerica.org,http://www.meetup.com/events/Code-For-Charlotte/,http://www.codeforamerica.org/blog/feed/,http://example.com/cfa-projects.csv\nCode for America (2),,,,https://github.com/codeforamerica\nCode for America (3),,,,https://www.github.com/orgs/codeforamerica'''.encode('utf8'))
 
         elif url.geturl() == 'https://api.github.com/repos/codeforamerica/cityvoice':
-            return response(200, '''{ "id": 10515516, "name": "cityvoice", "full_name": "codeforamerica/cityvoice", "owner": { "login": "codeforamerica", "id": 337792, "avatar_url": "https://avatars.githubusercontent.com/u/337792", "gravatar_id": "ec81184c572bc827b72ebb489d49f821", "url": "https://api.github.com/users/codeforamerica", "html_url": "https://github.com/codeforamerica", "followers_url": "https://api.github.com/users/codeforamerica/followers", "following_url": "https://api.github.com/users/codeforamerica/following{/other_user}", "gists_url": "https://api.github.com/users/codeforamerica/gists{/gist_id}", "starred_url": "https://api.github.com/users/codeforamerica/starred{/owner}{/repo}", "subscriptions_url": "https://api.github.com/users/codeforamerica/subscriptions", "organizations_url": "https://api.github.com/users/codeforamerica/orgs", "repos_url": "https://api.github.com/users/codeforamerica/repos", "events_url": "https://api.github.com/users/codeforamerica/events{/privacy}", "received_events_url": "https://api.github.com/users/codeforamerica/received_events", "type": "Organization", "site_admin": false }, "private": false, "html_url": "https://github.com/codeforamerica/cityvoice", "description": "A place-based call-in system for gathering and sharing community feedback", "fork": false, "url": "https://api.github.com/repos/codeforamerica/cityvoice", "forks_url": "https://api.github.com/repos/codeforamerica/cityvoice/forks", "keys_url": "https://api.github.com/repos/codeforamerica/cityvoice/keys{/key_id}", "collaborators_url": "https://api.github.com/repos/codeforamerica/cityvoice/collaborators{/collaborator}", "teams_url": "https://api.github.com/repos/codeforamerica/cityvoice/teams", "hooks_url": "https://api.github.com/repos/codeforamerica/cityvoice/hooks", "issue_events_url": "https://api.github.com/repos/codeforamerica/cityvoice/issues/events{/number}", "events_url": "https://api.github.com/repos/codeforamerica/cityvoice/events", "assignees_url": "https://api.github.com/repos/codeforamerica/cityvoice/assignees{/user}", "branches_url": "https://api.github.com/repos/codeforamerica/cityvoice/branches{/branch}", "tags_url": "https://api.github.com/repos/codeforamerica/cityvoice/tags", "blobs_url": "https://api.github.com/repos/codeforamerica/cityvoice/git/blobs{/sha}", "git_tags_url": "https://api.github.com/repos/codeforamerica/cityvoice/git/tags{/sha}", "git_refs_url": "https://api.github.com/repos/codeforamerica/cityvoice/git/refs{/sha}", "trees_url": "https://api.github.com/repos/codeforamerica/cityvoice/git/trees{/sha}", "statuses_url": "https://api.github.com/repos/codeforamerica/cityvoice/statuses/{sha}", "languages_url": "https://api.github.com/repos/codeforamerica/cityvoice/languages", "stargazers_url": "https://api.github.com/repos/codeforamerica/cityvoice/stargazers", "contributors_url": "https://api.github.com/repos/codeforamerica/cityvoice/contributors", "subscribers_url": "https://api.github.com/repos/codeforamerica/cityvoice/subscribers", "subscription_url": "https://api.github.com/repos/codeforamerica/cityvoice/subscription", "commits_url": "https://api.github.com/repos/codeforamerica/cityvoice/commits{/sha}", "git_commits_url": "https://api.github.com/repos/codeforamerica/cityvoice/git/commits{/sha}", "comments_url": "https://api.github.com/repos/codeforamerica/cityvoice/comments{/number}", "issue_comment_url": "https://api.github.com/repos/codeforamerica/cityvoice/issues/comments/{number}", "contents_url": "https://api.github.com/repos/codeforamerica/cityvoice/contents/{+path}", "compare_url": "https://api.github.com/repos/codeforamerica/cityvoice/compare/{base}...{head}", "merges_url": "https://api.github.com/repos/codeforamerica/cityvoice/merges", "archive_url": "https://api.github.com/repos/codeforamerica/cityvoice/{archive_format}{/ref}", "downloads_url": "https://api.github.com/repos/codeforamerica/cityvoice/downloads", "issues_url": "https://api.github.com/repos/codeforamerica/cityvoice/issues{/number}", "pulls_url": "https://api.github.com/repos/codeforamerica/cityvoice/pulls{/number}", "milestones_url": "https://api.github.com/repos/codeforamerica/cityvoice/milestones{/number}", "notifications_url": "https://api.github.com/repos/codeforamerica/cityvoice/notifications{?since,all,participating}", "labels_url": "https://api.github.com/repos/codeforamerica/cityvoice/labels{/name}", "releases_url": "https://api.github.com/repos/codeforamerica/cityvoice/releases{/id}", "created_at": "2013-06-06T00:12:30Z", "updated_at": "2014-02-21T20:43:16Z", "pushed_at": "2014-02-21T20:43:16Z", "git_url": "git://github.com/codeforamerica/cityvoice.git", "ssh_url": "git@github.com:codeforamerica/cityvoice.git", "clone_url": "https://github.com/codeforamerica/cityvoice.git", "svn_url": "https://github.com/codeforamerica/cityvoice", "homepage": "http://www.cityvoiceapp.com/", "size": 6290, "stargazers_count": 10, "watchers_count": 10, "language": "Ruby", "has_issues": true, "has_downloads": true, "has_wiki": true, "forks_count": 12, "mirror_url": null, "open_issues_count": 37, "forks": 12, "open_issues": 37, "watchers": 10, "default_branch": "master", "master_branch": "master", "organization": { "login": "codeforamerica", "id": 337792, "avatar_url": "https://avatars.githubusercontent.com/u/337792", "gravatar_id": "ec81184c572bc827b72ebb489d49f821", "url": "https://api.github.com/users/codeforamerica", "html_url": "https://github.com/codeforamerica", "followers_url": "https://api.github.com/users/codeforamerica/followers", "following_url": "https://api.github.com/users/codeforamerica/following{/other_user}", "gists_url": "https://api.github.com/users/codeforamerica/gists{/gist_id}", "starred_url": "https://api.github.com/users/codeforamerica/starred{/owner}{/repo}", "subscriptions_url": "https://api.github.com/users/codeforamerica/subscriptions", "organizations_url": "https://api.github.com/users/codeforamerica/orgs", "repos_url": "https://api.github.com/users/codeforamerica/repos", "events_url": "https://api.github.com/users/codeforamerica/events{/privacy}", "received_events_url": "https://api.github.com/users/codeforamerica/received_events", "type": "Organization", "site_admin": false }, "network_count": 12, "subscribers_count": 42 }''', {'last-modified': datetime.datetime.strptime('Fri, 15 Nov 2013 00:08:07 GMT',"%a, %d %b %Y %H:%M:%S GMT")})
+            return response(200, '''{ "id": 10515516, "name": "cityvoice", "full_name": "codeforamerica/cityvoice", "owner": { "login": "codeforamerica", "id": 337792, "avatar_url": "https://avatars.githubusercontent.com/u/337792", "gravatar_id": "ec81184c572bc827b72ebb489d49f821", "url": "https://api.github.com/users/codeforamerica", "html_url": "https://github.com/codeforamerica", "followers_url": "https://api.github.com/users/codeforamerica/followers", "following_url": "https://api.github.com/users/codeforamerica/following{/other_user}", "gists_url": "https://api.github.com/users/codeforamerica/gists{/gist_id}", "starred_url": "https://api.github.com/users/codeforamerica/starred{/owner}{/repo}", "subscriptions_url": "https://api.github.com/users/codeforamerica/subscriptions", "organizations_url": "https://api.github.com/users/codeforamerica/orgs", "repos_url": "https://api.github.com/users/codeforamerica/repos", "events_url": "https://api.github.com/users/codeforamerica/events{/privacy}", "received_events_url": "https://api.github.com/users/codeforamerica/received_events", "type": "Organization", "site_admin": false }, "private": false, "html_url": "https://github.com/codeforamerica/cityvoice", "description": "A place-based call-in system for gathering and sharing community feedback", "fork": false, "url": "https://api.github.com/repos/codeforamerica/cityvoice", "forks_url": "https://api.github.com/repos/codeforamerica/cityvoice/forks", "keys_url": "https://api.github.com/repos/codeforamerica/cityvoice/keys{/key_id}", "collaborators_url": "https://api.github.com/repos/codeforamerica/cityvoice/collaborators{/collaborator}", "teams_url": "https://api.github.com/repos/codeforamerica/cityvoice/teams", "hooks_url": "https://api.github.com/repos/codeforamerica/cityvoice/hooks", "issue_events_url": "https://api.github.com/repos/codeforamerica/cityvoice/issues/events{/number}", "events_url": "https://api.github.com/repos/codeforamerica/cityvoice/events", "assignees_url": "https://api.github.com/repos/codeforamerica/cityvoice/assignees{/user}", "branches_url": "https://api.github.com/repos/codeforamerica/cityvoice/branches{/branch}", "tags_url": "https://api.github.com/repos/codeforamerica/cityvoice/tags", "blobs_url": "https://api.github.com/repos/codeforamerica/cityvoice/git/blobs{/sha}", "git_tags_url": "https://api.github.com/repos/codeforamerica/cityvoice/git/tags{/sha}", "git_refs_url": "https://api.github.com/repos/codeforamerica/cityvoice/git/refs{/sha}", "trees_url": "https://api.github.com/repos/codeforamerica/cityvoice/git/trees{/sha}", "statuses_url": "https://api.github.com/repos/codeforamerica/cityvoice/statuses/{sha}", "languages_url": "https://api.github.com/repos/codeforamerica/cityvoice/languages", "stargazers_url": "https://api.github.com/repos/codeforamerica/cityvoice/stargazers", "contributors_url": "https://api.github.com/repos/codeforamerica/cityvoice/contributors", "subscribers_url": "https://api.github.com/repos/codeforamerica/cityvoice/subscribers", "subscription_url": "https://api.github.com/repos/codeforamerica/cityvoice/subscription", "commits_url": "https://api.github.com/repos/codeforamerica/cityvoice/commits{/sha}", "git_commits_url": "https://api.github.com/repos/codeforamerica/cityvoice/git/commits{/sha}", "comments_url": "https://api.github.com/repos/codeforamerica/cityvoice/comments{/number}", "issue_comment_url": "https://api.github.com/repos/codeforamerica/cityvoice/issues/comments/{number}", "contents_url": "https://api.github.com/repos/codeforamerica/cityvoice/contents/{+path}", "compare_url": "https://api.github.com/repos/codeforamerica/cityvoice/compare/{base}...{head}", "merges_url": "https://api.github.com/repos/codeforamerica/cityvoice/merges", "archive_url": "https://api.github.com/repos/codeforamerica/cityvoice/{archive_format}{/ref}", "downloads_url": "https://api.github.com/repos/codeforamerica/cityvoice/downloads", "issues_url": "https://api.github.com/repos/codeforamerica/cityvoice/issues{/number}", "pulls_url": "https://api.github.com/repos/codeforamerica/cityvoice/pulls{/number}", "milestones_url": "https://api.github.com/repos/codeforamerica/cityvoice/milestones{/number}", "notifications_url": "https://api.github.com/repos/codeforamerica/cityvoice/notifications{?since,all,participating}", "labels_url": "https://api.github.com/repos/codeforamerica/cityvoice/labels{/name}", "releases_url": "https://api.github.com/repos/codeforamerica/cityvoice/releases{/id}", "created_at": "2013-06-06T00:12:30Z", "updated_at": "2014-02-21T20:43:16Z", "pushed_at": "2014-02-21T20:43:16Z", "git_url": "git://github.com/codeforamerica/cityvoice.git", "ssh_url": "git@github.com:codeforamerica/cityvoice.git", "clone_url": "https://github.com/codeforamerica/cityvoice.git", "svn_url": "https://github.com/codeforamerica/cityvoice", "homepage": "http://www.cityvoiceapp.com/", "size": 6290, "stargazers_count": 10, "watchers_count": 10, "language": "Ruby", "has_issues": true, "has_downloads": true, "has_wiki": true, "forks_count": 12, "mirror_url": null, "open_issues_count": 37, "forks": 12, "open_issues": 37, "watchers": 10, "default_branch": "master", "master_branch": "master", "organization": { "login": "codeforamerica", "id": 337792, "avatar_url": "https://avatars.githubusercontent.com/u/337792", "gravatar_id": "ec81184c572bc827b72ebb489d49f821", "url": "https://api.github.com/users/codeforamerica", "html_url": "https://github.com/codeforamerica", "followers_url": "https://api.github.com/users/codeforamerica/followers", "following_url": "https://api.github.com/users/codeforamerica/following{/other_user}", "gists_url": "https://api.github.com/users/codeforamerica/gists{/gist_id}", "starred_url": "https://api.github.com/users/codeforamerica/starred{/owner}{/repo}", "subscriptions_url": "https://api.github.com/users/codeforamerica/subscriptions", "organizations_url": "https://api.github.com/users/codeforamerica/orgs", "repos_url": "https://api.github.com/users/codeforamerica/repos", "events_url": "https://api.github.com/users/codeforamerica/events{/privacy}", "received_events_url": "https://api.github.com/users/codeforamerica/received_events", "type": "Organization", "site_admin": false }, "network_count": 12, "subscribers_count": 42 }''', {'last-modified': 'Fri, 15 Nov 2013 00:08:07 GMT'})
 
         elif url.geturl() == 'https://api.github.com/repos/codeforamerica/cityvoice/contributors':
             return response(200, '''[ { "login": "daguar", "id": 994938, "avatar_url": "https://avatars.githubusercontent.com/u/994938", "gravatar_id": "bdd8cc46ae86e389388ae78dfc45effe", "url": "https://api.github.com/users/daguar", "html_url": "https://github.com/daguar", "followers_url": "https://api.github.com/users/daguar/followers", "following_url": "https://api.github.com/users/daguar/following{/other_user}", "gists_url": "https://api.github.com/users/daguar/gists{/gist_id}", "starred_url": "https://api.github.com/users/daguar/starred{/owner}{/repo}", "subscriptions_url": "https://api.github.com/users/daguar/subscriptions", "organizations_url": "https://api.github.com/users/daguar/orgs", "repos_url": "https://api.github.com/users/daguar/repos", "events_url": "https://api.github.com/users/daguar/events{/privacy}", "received_events_url": "https://api.github.com/users/daguar/received_events", "type": "User", "site_admin": false, "contributions": 518 }, { "login": "rduecyg", "id": 1710759, "avatar_url": "https://avatars.githubusercontent.com/u/1710759", "gravatar_id": "ca617a981a0ba8423eb849843b21693c", "url": "https://api.github.com/users/rduecyg", "html_url": "https://github.com/rduecyg", "followers_url": "https://api.github.com/users/rduecyg/followers", "following_url": "https://api.github.com/users/rduecyg/following{/other_user}", "gists_url": "https://api.github.com/users/rduecyg/gists{/gist_id}", "starred_url": "https://api.github.com/users/rduecyg/starred{/owner}{/repo}", "subscriptions_url": "https://api.github.com/users/rduecyg/subscriptions", "organizations_url": "https://api.github.com/users/rduecyg/orgs", "repos_url": "https://api.github.com/users/rduecyg/repos", "events_url": "https://api.github.com/users/rduecyg/events{/privacy}", "received_events_url": "https://api.github.com/users/rduecyg/received_events", "type": "User", "site_admin": false, "contributions": 159 }, { "login": "mholubowski", "id": 2035619, "avatar_url": "https://avatars.githubusercontent.com/u/2035619", "gravatar_id": "76743e4c14368f817ea4fff3c7e72b34", "url": "https://api.github.com/users/mholubowski", "html_url": "https://github.com/mholubowski", "followers_url": "https://api.github.com/users/mholubowski/followers", "following_url": "https://api.github.com/users/mholubowski/following{/other_user}", "gists_url": "https://api.github.com/users/mholubowski/gists{/gist_id}", "starred_url": "https://api.github.com/users/mholubowski/starred{/owner}{/repo}", "subscriptions_url": "https://api.github.com/users/mholubowski/subscriptions", "organizations_url": "https://api.github.com/users/mholubowski/orgs", "repos_url": "https://api.github.com/users/mholubowski/repos", "events_url": "https://api.github.com/users/mholubowski/events{/privacy}", "received_events_url": "https://api.github.com/users/mholubowski/received_events", "type": "User", "site_admin": false, "contributions": 26 }, { "login": "mick", "id": 26278, "avatar_url": "https://avatars.githubusercontent.com/u/26278", "gravatar_id": "0a57f29a6d300554ed45c80b4e37ab49", "url": "https://api.github.com/users/mick", "html_url": "https://github.com/mick", "followers_url": "https://api.github.com/users/mick/followers", "following_url": "https://api.github.com/users/mick/following{/other_user}", "gists_url": "https://api.github.com/users/mick/gists{/gist_id}", "starred_url": "https://api.github.com/users/mick/starred{/owner}{/repo}", "subscriptions_url": "https://api.github.com/users/mick/subscriptions", "organizations_url": "https://api.github.com/users/mick/orgs", "repos_url": "https://api.github.com/users/mick/repos", "events_url": "https://api.github.com/users/mick/events{/privacy}", "received_events_url": "https://api.github.com/users/mick/received_events", "type": "User", "site_admin": false, "contributions": 1 }, { "login": "migurski", "id": 58730, "avatar_url": "https://avatars.githubusercontent.com/u/58730", "gravatar_id": "039667155d1baa533e461671e97891a1", "url": "https://api.github.com/users/migurski", "html_url": "https://github.com/migurski", "followers_url": "https://api.github.com/users/migurski/followers", "following_url": "https://api.github.com/users/migurski/following{/other_user}", "gists_url": "https://api.github.com/users/migurski/gists{/gist_id}", "starred_url": "https://api.github.com/users/migurski/starred{/owner}{/repo}", "subscriptions_url": "https://api.github.com/users/migurski/subscriptions", "organizations_url": "https://api.github.com/users/migurski/orgs", "repos_url": "https://api.github.com/users/migurski/repos", "events_url": "https://api.github.com/users/migurski/events{/privacy}", "received_events_url": "https://api.github.com/users/migurski/received_events", "type": "User", "site_admin": false, "contributions": 1 } ]''')
@@ -129,6 +129,7 @@ class RunUpdateTestCase(unittest.TestCase):
         organization = self.db.session.query(Organization).filter(filter).first()
         self.assertIsNotNone(organization)
         self.assertEqual(organization.name,u'Cöde for Ameriça')
+        self.assertEqual(organization.slug,u'Cöde-for-Ameriça')
 
         # check for the one project
         filter = Project.name == 'SouthBendVoices'
@@ -142,12 +143,24 @@ class RunUpdateTestCase(unittest.TestCase):
         self.assertIsNotNone(project)
         self.assertEqual(project.name,'cityvoice')
 
+        # check that Github details were copied to their own columns
+        self.assertEqual((project.language, project.watchers_count, project.forks_count, project.open_issues),
+                         ('Ruby', 10, 12, 37))
+        self.assertEqual(project.pushed_at, datetime.datetime(2014, 2, 21, 20, 43, 16))
+
         # check for cityvoice project's issues
         filter = Issue.project_id == project.id
         issue = self.db.session.query(Issue).filter(filter).first()
         self.assertIsNotNone(issue)
         self.assertEqual(issue.title, 'Important cityvoice issue')
 
+        # check that the project and issue were indexed for search
+        from app import SearchDocument
+        document = self.db.session.query(SearchDocument).filter(SearchDocument.project_id == project.id).one()
+        self.assertEqual((document.kind, document.title), ('project', 'cityvoice'))
+        document = self.db.session.query(SearchDocument).filter(SearchDocument.issue_id == issue.id).one()
+        self.assertEqual((document.kind, document.title), ('issue', 'Important cityvoice issue'))
+
     def test_import_with_times(self):
         ''' Test passage of time on organization updates.
         '''
@@ -204,6 +217,36 @@ class RunUpdateTestCase(unittest.TestCase):
         org = self.db.session.query(Organization).first()
         self.assertTrue(org.last_updated >= time() - 1)
 
+    def test_main_bumps_generation(self):
+        ''' Each committed organization update moves on to a new data generation.
+        '''
+        def response_content(url, request):
+            if "docs.google.com" in url:
+                return response(200, '''name,website,events_url,rss,projects_list_url\nCfA,,,,''')
+
+        from app import DataGeneration
+
+        with HTTMock(response_content):
+            import run_update
+            run_update.main(minimum_age=10, org_sources="test_org_sources.csv")
+
+        generation = self.db.session.query(DataGeneration).first().generation
+        self.db.session.commit()
+
+        # Too soon to update CfA again, so nothing changes.
+        with HTTMock(response_content):
+            import run_update
+            run_update.main(minimum_age=10, org_sources="test_org_sources.csv")
+
+        self.assertEqual(self.db.session.query(DataGeneration).first().generation, generation)
+        self.db.session.commit()
+
+        with HTTMock(response_content):
+            import run_update
+            run_update.main(org_name='CfA', org_sources="test_org_sources.csv")
+
+        self.assertEqual(self.db.session.query(DataGeneration).first().generation, generation + 1)
+
     def test_main_with_good_new_data(self):
         ''' When current organization data is not the same set as existing, saved organization data,
             the new organization, its project, and events should be saved. The out of date
@@ -253,6 +296,22 @@ class RunUpdateTestCase(unittest.TestCase):
         organization = self.db.session.query(Organization).filter(filter).first()
         self.assertEqual(organization.name, u'Cöde for Ameriça')
 
+        # check that the organization was summarized as of this update
+        from app import OrganizationSummary, SUMMARY_ROOT
+        summary = self.db.session.query(OrganizationSummary).get(organization.id)
+        self.assertEqual((summary.project_count, summary.issue_count, summary.upcoming_event_count, summary.story_count),
+                         (len(organization.projects), sum([len(project.issues) for project in organization.projects]),
+                          0, len(organization.stories)))
+
+        # all of the events are in 2014
+        self.assertEqual(summary.current_events, [])
+        self.assertTrue(summary.current_projects[0]['api_url'].startswith(SUMMARY_ROOT + '/api/projects/'))
+
+        # project update times are summarized as saved, not as Github sent them
+        for summarized in summary.current_projects:
+            project = self.db.session.query(Project).get(summarized['id'])
+            self.assertEqual(summarized['last_updated'], project.last_updated and project.last_updated.isoformat())
+
         # check for the one project
         filter = Project.name == 'SouthBendVoices'
         project = self.db.session.query(Project).filter(filter).first()
@@ -287,6 +346,29 @@ class RunUpdateTestCase(unittest.TestCase):
         self.assertEqual(third_event.start_time_notz, datetime.datetime(2014, 3, 5, 17, 30, 0))
         self.assertEqual(third_event.name, 'Brigade Ideation (Brainstorm and Prototyping) Session.')
 
+    def test_main_keeps_updated_at(self):
+        ''' Updating with the same data again doesn't count as a change to any row.
+        '''
+        self.mock_rss_response()
+
+        def updated_at():
+            return [self.db.session.execute('SELECT id, updated_at FROM %s ORDER BY id' % table).fetchall()
+                    for table in ('organization', 'project', 'issue', 'event', 'story')]
+
+        with HTTMock(self.response_content):
+            import run_update
+            run_update.main(org_sources="test_org_sources.csv")
+
+        first = updated_at()
+        self.assertTrue(all(first))
+        self.db.session.commit()
+
+        with HTTMock(self.response_content):
+            import run_update
+            run_update.main(minimum_age=0, org_sources="test_org_sources.csv")
+
+        self.assertEqual(updated_at(), first)
+
     def test_main_with_missing_projects(self):
         ''' When github returns a 404 when trying to retrieve project data,
             an error message should be logged.
@@ -503,6 +585,26 @@ class RunUpdateTestCase(unittest.TestCase):
         error = self.db.session.query(Error).first()
         self.assertEqual(error.error, "IOError: We done got throttled by GitHub")
 
+    def test_save_project_without_github_details(self):
+        ''' Projects saved without Github details keep the values copied from earlier ones.
+        '''
+        from factories import OrganizationFactory
+        organization = OrganizationFactory(name=u'Code for San Francisco')
+        self.db.session.flush()
+
+        import run_update
+        project_info = dict(name=u'cityvoice', code_url=u'https://github.com/codeforamerica/cityvoice',
+                            organization_name=organization.name)
+        github_details = dict(language=u'Ruby', watchers_count=10, pushed_at=u'2014-02-21T20:43:16Z')
+
+        run_update.save_project_info(self.db.session, dict(project_info, github_details=github_details))
+        self.db.session.flush()
+
+        project = run_update.save_project_info(self.db.session, project_info)
+
+        self.assertEqual((project.github_details, project.language, project.watchers_count),
+                         (github_details, u'Ruby', 10))
+
     def test_csv_sniffer(self):
         '''
         Testing weird csv dialects we've encountered
@@ -545,11 +647,11 @@ class RunUpdateTestCase(unittest.TestCase):
             import run_update
             projects = run_update.get_projects(whatever)
             self.assertEqual(projects[0]['name'], "OpenPhillyGlobe")
-            self.assertEqual(projects[0]['last_updated'], datetime.datetime.now().strftime("%a, %d %b %Y %H:%M:%S %Z"))
+            self.assertEqual(projects[0]['last_updated'].replace(microsecond=0), datetime.datetime.now().replace(microsecond=0))
 
             projects = run_update.get_projects(gdocs)
             self.assertEqual(projects[0]['name'], "Hack Task Aggregator")
-            self.assertEqual(projects[0]['last_updated'], datetime.datetime.now().strftime("%a, %d %b %Y %H:%M:%S %Z"))
+            self.assertEqual(projects[0]['last_updated'].replace(microsecond=0), datetime.datetime.now().replace(microsecond=0))
 
     def test_org_sources_csv(self):
         '''Test that there is a csv file with links to lists of organizations
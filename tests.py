@@ -1,11 +1,13 @@
 #!/usr/bin/env python
 # -*- coding: utf8 -*-
 
-import unittest, requests, json, os
+import unittest, requests, json, os, base64, gzip, zlib, struct, msgpack
+from StringIO import StringIO
 from datetime import datetime, timedelta
 from urlparse import urlparse
+from sqlalchemy import event
 
-from app import app, db, Organization, Project, Event, Story, Issue, Label
+from app import app, db, Organization, Project, Event, Story, Issue, Label, SearchDocument, OrganizationSummary, SUMMARY_ROOT, bump_generation, load_organization_extras, rebuild_search_index, index_search_document, search_query, issues_with_labels, response_cache, STREAM_BATCH_SIZE
 from factories import OrganizationFactory, ProjectFactory, EventFactory, StoryFactory, IssueFactory, LabelFactory
 
 class ApiTest(unittest.TestCase):
@@ -20,6 +22,27 @@ class ApiTest(unittest.TestCase):
         db.session.close()
         db.drop_all()
 
+    def record_queries(self, url):
+        ''' Return the SQL statements run to answer a GET request.
+        '''
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            self.app.get(url)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+
+        return statements
+
+    def count_queries(self, url):
+        ''' Return the number of SQL statements run to answer a GET request.
+        '''
+        return len(self.record_queries(url))
+
     # Test API -----------------------
     def test_current_projects(self):
         '''
@@ -80,6 +103,41 @@ class ApiTest(unittest.TestCase):
         self.assertEqual(response['objects'][2]['name'], "Project 2")
         self.assertEqual(response['objects'][3]['name'], "Project 1")
 
+    def test_projects_query_count(self):
+        '''
+        Issues and labels for a page of projects are loaded all at once
+        '''
+        organization = OrganizationFactory(name='Code for San Francisco')
+        db.session.flush()
+
+        project = ProjectFactory(organization_name=organization.name)
+        db.session.flush()
+        issue = IssueFactory(project_id=project.id)
+        db.session.flush()
+        issue.labels = [LabelFactory()]
+        db.session.commit()
+
+        urls = ('/api/projects', '/api/organizations/Code-for-San-Francisco/projects')
+        one_project = [self.count_queries(url) for url in urls]
+
+        for _ in range(3):
+            project = ProjectFactory(organization_name=u'Code for San Francisco')
+            db.session.flush()
+            for _ in range(2):
+                issue = IssueFactory(project_id=project.id)
+                db.session.flush()
+                issue.labels = [LabelFactory(), LabelFactory()]
+        db.session.commit()
+
+        self.assertEqual([self.count_queries(url) for url in urls], one_project)
+
+        response = self.app.get('/api/projects')
+        response = json.loads(response.data)
+        self.assertEqual(len(response['objects']), 4)
+        issues = [issue for project in response['objects'] for issue in project['issues']]
+        self.assertEqual(len(issues), 7)
+        self.assertEqual(sum([len(issue['labels']) for issue in issues]), 13)
+
     def test_current_events(self):
         '''
         The three soonest upcoming events should be returned.
@@ -165,6 +223,36 @@ class ApiTest(unittest.TestCase):
         self.assertEqual(response_json['current_stories'][0]['title'], 'First Story')
         self.assertEqual(response_json['current_stories'][1]['title'], 'Second Story')
 
+    def test_organizations_query_count(self):
+        '''
+        Current events, projects and stories are loaded for a page of organizations at once
+        '''
+        def add_organization():
+            organization_name = OrganizationFactory().name
+            db.session.flush()
+            for days in (1, 2, 3):
+                EventFactory(organization_name=organization_name, start_time_notz=datetime.now() + timedelta(days))
+                ProjectFactory(organization_name=organization_name)
+                StoryFactory(organization_name=organization_name)
+            db.session.commit()
+
+        add_organization()
+        one_organization = self.count_queries('/api/organizations')
+
+        for _ in range(4):
+            add_organization()
+
+        self.assertEqual(self.count_queries('/api/organizations'), one_organization)
+
+        response = self.app.get('/api/organizations')
+        response = json.loads(response.data)
+        self.assertEqual(len(response['objects']), 5)
+        for organization in response['objects']:
+            self.assertEqual(len(organization['current_events']), 2)
+            self.assertEqual(len(organization['current_projects']), 3)
+            self.assertEqual(len(organization['current_stories']), 2)
+            self.assertEqual(organization['current_events'][0]['organization_name'], organization['name'])
+
     def test_headers(self):
         OrganizationFactory()
         db.session.flush()
@@ -221,7 +309,7 @@ class ApiTest(unittest.TestCase):
         ProjectFactory()
         db.session.flush()
 
-        response = self.app.get('/api/projects')
+        response = self.app.get('/api/projects?expand=organization')
         response = json.loads(response.data)
         assert isinstance(response, dict)
         assert isinstance(response['pages'], dict)
@@ -254,6 +342,716 @@ class ApiTest(unittest.TestCase):
         self.assertNotIn('first', response['pages'])
         self.assertNotIn('prev', response['pages'])
 
+    def test_cursor_pagination(self):
+        ProjectFactory(name="Project 1", last_updated="Mon, 01 Jan 2010 00:00:00 GMT")
+        ProjectFactory(name="Project 2", last_updated="Tue, 01 Jan 2011 00:00:00 GMT")
+        ProjectFactory(name="Project 3", last_updated="Tue, 01 Jan 2011 00:00:00 GMT")
+        ProjectFactory(name="Project 4", last_updated="Thu, 01 Jan 2014 00:00:00 GMT")
+        ProjectFactory(name="Not Updated Project")
+        db.session.commit()
+
+        response = self.app.get('/api/projects?per_page=2&cursor=')
+        response = json.loads(response.data)
+        self.assertEqual([p['name'] for p in response['objects']], ["Not Updated Project", "Project 4"])
+        self.assertNotIn('total', response)
+        self.assertNotIn('prev', response['pages'])
+
+        names = [p['name'] for p in response['objects']]
+        while 'next' in response['pages']:
+            response = json.loads(self.app.get(response['pages']['next'].replace('http://localhost', '')).data)
+            names += [p['name'] for p in response['objects']]
+
+        self.assertEqual(names, ["Not Updated Project", "Project 4", "Project 3", "Project 2", "Project 1"])
+
+        # Walk back from the last page
+        response = json.loads(self.app.get(response['pages']['prev'].replace('http://localhost', '')).data)
+        self.assertEqual([p['name'] for p in response['objects']], ["Project 3", "Project 2"])
+        response = json.loads(self.app.get(response['pages']['prev'].replace('http://localhost', '')).data)
+        self.assertEqual([p['name'] for p in response['objects']], ["Not Updated Project", "Project 4"])
+        self.assertNotIn('prev', response['pages'])
+
+        response = self.app.get('/api/projects?per_page=2&cursor=&total=true')
+        response = json.loads(response.data)
+        self.assertEqual(response['total'], 5)
+        self.assertTrue('total=true' in response['pages']['next'])
+
+        response = self.app.get('/api/projects?cursor=garbage')
+        self.assertEqual(response.status_code, 400)
+
+        # Valid JSON that isn't a cursor object
+        for cursor in ('[1,2]', '5', '{"after": 5}', '{"after": [1]}', '{"after": [1, 2], "before": [1, 2]}'):
+            response = self.app.get('/api/projects?cursor=%s' % base64.urlsafe_b64encode(cursor))
+            self.assertEqual(response.status_code, 400)
+
+    def test_count_cache(self):
+        '''
+        Listing totals are counted once and cached for a data generation
+        '''
+        ProjectFactory(type="web service")
+        db.session.commit()
+
+        def count_statements(url):
+            statements = []
+            def count(conn, cursor, statement, parameters, context, executemany):
+                if 'count(' in statement:
+                    statements.append(statement)
+            event.listen(db.engine, 'before_cursor_execute', count)
+            try:
+                response = json.loads(self.app.get(url).data)
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', count)
+            return response['total'], len(statements)
+
+        # Without a data generation, nothing is cached
+        self.assertEqual(count_statements('/api/projects'), (1, 1))
+        self.assertEqual(count_statements('/api/projects'), (1, 1))
+
+        bump_generation(db.session)
+        db.session.commit()
+
+        self.assertEqual(count_statements('/api/projects'), (1, 1))
+        self.assertEqual(count_statements('/api/projects?page=2'), (1, 0))
+        self.assertEqual(count_statements('/api/projects?type=web'), (1, 1))
+
+        # New data is only counted once the generation moves on
+        ProjectFactory(type="web service")
+        db.session.commit()
+        self.assertEqual(count_statements('/api/projects'), (1, 0))
+
+        bump_generation(db.session)
+        db.session.commit()
+        self.assertEqual(count_statements('/api/projects'), (2, 1))
+        self.assertEqual(count_statements('/api/projects?type=web'), (2, 1))
+
+    def test_organization_slugs(self):
+        '''
+        Organizations are found by URL slug, once per data generation
+        '''
+        organization = OrganizationFactory(name=u'Code for San Francisco')
+        db.session.commit()
+
+        self.assertEqual(organization.slug, u'Code-for-San-Francisco')
+        self.assertFalse('slug' in json.loads(self.app.get('/api/organizations/Code-for-San-Francisco').data))
+
+        for name in ('Code-for-San-Francisco', 'Code_for_San_Francisco', 'Code for San Francisco'):
+            self.assertEqual(self.app.get('/api/organizations/%s/projects' % name).status_code, 200)
+
+        self.assertEqual(self.app.get('/api/organizations/Code-for-Nowhere/projects').status_code, 404)
+
+        bump_generation(db.session)
+        db.session.commit()
+
+        def organization_queries(url):
+            return [statement for statement in self.record_queries(url) if 'organization.slug' in statement]
+
+        # The first lookup reads the slug index, later ones are remembered
+        self.assertEqual(len(organization_queries('/api/organizations/Code-for-San-Francisco/events')), 1)
+        self.assertEqual(len(organization_queries('/api/organizations/Code-for-San-Francisco/stories')), 0)
+        self.assertEqual(len(organization_queries('/api/organizations/Code_for_San_Francisco/issues')), 0)
+
+    def test_organization_rename(self):
+        '''
+        Projects, events and stories follow their organization by id
+        '''
+        organization = OrganizationFactory(name=u'Code for Old Town')
+        db.session.flush()
+
+        project = ProjectFactory(organization_name=u'Code for Old Town')
+        hack_night = EventFactory(organization_name=u'Code for Old Town')
+        story = StoryFactory(organization_name=u'Code for Old Town')
+        db.session.commit()
+
+        self.assertEqual([project.organization_id, hack_night.organization_id, story.organization_id], [organization.id] * 3)
+
+        # A name that matches no organization is an error, as it was with name keys
+        ProjectFactory(organization_name=u'Code for Nowhere')
+        self.assertRaises(ValueError, db.session.flush)
+        db.session.rollback()
+
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            organization.name, organization.slug = u'Code for New Town', u'Code-for-New-Town'
+            db.session.commit()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+
+        # Renaming only touches the organization row
+        self.assertEqual([statement.split()[1] for statement in statements if statement.startswith('UPDATE')], ['organization'])
+
+        for kind in ('projects', 'events', 'stories'):
+            response = json.loads(self.app.get('/api/%s' % kind).data)
+            self.assertEqual(response['objects'][0]['organization_name'], u'Code for New Town')
+            self.assertFalse('organization_id' in response['objects'][0])
+
+        response = json.loads(self.app.get('/api/organizations/Code-for-New-Town').data)
+        self.assertEqual(response['current_projects'][0]['organization_name'], u'Code for New Town')
+        self.assertFalse('id' in response)
+
+        response = json.loads(self.app.get('/api/projects?organization_name=new town').data)
+        self.assertEqual(response['total'], 1)
+
+    def test_organization_summary(self):
+        '''
+        A saved organization summary is served in place of live queries
+        '''
+        organization = OrganizationFactory(name=u'Code for San Francisco')
+        db.session.flush()
+
+        project = ProjectFactory(organization_name=u'Code for San Francisco')
+        db.session.flush()
+
+        IssueFactory(project_id=project.id)
+        EventFactory(organization_name=u'Code for San Francisco', start_time_notz=datetime.now() + timedelta(1))
+        StoryFactory(organization_name=u'Code for San Francisco')
+        db.session.commit()
+        organization_id, project_id = organization.id, project.id
+
+        live = json.loads(self.app.get('/api/organizations/Code-for-San-Francisco').data)
+        self.assertEqual(live['counts'], dict(projects=1, issues=1, upcoming_events=1, stories=1))
+
+        # Outside of a request, links are made under the summary root
+        extras = load_organization_extras([organization_id])[organization_id]
+        self.assertEqual(extras['current_projects'][0]['api_url'], '%s/api/projects/%d' % (SUMMARY_ROOT, project_id))
+
+        db.session.add(OrganizationSummary(organization_id, extras))
+        bump_generation(db.session)
+        db.session.commit()
+
+        statements = self.record_queries('/api/organizations/Code-for-San-Francisco')
+        summary = json.loads(self.app.get('/api/organizations/Code-for-San-Francisco').data)
+
+        # Links are moved from the summary root to the requested host
+        self.assertEqual(summary, live)
+        self.assertEqual(summary['current_projects'][0]['api_url'], 'http://localhost/api/projects/%d' % project_id)
+
+        # One read of the summary, and none of the live tables
+        self.assertEqual(len([statement for statement in statements if 'organization_summary' in statement]), 1)
+        self.assertFalse([statement for statement in statements if ' project' in statement or ' event' in statement or ' story' in statement])
+
+    def test_all_upcoming_events_streamed(self):
+        '''
+        Every upcoming event is streamed in chronological order
+        '''
+        organization_name = OrganizationFactory().name
+        db.session.flush()
+
+        EventFactory(organization_name=organization_name, name="Past Event", start_time_notz=datetime.now() - timedelta(10))
+        for days in range(120, 0, -1):
+            EventFactory(organization_name=organization_name, name="Event %d" % days, start_time_notz=datetime.now() + timedelta(days))
+        db.session.commit()
+
+        response = self.app.get('/api/events/upcoming_events/all')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_streamed)
+
+        response = json.loads(response.data)
+        self.assertEqual(response['total'], 120)
+        self.assertEqual([event['name'] for event in response['objects']], ["Event %d" % days for days in range(1, 121)])
+        self.assertEqual(response['objects'][0]['organization_name'], organization_name)
+
+        # Paged listings are limited to a hundred results per page
+        response = json.loads(self.app.get('/api/events/upcoming_events?per_page=1000').data)
+        self.assertEqual(len(response['objects']), 100)
+        self.assertEqual(response['total'], 120)
+
+    def test_streamed_batches(self):
+        '''
+        Streamed results carry on from one batch to the next without repeats or gaps
+        '''
+        organization = OrganizationFactory()
+        db.session.flush()
+
+        count = STREAM_BATCH_SIZE * 2 + 1
+        db.session.execute('''INSERT INTO event (name, organization_id, start_time_notz, utc_offset, keep)
+                              SELECT 'Event ' || n, :organization_id, now() + n * interval '1 hour', 0, true
+                              FROM generate_series(1, :count) AS n''', dict(organization_id=organization.id, count=count))
+        db.session.commit()
+
+        response = json.loads(self.app.get('/api/events/upcoming_events/all').data)
+        self.assertEqual(response['total'], count)
+        self.assertEqual([event['name'] for event in response['objects']], ['Event %d' % n for n in range(1, count + 1)])
+
+        events = [json.loads(line) for line in self.app.get('/api/export/events.ndjson').data.splitlines()]
+        self.assertEqual([event['id'] for event in events], range(events[0]['id'], events[0]['id'] + count))
+
+    def test_export(self):
+        '''
+        Every row of an entity is exported as newline-delimited JSON
+        '''
+        old_organization = OrganizationFactory(name=u'Old Brigade')
+        new_organization = OrganizationFactory(name=u'New Brigade')
+        db.session.flush()
+
+        old_project = ProjectFactory(organization_name=old_organization.name, name=u'Old Project')
+        new_project = ProjectFactory(organization_name=new_organization.name, name=u'New Project')
+        db.session.flush()
+
+        db.session.add(Issue(u'Old Issue', project_id=old_project.id))
+        db.session.add(Issue(u'New Issue', project_id=new_project.id))
+        EventFactory(organization_name=new_organization.name)
+        db.session.commit()
+
+        def export(url):
+            response = self.app.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.mimetype, 'application/x-ndjson')
+            return [json.loads(line) for line in response.data.splitlines()]
+
+        self.assertEqual([org['name'] for org in export('/api/export/organizations.ndjson')], [u'Old Brigade', u'New Brigade'])
+        self.assertEqual(len(export('/api/export/projects.ndjson')), 2)
+        self.assertEqual(len(export('/api/export/events.ndjson')), 1)
+        self.assertEqual(export('/api/export/stories.ndjson'), [])
+
+        issues = export('/api/export/issues.ndjson')
+        self.assertEqual([issue['title'] for issue in issues], [u'Old Issue', u'New Issue'])
+        self.assertEqual(issues[0]['project']['name'], u'Old Project')
+
+        # Only rows whose own data changed since then
+        for model in (Organization, Project, Issue, Event):
+            db.session.execute(db.update(model, values={'updated_at': datetime(2014, 1, 1)}))
+        db.session.commit()
+
+        db.session.query(Issue).filter(Issue.title == u'New Issue').one().body = u'Changed'
+        db.session.query(Organization).filter(Organization.name == u'New Brigade').one().city = u'New Town'
+
+        # Bookkeeping that run_update.py does on every run isn't a change
+        old_organization = db.session.query(Organization).filter(Organization.name == u'Old Brigade').one()
+        old_organization.keep, old_organization.last_updated = False, 3000
+        db.session.commit()
+
+        self.assertEqual([issue['title'] for issue in export('/api/export/issues.ndjson?since=1396310400')], [u'New Issue'])
+        self.assertEqual([org['name'] for org in export('/api/export/organizations.ndjson?since=2014-04-01T00:00:00Z')], [u'New Brigade'])
+        self.assertEqual(export('/api/export/projects.ndjson?since=2014-04-01'), [])
+        self.assertEqual(len(export('/api/export/projects.ndjson?since=2013-12-31')), 2)
+
+        self.assertEqual(self.app.get('/api/export/issues.ndjson?since=yesterday').status_code, 400)
+        self.assertEqual(self.app.get('/api/export/errors.ndjson').status_code, 404)
+
+    def test_organizations_geojson(self):
+        '''
+        Organizations come as GeoJSON features, optionally in a bounding box
+        '''
+        OrganizationFactory(name=u'Code for San Francisco', latitude=37.7749, longitude=-122.4194)
+        OrganizationFactory(name=u'Code for Oakland', latitude=37.8044, longitude=-122.2711)
+        OrganizationFactory(name=u'Code for Hawaii', latitude=21.3069, longitude=-157.8583)
+        OrganizationFactory(name=u'Code for Fiji', latitude=-18.1248, longitude=178.4501)
+        OrganizationFactory(name=u'Code for Nowhere', latitude=None, longitude=None)
+        db.session.commit()
+
+        def names(url):
+            response = self.app.get(url)
+            self.assertEqual(response.status_code, 200)
+            return [feature['properties']['name'] for feature in json.loads(response.data)['features']]
+
+        geojson = json.loads(self.app.get('/api/organizations.geojson').data)
+        self.assertEqual(geojson['type'], 'FeatureCollection')
+        self.assertEqual(len(geojson['features']), 5)
+        self.assertEqual(geojson['features'][-1]['id'], 'Code-for-San-Francisco')
+        self.assertEqual(geojson['features'][-1]['geometry'], dict(type='Point', coordinates=[-122.4194, 37.7749]))
+
+        self.assertEqual(names('/api/organizations.geojson?bbox=-123,37,-122,38'), [u'Code for Oakland', u'Code for San Francisco'])
+        self.assertEqual(names('/api/organizations.geojson?bbox=-122.3,37.5,-122,38'), [u'Code for Oakland'])
+        self.assertEqual(names('/api/organizations.geojson?bbox=-180,-90,180,90'), [u'Code for Fiji', u'Code for Hawaii', u'Code for Oakland', u'Code for San Francisco'])
+        self.assertEqual(names('/api/organizations.geojson?bbox=170,-30,-150,30'), [u'Code for Fiji', u'Code for Hawaii'])
+
+        geojson = json.loads(self.app.get('/api/organizations.geojson?bbox=-123,37,-122.3,38&fields=name,city').data)
+        self.assertEqual(geojson['features'][0]['properties'], dict(name=u'Code for San Francisco', city=u'San Francisco, CA'))
+
+        self.assertEqual(self.app.get('/api/organizations.geojson?bbox=1,2,3').status_code, 400)
+        for bbox in ('nan,0,1,1', '0,0,inf,1', '-181,0,1,1', '0,-91,1,1', '0,10,1,5'):
+            self.assertEqual(self.app.get('/api/organizations.geojson?bbox=%s' % bbox).status_code, 400)
+
+        # Features are built once for each data generation
+        bump_generation(db.session)
+        db.session.commit()
+        self.app.get('/api/organizations.geojson?bbox=-123,37,-122,38')
+        self.assertEqual(self.count_queries('/api/organizations.geojson?bbox=0,0,1,1'), 1)
+
+    def test_organizations_near(self):
+        '''
+        Find the organizations nearest to a location
+        '''
+        OrganizationFactory(name=u'Code for San Francisco', latitude=37.7749, longitude=-122.4194)
+        OrganizationFactory(name=u'Code for Oakland', latitude=37.8044, longitude=-122.2711)
+        OrganizationFactory(name=u'Code for Hawaii', latitude=21.3069, longitude=-157.8583)
+        OrganizationFactory(name=u'Code for Fiji', latitude=-18.1248, longitude=178.4501)
+        OrganizationFactory(name=u'Code for Nowhere', latitude=None, longitude=None)
+        db.session.commit()
+
+        def near(url):
+            response = self.app.get(url)
+            self.assertEqual(response.status_code, 200)
+            return json.loads(response.data)['objects']
+
+        orgs = near('/api/organizations/near?lat=37.8716&lon=-122.2727&k=2')
+        self.assertEqual([org['name'] for org in orgs], [u'Code for Oakland', u'Code for San Francisco'])
+        self.assertAlmostEqual(orgs[0]['distance'], 7.48, places=1)
+        self.assertAlmostEqual(orgs[1]['distance'], 16.6, places=0)
+
+        # Across the antimeridian, and everything with coordinates
+        orgs = near('/api/organizations/near?lat=-16&lon=-179')
+        self.assertEqual([org['name'] for org in orgs], [u'Code for Fiji', u'Code for Hawaii', u'Code for San Francisco', u'Code for Oakland'])
+
+        self.assertEqual(self.app.get('/api/organizations/near?lat=37.8').status_code, 400)
+        self.assertEqual(self.app.get('/api/organizations/near?lat=north&lon=west').status_code, 400)
+        for (lat, lon) in (('nan', '0'), ('0', 'nan'), ('inf', '0'), ('0', '-inf'), ('91', '0'), ('0', '181')):
+            self.assertEqual(self.app.get('/api/organizations/near?lat=%s&lon=%s' % (lat, lon)).status_code, 400)
+
+        # The tree is built once for each data generation
+        bump_generation(db.session)
+        db.session.commit()
+        near('/api/organizations/near?lat=0&lon=0')
+        self.assertEqual(self.count_queries('/api/organizations/near?lat=1&lon=1'), 1)
+
+    def test_sparse_fields(self):
+        '''
+        Only the fields asked for are loaded and returned
+        '''
+        organization = OrganizationFactory(name=u'Code for San Francisco')
+        db.session.flush()
+        project = ProjectFactory(organization_name=organization.name, github_details={'contributors': [u'someone'] * 100})
+        db.session.flush()
+        IssueFactory(project_id=project.id)
+        EventFactory(organization_name=organization.name)
+        project_id, project_name = project.id, project.name
+        db.session.commit()
+
+        response = json.loads(self.app.get('/api/projects?fields=name,code_url,api_url').data)
+        self.assertEqual(sorted(response['objects'][0].keys()), ['api_url', 'code_url', 'name'])
+
+        # Unrequested columns and related rows are never read
+        statements = self.record_queries('/api/projects?fields=name,code_url,api_url')
+        self.assertEqual(len(statements), 3)
+        self.assertTrue('data_generation' in statements[0])
+        self.assertTrue('count(*)' in statements[1])
+        self.assertFalse('github_details' in statements[2] or 'description' in statements[2])
+
+        response = json.loads(self.app.get('/api/projects?fields=name,issues').data)
+        self.assertEqual(sorted(response['objects'][0].keys()), ['issues', 'name'])
+        self.assertEqual(len(response['objects'][0]['issues']), 1)
+
+        response = json.loads(self.app.get('/api/organizations?fields=name,all_events').data)
+        self.assertEqual(response['objects'][0], dict(name=u'Code for San Francisco',
+                                                      all_events='http://localhost/api/organizations/Code-for-San-Francisco/events'))
+        self.assertEqual(self.count_queries('/api/organizations?fields=name,all_events'), 3)
+
+        # Links load the name they're made from along with the rest of the row
+        for number in range(4):
+            OrganizationFactory(name=u'Code for Place %d' % number)
+        db.session.commit()
+        self.assertEqual(self.count_queries('/api/organizations?fields=api_url&per_page=5'), 3)
+
+        response = json.loads(self.app.get('/api/organizations?fields=current_events').data)
+        self.assertEqual(len(response['objects'][0]['current_events']), 1)
+
+        response = json.loads(self.app.get('/api/events?fields=start_time,organization&expand=organization').data)
+        self.assertEqual(sorted(response['objects'][0].keys()), ['organization', 'start_time'])
+
+        response = json.loads(self.app.get('/api/issues?fields=title,project').data)
+        self.assertEqual(sorted(response['objects'][0].keys()), ['project', 'title'])
+
+        response = json.loads(self.app.get('/api/projects/%d?fields=name' % project_id).data)
+        self.assertEqual(response, dict(name=project_name))
+
+        # Links to other pages keep asking for the same fields
+        ProjectFactory(organization_name=u'Code for San Francisco')
+        db.session.commit()
+        response = json.loads(self.app.get('/api/projects?fields=name&per_page=1').data)
+        self.assertTrue('fields=name' in response['pages']['next'])
+        self.assertEqual(response['total'], 2)
+        response = json.loads(self.app.get('/api/projects?fields=name&per_page=1&cursor=').data)
+        self.assertTrue('fields=name' in response['pages']['next'])
+        response = json.loads(self.app.get(response['pages']['next'].replace('http://localhost', '')).data)
+        self.assertEqual(response['objects'][0].keys(), ['name'])
+
+    def test_expand_organization(self):
+        '''
+        Listings only embed organizations when asked to, with a join
+        '''
+        for number in range(4):
+            organization_name = OrganizationFactory().name
+            db.session.flush()
+            ProjectFactory(organization_name=organization_name)
+            EventFactory(organization_name=organization_name)
+            StoryFactory(organization_name=organization_name)
+        db.session.commit()
+
+        for url in ('/api/projects', '/api/events', '/api/stories'):
+            response = json.loads(self.app.get(url).data)
+            self.assertFalse('organization' in response['objects'][0])
+            self.assertTrue(response['objects'][0]['organization_name'])
+
+            response = json.loads(self.app.get(url + '?expand=organization').data)
+            for obj in response['objects']:
+                self.assertEqual(obj['organization']['name'], obj['organization_name'])
+
+            # Expanding takes no extra queries, however many objects there are
+            self.assertEqual(self.count_queries(url + '?expand=organization&per_page=1'),
+                             self.count_queries(url + '?expand=organization'))
+            self.assertEqual(self.count_queries(url + '?expand=organization'), self.count_queries(url))
+
+        response = json.loads(self.app.get('/api/stories?expand=organization&per_page=1').data)
+        self.assertTrue('expand=organization' in response['pages']['next'])
+
+        response = json.loads(self.app.get('/api/export/events.ndjson?expand=organization').data.splitlines()[0])
+        self.assertTrue('organization' in response)
+
+    def test_compact_json(self):
+        '''
+        API responses are compact JSON unless ?pretty=1 is given
+        '''
+        ProjectFactory(name=u'Compact Project')
+        db.session.commit()
+
+        compact = self.app.get('/api/projects')
+        self.assertEqual(compact.mimetype, 'application/json')
+        self.assertFalse('\n' in compact.data)
+        self.assertFalse('": ' in compact.data or ', "' in compact.data)
+
+        pretty = self.app.get('/api/projects?pretty=1')
+        self.assertTrue('\n  "objects": [' in pretty.data)
+        self.assertTrue(len(pretty.data) > len(compact.data))
+        self.assertEqual(json.loads(pretty.data)['objects'], json.loads(compact.data)['objects'])
+
+        # The pretty argument isn't treated as a filter or carried in page links
+        self.assertEqual(json.loads(self.app.get('/api/projects?pretty=true').data)['total'], 1)
+
+        response = json.loads(self.app.get('/api/projects/%d?pretty=1' % json.loads(compact.data)['objects'][0]['id']).data)
+        self.assertEqual(response['name'], u'Compact Project')
+
+    def test_msgpack(self):
+        '''
+        API responses are MessagePack when asked for, with native timestamps
+        '''
+        ProjectFactory(name=u'Packed Project', last_updated=datetime(2014, 6, 1, 12, 30, 15, 500000))
+        ProjectFactory(name=u'Other Project')
+        db.session.commit()
+
+        def ext_hook(code, data):
+            self.assertEqual(code, -1)
+            value, = struct.unpack('>Q', data)
+            return datetime.utcfromtimestamp(value & (2**34 - 1)) + timedelta(microseconds=(value >> 34) // 1000)
+
+        response = self.app.get('/api/projects?per_page=1', headers={'Accept': 'application/msgpack'})
+        self.assertEqual(response.mimetype, 'application/msgpack')
+        self.assertTrue('Accept' in response.headers['Vary'])
+
+        packed = msgpack.unpackb(response.data, raw=False, ext_hook=ext_hook)
+        unpacked = json.loads(self.app.get('/api/projects?per_page=1').data)
+        self.assertEqual(sorted(packed.keys()), sorted(unpacked.keys()))
+        self.assertEqual(packed['total'], 2)
+        self.assertEqual(sorted(packed['objects'][0].keys()), sorted(unpacked['objects'][0].keys()))
+
+        response = self.app.get('/api/projects?format=msgpack&name=Packed Project')
+        packed = msgpack.unpackb(response.data, raw=False, ext_hook=ext_hook)
+        self.assertEqual(packed['objects'][0]['name'], u'Packed Project')
+        self.assertEqual(packed['objects'][0]['last_updated'], datetime(2014, 6, 1, 12, 30, 15, 500000))
+
+        # Page links keep the format
+        response = self.app.get('/api/projects?format=msgpack&per_page=1')
+        self.assertTrue('format=msgpack' in msgpack.unpackb(response.data, raw=False, ext_hook=ext_hook)['pages']['next'])
+
+        # Browsers and ?format=json still get JSON
+        response = self.app.get('/api/projects', headers={'Accept': 'text/html,application/xhtml+xml,*/*;q=0.8'})
+        self.assertEqual(response.mimetype, 'application/json')
+        response = self.app.get('/api/projects?format=json', headers={'Accept': 'application/msgpack'})
+        self.assertEqual(response.mimetype, 'application/json')
+
+        # Formats are cached separately
+        bump_generation(db.session)
+        db.session.commit()
+
+        self.app.get('/api/projects')
+        response = self.app.get('/api/projects', headers={'Accept': 'application/msgpack'})
+        self.assertEqual(response.mimetype, 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(response.data, raw=False, ext_hook=ext_hook)['total'], 2)
+
+    def test_response_cache(self):
+        '''
+        API responses are cached per data generation and tagged with ETags
+        '''
+        ProjectFactory(name="Cached Project")
+        db.session.commit()
+
+        # Without a data generation, responses are still tagged but not cached
+        response = self.app.get('/api/projects')
+        self.assertTrue(response.headers.get('ETag'))
+        self.assertTrue(self.count_queries('/api/projects') > 1)
+
+        bump_generation(db.session)
+        db.session.commit()
+
+        response = self.app.get('/api/projects')
+        etag = response.headers['ETag']
+        self.assertEqual(response.status_code, 200)
+
+        # Cached responses only need the data generation
+        self.assertEqual(self.count_queries('/api/projects'), 1)
+
+        cached = self.app.get('/api/projects')
+        self.assertEqual(cached.data, response.data)
+        self.assertEqual(cached.headers['ETag'], etag)
+        self.assertEqual(cached.headers['Access-Control-Allow-Origin'], '*')
+
+        # Matching ETags get an empty 304
+        response = self.app.get('/api/projects', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, '')
+
+        # Different content gets a different ETag
+        response = self.app.get('/api/projects?name=Missing', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+
+        # New data shows up once the generation moves on
+        ProjectFactory(name="Another Project")
+        db.session.commit()
+        self.assertEqual(json.loads(self.app.get('/api/projects').data)['total'], 1)
+
+        bump_generation(db.session)
+        db.session.commit()
+
+        response = self.app.get('/api/projects', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertEqual(json.loads(response.data)['total'], 2)
+
+    def test_compression(self):
+        '''
+        Responses are compressed for clients that accept it
+        '''
+        for number in range(5):
+            ProjectFactory(name=u'Compressed Project %d' % number)
+        db.session.commit()
+
+        plain = self.app.get('/api/projects')
+        self.assertFalse('Content-Encoding' in plain.headers)
+        self.assertTrue('Accept-Encoding' in plain.headers['Vary'])
+
+        response = self.app.get('/api/projects', headers={'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(response.headers['ETag'], plain.headers['ETag'][:-1] + '-gzip"')
+        self.assertEqual(gzip.GzipFile(fileobj=StringIO(response.data)).read(), plain.data)
+        self.assertTrue(len(response.data) < len(plain.data))
+
+        response = self.app.get('/api/projects', headers={'Accept-Encoding': 'deflate'})
+        self.assertEqual(response.headers['Content-Encoding'], 'deflate')
+        self.assertEqual(zlib.decompress(response.data), plain.data)
+
+        # Small responses aren't worth compressing
+        response = self.app.get('/api/projects?name=Missing', headers={'Accept-Encoding': 'gzip'})
+        self.assertFalse('Content-Encoding' in response.headers)
+
+        # ETags match per encoding
+        etag = self.app.get('/api/projects', headers={'Accept-Encoding': 'gzip'}).headers['ETag']
+        response = self.app.get('/api/projects', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        response = self.app.get('/api/projects', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+
+        # Cached responses keep their compressed bodies
+        bump_generation(db.session)
+        db.session.commit()
+
+        first = self.app.get('/api/projects', headers={'Accept-Encoding': 'gzip'})
+        cached = response_cache['responses'][('json', 'http://localhost/api/projects')]
+        self.assertEqual(cached['encoded'].keys(), ['gzip'])
+
+        second = self.app.get('/api/projects', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second.headers['Content-Encoding'], 'gzip')
+
+        # Pages outside the API are compressed too
+        response = self.app.get('/api/', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+
+    def test_search(self):
+        '''
+        Search projects, issues, stories and events by their text
+        '''
+        project = ProjectFactory(name=u'Open Budget Explorer', description=u'Explore the city budget')
+        ProjectFactory(name=u'Park Finder', description=u'Find parks near you')
+        db.session.flush()
+        IssueFactory(title=u'Budget charts are slow', body=u'Rendering takes forever', project_id=project.id)
+        StoryFactory(title=u'Budgets in the open')
+        EventFactory(name=u'Hack Night', description=u'Working on the budget explorer')
+        db.session.flush()
+        rebuild_search_index(db.session)
+        db.session.commit()
+
+        response = self.app.get('/api/search?q=budget')
+        self.assertEqual(response.status_code, 200)
+        response = json.loads(response.data)
+        self.assertEqual(response['total'], 4)
+        self.assertEqual(sorted([result['type'] for result in response['objects']]), ['event', 'issue', 'project', 'story'])
+
+        # Every word has to match, and the best matches come first
+        response = json.loads(self.app.get('/api/search?q=budget+explorer').data)
+        self.assertEqual(response['total'], 2)
+        self.assertEqual(response['objects'][0]['object']['name'], u'Open Budget Explorer')
+        self.assertEqual(response['objects'][0]['object']['issues'][0]['title'], u'Budget charts are slow')
+        self.assertEqual(response['objects'][1]['type'], 'event')
+
+        response = json.loads(self.app.get('/api/search?q=budget&per_page=1').data)
+        self.assertEqual(len(response['objects']), 1)
+        self.assertTrue('q=budget' in response['pages']['next'])
+
+        self.assertEqual(self.app.get('/api/search').status_code, 400)
+
+    def test_search_index(self):
+        '''
+        Search documents follow their objects, and use the full-text index
+        '''
+        project = ProjectFactory(name=u'Open Budget Explorer')
+        db.session.flush()
+        index_search_document(db.session, project)
+        db.session.commit()
+
+        project = db.session.query(Project).first()
+        project.name = u'Tree Census'
+        index_search_document(db.session, project)
+        db.session.commit()
+
+        self.assertEqual(db.session.query(SearchDocument).count(), 1)
+        self.assertEqual(json.loads(self.app.get('/api/search?q=budget').data)['total'], 0)
+        self.assertEqual(json.loads(self.app.get('/api/search?q=trees').data)['total'], 1)
+
+        db.session.query(Project).delete()
+        db.session.commit()
+        self.assertEqual(db.session.query(SearchDocument).count(), 0)
+
+        db.session.execute('SET enable_seqscan = off')
+        plan = db.session.execute('EXPLAIN ' + str(search_query(u'budget').statement.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True})))
+        self.assertTrue('search_document_text' in ' '.join([row[0] for row in plan]))
+
+    def test_estimated_total(self):
+        '''
+        Unfiltered totals can come from table statistics
+        '''
+        ProjectFactory(name="Analyzed Project")
+        ProjectFactory(name="Analyzed Project")
+        db.session.commit()
+        db.session.execute('ANALYZE project')
+        db.session.commit()
+
+        # Statistics don't know about projects added after ANALYZE
+        ProjectFactory(name="New Project")
+        db.session.commit()
+
+        response = json.loads(self.app.get('/api/projects?total=estimate').data)
+        self.assertEqual(response['total'], 2)
+
+        response = json.loads(self.app.get('/api/projects').data)
+        self.assertEqual(response['total'], 3)
+
+        # Filtered totals are always exact
+        response = json.loads(self.app.get('/api/projects?total=estimate&name=New').data)
+        self.assertEqual(response['total'], 1)
+
     def test_good_orgs_projects(self):
         organization = OrganizationFactory(name="Code for America")
         project = ProjectFactory(organization_name="Code for America")
@@ -275,7 +1073,7 @@ class ApiTest(unittest.TestCase):
         StoryFactory()
         db.session.flush()
 
-        response = self.app.get('/api/stories')
+        response = self.app.get('/api/stories?expand=organization')
         response = json.loads(response.data)
         assert isinstance(response, dict)
         assert isinstance(response['pages'], dict)
@@ -305,7 +1103,7 @@ class ApiTest(unittest.TestCase):
         EventFactory()
         db.session.flush()
 
-        response = self.app.get('/api/events')
+        response = self.app.get('/api/events?expand=organization')
         response = json.loads(response.data)
         assert isinstance(response, dict)
         assert isinstance(response['pages'], dict)
@@ -525,6 +1323,39 @@ class ApiTest(unittest.TestCase):
         self.assertTrue('project' in response)
         self.assertTrue('issues' not in response['project'])
 
+    def test_issues_query_count(self):
+        '''
+        Listing issues does not load the sibling issues of their projects
+        '''
+        organization_name = OrganizationFactory().name
+        db.session.flush()
+        project = ProjectFactory(organization_name=organization_name)
+        db.session.flush()
+        issue = IssueFactory(project_id=project.id)
+        db.session.flush()
+        issue.labels = [LabelFactory()]
+        db.session.commit()
+
+        one_issue = self.count_queries('/api/issues')
+
+        for _ in range(3):
+            project = ProjectFactory(organization_name=organization_name)
+            db.session.flush()
+            for _ in range(3):
+                issue = IssueFactory(project_id=project.id)
+                db.session.flush()
+                issue.labels = [LabelFactory()]
+        db.session.commit()
+
+        self.assertEqual(self.count_queries('/api/issues'), one_issue)
+
+        response = self.app.get('/api/issues')
+        response = json.loads(response.data)
+        self.assertEqual(len(response['objects']), 10)
+        for issue in response['objects']:
+            self.assertFalse('issues' in issue['project'])
+            self.assertEqual(len(issue['labels']), 1)
+
     def test_issues_with_labels(self):
         '''
         Test that /api/issues/labels works as expected.
@@ -554,6 +1385,48 @@ class ApiTest(unittest.TestCase):
         response = json.loads(response.data)
         self.assertEqual(response['total'], 0)
 
+    def test_issues_label_matching(self):
+        '''
+        Labels match by prefix, ignoring case, and all or any of them can be required
+        '''
+        organization = OrganizationFactory(name=u'Code for San Francisco')
+        project = ProjectFactory(organization_name=organization.name)
+        db.session.flush()
+
+        issue = IssueFactory(project_id=project.id)
+        issue.labels = [LabelFactory(name=u'Help Wanted'), LabelFactory(name=u'bug')]
+        issue = IssueFactory(project_id=project.id)
+        issue.labels = [LabelFactory(name=u'help wanted'), LabelFactory(name=u'enhancement')]
+        issue = IssueFactory(project_id=project.id)
+        issue.labels = [LabelFactory(name=u'100%_done')]
+        db.session.commit()
+
+        def total(url):
+            return json.loads(self.app.get(url).data)['total']
+
+        self.assertEqual(total('/api/issues/labels/help wanted'), 2)
+        self.assertEqual(total('/api/issues/labels/HELP'), 2)
+        self.assertEqual(total('/api/issues/labels/help wanted,bug'), 1)
+        self.assertEqual(total('/api/issues/labels/help wanted,bug?match=all'), 1)
+        self.assertEqual(total('/api/issues/labels/bug,enhancement'), 0)
+        self.assertEqual(total('/api/issues/labels/bug,enhancement?match=any'), 2)
+        self.assertEqual(total('/api/issues/labels/wanted'), 0)
+        self.assertEqual(total('/api/issues/labels/100%_'), 1)
+        self.assertEqual(total('/api/issues/labels/100_'), 0)
+        self.assertEqual(total('/api/organizations/Code-for-San-Francisco/issues/labels/bug,enhancement?match=any'), 2)
+        self.assertEqual(total('/api/organizations/Code-for-San-Francisco/issues/labels/help,bug'), 1)
+
+        response = json.loads(self.app.get('/api/issues/labels/bug,enhancement?match=any&per_page=1').data)
+        self.assertTrue('match=any' in response['pages']['next'])
+
+        self.assertEqual(self.app.get('/api/issues/labels/bug?match=some').status_code, 400)
+
+        # Label names are matched through their index
+        db.session.execute('SET enable_seqscan = off')
+        query = issues_with_labels(db.session.query(Issue), u'help,bug', 'all')
+        plan = db.session.execute('EXPLAIN ' + str(query.statement.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True})))
+        self.assertTrue('label_normalized_name' in ' '.join([row[0] for row in plan]))
+
     def test_organization_query_filter(self):
         '''
         Test that organization query params work as expected.
@@ -622,6 +1495,159 @@ class ApiTest(unittest.TestCase):
         response = json.loads(response.data)
         self.assertEqual(response['total'], 1)
 
+    def test_github_details(self):
+        '''
+        Github details are stored as JSONB, filterable, and only decoded when used
+        '''
+        ProjectFactory(name=u'Python Project', github_details={'language': 'Python', 'owner': {'login': 'someone'}})
+        ProjectFactory(name=u'Ruby Project', github_details={'language': 'Ruby'})
+        ProjectFactory(name=u'Empty Project', github_details=None)
+        db.session.commit()
+
+        column_type = db.session.execute("SELECT data_type FROM information_schema.columns "
+                                         "WHERE table_name = 'project' AND column_name = 'github_details'").scalar()
+        self.assertEqual(column_type, 'jsonb')
+
+        response = json.loads(self.app.get('/api/projects?github_details.language=python').data)
+        self.assertEqual(response['total'], 1)
+        self.assertEqual(response['objects'][0]['name'], u'Python Project')
+        self.assertEqual(response['objects'][0]['github_details']['owner'], {'login': 'someone'})
+
+        response = json.loads(self.app.get('/api/projects?github_details.language=Go').data)
+        self.assertEqual(response['total'], 0)
+
+        db.session.expunge_all()
+        project = db.session.query(Project).filter(Project.name == u'Python Project').first()
+        self.assertFalse('github_details' in project.__dict__)
+        self.assertEqual(project.github_details['language'], 'Python')
+        self.assertEqual(db.session.query(Project).filter(Project.name == u'Empty Project').first().github_details, None)
+
+    def test_github_columns(self):
+        '''
+        Projects can be filtered and sorted on columns copied from their Github details
+        '''
+        ProjectFactory(name=u'Popular Project', language=u'Python', watchers_count=120, forks_count=30,
+                       open_issues=5, pushed_at=datetime(2014, 6, 1))
+        ProjectFactory(name=u'Quiet Project', language=u'Ruby', watchers_count=3, forks_count=0,
+                       open_issues=1, pushed_at=datetime(2013, 1, 1))
+        ProjectFactory(name=u'Middling Project', language=u'Python', watchers_count=40, forks_count=8,
+                       open_issues=12, pushed_at=datetime(2014, 2, 1))
+        ProjectFactory(name=u'Offline Project')
+        db.session.commit()
+
+        def names(url):
+            return [project['name'] for project in json.loads(self.app.get(url).data)['objects']]
+
+        self.assertEqual(sorted(names('/api/projects?language=Python')), [u'Middling Project', u'Popular Project'])
+        self.assertEqual(names('/api/projects?language=Pyth'), [])
+        self.assertEqual(names('/api/projects?watchers_count__gt=10&open_issues__lt=10'), [u'Popular Project'])
+        self.assertEqual(sorted(names('/api/projects?pushed_at__gt=2014-01-01')), [u'Middling Project', u'Popular Project'])
+
+        self.assertEqual(names('/api/projects?sort=pushed_at&language=Python'), [u'Middling Project', u'Popular Project'])
+
+        # Projects without a value come last going up or down, and still count
+        self.assertEqual(names('/api/projects?sort=-watchers_count'), [u'Popular Project', u'Middling Project', u'Quiet Project', u'Offline Project'])
+        self.assertEqual(names('/api/projects?sort=watchers_count'), [u'Quiet Project', u'Middling Project', u'Popular Project', u'Offline Project'])
+        self.assertEqual(json.loads(self.app.get('/api/projects?sort=-watchers_count').data)['total'], 4)
+
+        # Promoted columns stay out of responses, which already hold github_details
+        response = json.loads(self.app.get('/api/projects?language=Ruby').data)
+        self.assertFalse('watchers_count' in response['objects'][0])
+
+        # Sorted pages link to sorted pages, with cursors too
+        response = json.loads(self.app.get('/api/projects?sort=-watchers_count&per_page=2').data)
+        self.assertTrue('sort=-watchers_count' in response['pages']['next'])
+        def follow(link):
+            return json.loads(self.app.get(urlparse(link).path + '?' + urlparse(link).query).data)
+
+        for sort in ('-watchers_count', 'watchers_count'):
+            first = json.loads(self.app.get('/api/projects?sort=%s&per_page=3&cursor=' % sort).data)
+            second = follow(first['pages']['next'])
+            self.assertEqual([project['name'] for project in second['objects']], [u'Offline Project'])
+            self.assertFalse('next' in second['pages'])
+
+            # Going back from the project without a value finds the others again
+            back = follow(second['pages']['prev'])
+            self.assertEqual([project['name'] for project in back['objects']], [project['name'] for project in first['objects']])
+
+        # Bad arguments are rejected
+        self.assertEqual(self.app.get('/api/projects?sort=name').status_code, 400)
+        self.assertEqual(self.app.get('/api/projects?watchers_count__gt=lots').status_code, 400)
+        self.assertEqual(self.app.get('/api/projects?watchers_count__near=5').status_code, 400)
+
+    def test_filter_operators(self):
+        '''
+        Filters take operators as suffixes, and only whitelisted attributes
+        '''
+        boston = OrganizationFactory(name=u'Code for Boston', type=u'Brigade')
+        OrganizationFactory(name=u'Code for Boston Harbor', type=u'Brigade')
+        OrganizationFactory(name=u'Open Boston', type=u'Government')
+        db.session.flush()
+        project = ProjectFactory(name=u'100% Civic', organization_name=boston.name, github_details={'language': 'Python'})
+        ProjectFactory(name=u'Boston Budget', organization_name=u'Open Boston')
+        db.session.flush()
+        db.session.add(Issue(u'Fix it', project_id=project.id))
+        EventFactory(name=u'Hack Night', organization_name=boston.name)
+        EventFactory(name=u'Harbor Hack Night', organization_name=u'Code for Boston Harbor')
+        StoryFactory(title=u'Boston Budget launched', organization_name=u'Open Boston')
+        project_id = project.id
+        db.session.commit()
+
+        def names(url, key='name'):
+            return sorted([obj[key] for obj in json.loads(self.app.get(url).data)['objects']])
+
+        # Plain text filters still match substrings, ignoring case
+        self.assertEqual(names('/api/events?organization_name=code for boston'), [u'Hack Night', u'Harbor Hack Night'])
+
+        self.assertEqual(names('/api/events?organization_name__eq=Code for Boston'), [u'Hack Night'])
+        self.assertEqual(names('/api/organizations?name__prefix=code for'), [u'Code for Boston', u'Code for Boston Harbor'])
+        self.assertEqual(names('/api/organizations?name__in=Open Boston,Code for Boston'), [u'Code for Boston', u'Open Boston'])
+        self.assertEqual(names('/api/organizations?type__eq=Brigade&name__contains=harbor'), [u'Code for Boston Harbor'])
+        self.assertEqual(names('/api/projects?organization_type__eq=Government'), [u'Boston Budget'])
+        self.assertEqual(names('/api/projects?github_details.language__eq=Python'), [u'100% Civic'])
+        self.assertEqual(names('/api/stories?organization_name__prefix=Open', 'title'), [u'Boston Budget launched'])
+        self.assertEqual(names('/api/issues?project_id__in=%d,0' % project_id, 'title'), [u'Fix it'])
+        self.assertEqual(names('/api/issues?project_name__prefix=100', 'title'), [u'Fix it'])
+
+        # Wildcards match literally
+        self.assertEqual(names('/api/projects?name=100%'), [u'100% Civic'])
+        self.assertEqual(names('/api/projects?name=0_'), [])
+
+        # Exact matches don't need a pattern
+        statements = self.record_queries('/api/events?organization_name__eq=Code for Boston')
+        self.assertFalse([statement for statement in statements if 'ILIKE' in statement.upper()])
+
+        # Unknown attributes and operators, and bad values, are refused
+        self.assertEqual(self.app.get('/api/projects?keep=true').status_code, 400)
+        self.assertEqual(self.app.get('/api/organizations?__class__=x').status_code, 400)
+        self.assertEqual(self.app.get('/api/events?name__like=x').status_code, 400)
+        self.assertEqual(self.app.get('/api/issues?project_id__prefix=1').status_code, 400)
+        self.assertEqual(self.app.get('/api/issues?project_id__gt=one').status_code, 400)
+
+    def test_trigram_indexes(self):
+        '''
+        Substring filters keep their meaning and can use trigram indexes
+        '''
+        project = ProjectFactory(name=u'Housing Finder', description=u'Affordable HOUSING near you')
+        ProjectFactory(name=u'Park Finder', description=u'Find parks near you')
+        db.session.flush()
+        db.session.add(Issue(u'Housing map is slow', project_id=project.id))
+        db.session.commit()
+
+        response = json.loads(self.app.get('/api/projects?description=housing').data)
+        self.assertEqual([project['name'] for project in response['objects']], [u'Housing Finder'])
+
+        response = json.loads(self.app.get('/api/issues?title=MAP IS').data)
+        self.assertEqual(response['total'], 1)
+
+        # With sequential scans off, the planner shows which index it would pick
+        for (table, column, value) in (('project', 'description', '%housing%'), ('issue', 'title', '%map is%'),
+                                       ('event', 'location', '%city hall%')):
+            db.session.execute('SET LOCAL enable_seqscan = off')
+            plan = db.session.execute('EXPLAIN SELECT id FROM %s WHERE %s ILIKE :value' % (table, column), dict(value=value))
+            self.assertTrue('%s_%s_trgm' % (table, column) in '\n'.join([row[0] for row in plan]))
+            db.session.rollback()
+
     def test_organization_issues(self):
         '''
         Test getting all of an organization's issues
@@ -817,5 +1843,129 @@ class ApiTest(unittest.TestCase):
         self.assertEqual(response['total'], 1)
         self.assertEqual(response['objects'][0]['title'], "Awesome issue")
 
+class QueryPlanTest(unittest.TestCase):
+    ''' Check that hot queries use indexes on a large dataset.
+    '''
+    # Tables big enough in production that a sequential scan is a regression.
+    TABLES = ('organization', 'project', 'issue', 'label', 'event', 'story')
+
+    @classmethod
+    def setUpClass(cls):
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'postgres://postgres@localhost/civic_json_worker_test'
+        db.create_all()
+
+        db.session.execute('''INSERT INTO organization (id, name, slug, type, keep)
+                              SELECT n, 'Code for ' || n, 'Code-for-' || n, 'Brigade', true FROM generate_series(1, 1000) AS n''')
+        db.session.execute('''INSERT INTO project (name, code_url, organization_id, last_updated, keep)
+                              SELECT 'Project ' || n, 'https://github.com/codeforamerica/project-' || n, n % 1000 + 1,
+                                     timestamp '2014-01-01' + n * interval '1 hour', true
+                              FROM generate_series(1, 10000) AS n''')
+        db.session.execute('''INSERT INTO issue (title, project_id, keep)
+                              SELECT 'Issue ' || n, n % 10000 + 1, true FROM generate_series(1, 50000) AS n''')
+        db.session.execute('''INSERT INTO label (name, normalized_name, issue_id)
+                              SELECT 'Label ' || (n % 1000), 'label ' || (n % 1000), n FROM generate_series(1, 50000) AS n''')
+        db.session.execute('''INSERT INTO event (name, event_url, organization_id, start_time_notz, utc_offset, keep)
+                              SELECT 'Event ' || n, 'http://www.meetup.com/events/' || n, n % 1000 + 1,
+                                     timestamp '2010-01-01' + n * interval '6 hours', 0, true
+                              FROM generate_series(1, 20000) AS n''')
+        db.session.execute('''INSERT INTO story (title, link, organization_id, keep)
+                              SELECT 'Story ' || n, 'http://www.codeforamerica.org/blog/' || n, n % 1000 + 1, true
+                              FROM generate_series(1, 10000) AS n''')
+        db.session.commit()
+
+        # Sample every row, so that plans don't change from run to run
+        db.session.execute('SET LOCAL default_statistics_target = 1000')
+        for table in cls.TABLES:
+            db.session.execute('ANALYZE %s' % table)
+        db.session.commit()
+
+    @classmethod
+    def tearDownClass(cls):
+        db.session.close()
+        db.drop_all()
+
+    def setUp(self):
+        self.app = app.test_client()
+
+    def tearDown(self):
+        db.session.close()
+
+    def record_statements(self, function):
+        ''' Return the SQL statements and parameters run by a function.
+        '''
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().upper().startswith('SELECT'):
+                statements.append((statement, parameters))
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            function()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+
+        self.assertTrue(statements)
+        return statements
+
+    def assertNoSeqScans(self, statements, label):
+        ''' Fail if any statement's plan reads a whole big table.
+
+            Unfiltered scans feeding straight into a limit only read one page.
+        '''
+        def scans(node, parent=None):
+            if node['Node Type'] == 'Seq Scan' and node['Relation Name'] in self.TABLES:
+                if not (parent and parent['Node Type'] == 'Limit' and 'Filter' not in node):
+                    yield node['Relation Name']
+
+            for child in node.get('Plans', []):
+                for table in scans(child, node):
+                    yield table
+
+        connection = db.engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            for (statement, parameters) in statements:
+                cursor.execute('EXPLAIN (FORMAT JSON) ' + statement, parameters)
+                plan = cursor.fetchone()[0]
+                plan = json.loads(plan) if isinstance(plan, basestring) else plan
+                tables = list(scans(plan[0]['Plan']))
+                self.assertFalse(tables, '%s scans %s:\n%s\n%s' % (label, ', '.join(tables), statement, json.dumps(plan, indent=2)))
+        finally:
+            connection.close()
+
+    def test_endpoint_plans(self):
+        '''
+        Listings and lookups find their rows through indexes
+        '''
+        for url in ('/api/organizations/Code-for-7', '/api/organizations/Code-for-7/projects',
+                    '/api/organizations/Code-for-7/events', '/api/organizations/Code-for-7/upcoming_events',
+                    '/api/organizations/Code-for-7/past_events', '/api/organizations/Code-for-7/stories',
+                    '/api/organizations/Code-for-7/issues', '/api/organizations/Code-for-7/issues/labels/label 777',
+                    '/api/projects?total=estimate', '/api/projects?cursor=', '/api/projects/7',
+                    '/api/projects?organization_name__eq=Code for 7', '/api/projects?sort=-watchers_count&cursor=',
+                    '/api/issues?total=estimate', '/api/issues?cursor=', '/api/issues/7', '/api/issues?project_id=7',
+                    '/api/issues/labels/label 777', '/api/issues/labels/label 777,label 778?match=any',
+                    '/api/events?total=estimate', '/api/events?cursor=', '/api/events/7', '/api/events/upcoming_events',
+                    '/api/stories?total=estimate', '/api/stories?cursor=', '/api/stories/7'):
+            statements = self.record_statements(lambda: self.assertEqual(self.app.get(url).status_code, 200))
+            self.assertNoSeqScans(statements, url)
+
+    def test_update_plans(self):
+        '''
+        Lookups made by run_update find their rows through indexes
+        '''
+        lookups = (
+            ('project code_url', lambda: Project.query.filter(Project.code_url == u'https://github.com/codeforamerica/project-7').first()),
+            ('project name', lambda: Project.query.join(Project.organization).filter(Project.name == u'Project 7', Organization.name == u'Code for 8').first()),
+            ('organization projects', lambda: Project.query.join(Project.organization).filter(Organization.name == u'Code for 8').all()),
+            ('issue title', lambda: Issue.query.filter(Issue.title == u'Issue 7', Issue.project_id == 8).first()),
+            ('event url', lambda: Event.query.join(Event.organization).filter(Event.event_url == u'http://www.meetup.com/events/7', Organization.name == u'Code for 8').first()),
+            ('story link', lambda: Story.query.join(Story.organization).filter(Organization.name == u'Code for 8', Story.link == u'http://www.codeforamerica.org/blog/7').first())
+            )
+
+        for (label, lookup) in lookups:
+            self.assertNoSeqScans(self.record_statements(lookup), label)
+
 if __name__ == '__main__':
     unittest.main()